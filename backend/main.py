@@ -1,14 +1,21 @@
 # main.py - FastAPI backend for JewelUX multimodal retrieval system.
 import os
 import sys
+import random
 import base64
+import json
+import hashlib
+import hmac
+import functools
+import asyncio
 import numpy as np
-import pandas as pd
 import faiss
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from PIL import Image
 import io
 
@@ -17,8 +24,21 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from utils.embedder import CLIPEngine
 from utils.ocr import OCRManager
-from utils.hybrid import HybridSearcher
 from utils.reranker import Reranker
+from utils import index_factory
+from utils.batcher import MicroBatcher
+from utils.stages import StageExecutor
+from utils import thumbnails
+from utils.cache import LRUCache, normalize_text
+from utils.registry import ResourceRegistry, ResourceUnavailable
+from utils.snapshots import SnapshotManager, list_snapshots
+from utils.metrics import MetricsRegistry, merge_expositions
+from utils.query_cleaner import LLMQueryCleaner, detect_category
+from utils.pagination import SearchWindow, encode_cursor, decode_cursor
+from utils.landing import FALLBACK_TAGS, featured_item
+from utils import tracing
+from utils import prefork
+from utils.tracing import span
 
 app = FastAPI(title="JewelUX API")
 
@@ -29,95 +49,387 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read the pagination cursor and the stage timings
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+# Per-request tracing: every request gets a Trace whose spans (embed, ann, bm25, rerank, format, ...)
+# feed the /metrics histograms and a Server-Timing header. TRACE_LOG=slow|all|off prints the
+# span breakdown as one JSON line; PROFILE_SAMPLE_RATE runs that share of requests' blocking
+# stages under cProfile and dumps the ones slower than SLOW_REQUEST_MS into PROFILE_DIR.
+TRACE_LOG = os.getenv("TRACE_LOG", "slow").lower()
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram("jewelux_request_duration_seconds", "Request latency by endpoint.",
+                                    ("endpoint", "method", "status"))
+stage_seconds = metrics.histogram("jewelux_stage_duration_seconds",
+                                  "Time per pipeline stage; <stage>.queue is the wait for a stage slot.", ("stage",))
+slow_requests = metrics.counter("jewelux_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("endpoint",))
+tracing.add_observer(lambda stage, seconds: stage_seconds.observe(seconds, stage))
+
+def route_template(request):
+    """Route path (e.g. /images/{item_id}) so metrics labels don't grow with every id."""
+    for route in app.router.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            return route.path
+    return "unmatched"
+
+# For streamed (NDJSON) responses the request latency ends at the first byte; their
+# per-chunk stages still land in the stage histograms.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    endpoint = route_template(request)
+    trace = tracing.start_trace(endpoint, profile=random.random() < PROFILE_SAMPLE_RATE)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        timing = trace.server_timing()
+        if timing:
+            response.headers["Server-Timing"] = timing
+        return response
+    finally:
+        elapsed = trace.elapsed()
+        request_seconds.observe(elapsed, endpoint, request.method, str(status))
+        slow = elapsed * 1000 >= SLOW_REQUEST_MS
+        if slow:
+            slow_requests.inc(endpoint)
+        if TRACE_LOG == "all" or (TRACE_LOG == "slow" and slow):
+            print(json.dumps({"trace": trace.to_dict(status)}))
+        if trace.profile and slow:
+            path = trace.dump_profile(PROFILE_DIR)
+            if path:
+                print(f"Slow request profile written to {path}")
+
 # Global variables for resources
 engine = None
 ocr = None
 reranker = None
-index_std = None
-index_sbir = None
-metadata = None
-vectors = None
-hybrid_searcher = None
+text_batcher = None
+image_batcher = None
+
+# Micro-batching of CLIP forward passes across concurrent requests
+BATCH_MAX_SIZE = int(os.getenv("CLIP_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("CLIP_BATCH_MAX_WAIT_MS", "5"))
+
+# Inference backend: "torch" (default) or "onnx" (CPU ONNX Runtime, see scripts/export_onnx.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+ONNX_OPTIONS = {
+    "onnx_dir": os.getenv("ONNX_MODEL_DIR", "models/onnx"),
+    "quantized": os.getenv("ONNX_QUANTIZED", "1") != "0",
+    "threads": int(os.getenv("ONNX_THREADS", "0")) or None,
+}
+
+def backend_options():
+    return {"backend": INFERENCE_BACKEND, **ONNX_OPTIONS} if INFERENCE_BACKEND == "onnx" else {}
+
+# Blocking stages (OCR, FAISS + ranking, image decode, formatting) run on this pool,
+# never on the event loop. Per-stage limits keep slow stages from hogging every thread.
+stages = StageExecutor(
+    max_workers=int(os.getenv("STAGE_POOL_WORKERS", "8")),
+    limits={
+        "ocr": int(os.getenv("STAGE_LIMIT_OCR", "2")),
+        "search": int(os.getenv("STAGE_LIMIT_SEARCH", "4")),
+        "decode": int(os.getenv("STAGE_LIMIT_DECODE", "4")),
+        "format": int(os.getenv("STAGE_LIMIT_FORMAT", "4")),
+        # Local (difflib) query cleaning when the LLM can't answer
+        "clean": int(os.getenv("STAGE_LIMIT_CLEAN", "2")),
+        # Bulk batch requests get few slots so they can't crowd out interactive searches
+        "batch": int(os.getenv("STAGE_LIMIT_BATCH", "1")),
+    },
+)
+
+# Handwriting query cleaning: async LLM call with a strict timeout, a concurrency limit, a rate
+# limit/daily budget and a cache; the local fuzzy cleaner answers whenever the LLM can't.
+query_cleaner = LLMQueryCleaner(
+    api_key=os.getenv("LLM_API_KEY"),
+    base_url=os.getenv("LLM_BASE_URL"),
+    model=os.getenv("LLM_MODEL", "gpt-4.1-nano"),
+    timeout=float(os.getenv("LLM_TIMEOUT", "4")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+    rate_per_minute=float(os.getenv("LLM_RATE_PER_MINUTE", "60")),
+    burst=int(os.getenv("LLM_BURST", "10")),
+    daily_budget=int(os.getenv("LLM_DAILY_BUDGET", "0")),
+    cache_size=int(os.getenv("LLM_CACHE_SIZE", "2048")),
+    cache_ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    cooldown=float(os.getenv("LLM_COOLDOWN", "30")),
+)
+if query_cleaner.client is None:
+    print("❌ WARNING: LLM_API_KEY not found in .env file; handwriting queries use the local cleaner")
+
+# /search/batch/*: queries per embed + search + rank round (one NDJSON flush each), and per request
+BATCH_SEARCH_CHUNK = int(os.getenv("BATCH_SEARCH_CHUNK", "64"))
+BATCH_SEARCH_MAX_QUERIES = int(os.getenv("BATCH_SEARCH_MAX_QUERIES", "10000"))
+
+# Layered caches: text embeddings live in CLIPEngine; uploads are keyed by content hash;
+# ranked candidate windows are keyed by normalized query + options + index version.
+image_embedding_cache = LRUCache("image_embedding", maxsize=int(os.getenv("IMAGE_EMBED_CACHE_SIZE", "512")))
+results_cache = LRUCache("results", maxsize=int(os.getenv("RESULT_CACHE_SIZE", "2048")),
+                         ttl=float(os.getenv("RESULT_CACHE_TTL", "600")))
+
+# /search/featured streams this many items per chunk
+FEATURED_CHUNK = int(os.getenv("FEATURED_CHUNK", "256"))
+
+# Pagination: the first page ranks a window of PAGE_WINDOW candidates (or top_k, if larger) and
+# keeps it, keyed by an opaque cursor (X-Next-Cursor), for CURSOR_TTL seconds after last use.
+# POST /search/next serves later pages from it; the ANN search only widens (doubling, up to
+# PAGE_MAX_CANDIDATES) when a page runs past the window.
+PAGE_WINDOW = int(os.getenv("PAGE_WINDOW", "50"))
+PAGE_MAX_CANDIDATES = int(os.getenv("PAGE_MAX_CANDIDATES", "1000"))
+search_windows = LRUCache("search_windows", maxsize=int(os.getenv("CURSOR_CACHE_SIZE", "1000")),
+                          ttl=float(os.getenv("CURSOR_TTL", "300")))
+
+def on_snapshot_swap(old, new):
+    # Cached rankings and open cursors refer to the old build's row ids (and would keep it alive)
+    results_cache.clear()
+    search_windows.clear()
+    # Featured items, tags and the spelling vocabulary are precomputed per build; do it now
+    # rather than on the first request that needs them
+    new.landing()
+    new.query_cleaner()
+
+# Indices + catalog of the active build (snapshots/CURRENT, or the legacy embeddings/ + metadata/ files).
+# Handlers take `snapshots.active` once per request, so a reload never changes data under them.
+snapshots = SnapshotManager(os.getenv("SNAPSHOT_ROOT", "snapshots"), on_swap=on_snapshot_swap)
+SNAPSHOT_WATCH_INTERVAL = float(os.getenv("SNAPSHOT_WATCH_INTERVAL", "0"))
+# Without ADMIN_TOKEN, the /admin endpoints only answer requests from this machine
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+# Models, indices and the catalog load concurrently in the background; /ready reports
+# progress. TrOCR is only needed by /search/handwriting, so it loads on first use.
+registry = ResourceRegistry(max_workers=int(os.getenv("STARTUP_WORKERS", "4")))
+RESOURCE_WAIT_TIMEOUT = float(os.getenv("RESOURCE_WAIT_TIMEOUT", "120"))
+def load_clip():
+    global engine, text_batcher, image_batcher
+    engine = CLIPEngine(text_cache_size=int(os.getenv("TEXT_EMBED_CACHE_SIZE", "4096")), **backend_options())
+    # Separate queues so short text passes never wait behind image batches
+    text_batcher = MicroBatcher("text", engine.encode_texts,
+                                max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+    image_batcher = MicroBatcher("image", engine.get_pil_image_embeddings,
+                                 max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+    return engine
+
+def load_ocr():
+    global ocr
+    manager = OCRManager(
+        text_height=int(os.getenv("OCR_TEXT_HEIGHT", "32")),
+        max_side=int(os.getenv("OCR_MAX_SIDE", "1600")),
+        segment_lines=os.getenv("OCR_SEGMENT_LINES", "1") != "0",
+        max_lines=int(os.getenv("OCR_MAX_LINES", "8")),
+        num_beams=int(os.getenv("OCR_NUM_BEAMS", "1")),
+        max_new_tokens=int(os.getenv("OCR_MAX_NEW_TOKENS", "32")),
+    )
+    manager.load_model()
+    if manager.model is None:
+        raise RuntimeError("TrOCR model failed to load")
+    ocr = manager
+    return ocr
+
+def load_reranker():
+    global reranker
+    model = Reranker(cache_size=int(os.getenv("RERANK_CACHE_SIZE", "50000")),
+                     max_batch_size=int(os.getenv("RERANK_BATCH_MAX_SIZE", "256")),
+                     max_wait_ms=float(os.getenv("RERANK_BATCH_MAX_WAIT_MS", "3")),
+                     **backend_options())
+    reranker = model
+    # Loads independently of the snapshot; link it to the active (and every future) one
+    snapshots.attach_reranker(reranker)
+    # Rankings cached before the reranker arrived are hybrid-only
+    results_cache.clear()
+    return reranker
+
+def load_snapshot():
+    snapshots.reload()
+    snapshots.watch(SNAPSHOT_WATCH_INTERVAL)
+    # The manager, not the Snapshot: holding the latter here would keep it alive after a swap
+    return snapshots
+
+registry.register("clip", load_clip)
+registry.register("snapshot", load_snapshot)
+# Without the reranker, text search falls back to hybrid scores, so it doesn't gate readiness
+registry.register("reranker", load_reranker, critical=False)
+# OCR_PRELOAD=1 warms TrOCR in the background instead of on the first handwriting request
+registry.register("ocr", load_ocr, lazy=os.getenv("OCR_PRELOAD", "0") != "1", critical=False)
 
 @app.on_event("startup")
 def load_resources():
-    global engine, ocr, reranker, index_std, index_sbir, metadata, vectors, hybrid_searcher
-    
     print("Loading resources...")
-    engine = CLIPEngine()
-    ocr = OCRManager()
-    ocr.load_model() # Optimization: Eager load at startup
-    
-    # Load Reranker (Lazy load or eager? Eager for now to ensure readiness)
-    try:
-        reranker = Reranker()
-    except Exception as e:
-        print(f"Warning: Failed to load Reranker: {e}")
-    
-    # Load FAISS indices
-    if os.path.exists("embeddings/faiss_index.bin"):
-        index_std = faiss.read_index("embeddings/faiss_index.bin")
-    else:
-        print("Warning: Standard index not found")
-        
-    if os.path.exists("embeddings/faiss_sbir_index.bin"):
-        index_sbir = faiss.read_index("embeddings/faiss_sbir_index.bin")
-    else:
-        print("Warning: SBIR index not found")
+    registry.start()
 
-    # Load Metadata
-    if os.path.exists("metadata/items.csv"):
-        metadata = pd.read_csv("metadata/items.csv")
-        # Pass reranker to HybridSearcher
-        hybrid_searcher = HybridSearcher(metadata, reranker=reranker)
-    else:
-        print("Warning: Metadata CSV not found")
+async def require(*names):
+    """Waits for the named resources (up to RESOURCE_WAIT_TIMEOUT); 503 if one failed or is still loading."""
+    try:
+        for name in names:
+            await registry.wait(name, RESOURCE_WAIT_TIMEOUT)
+    except ResourceUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-    # Load Vectors
-    if os.path.exists("embeddings/image_vectors.npy"):
-        vectors = np.load("embeddings/image_vectors.npy")
-    else:
-        print("Warning: Image vectors not found")
-        
-    print("Resources loaded!")
-    import gc
-    gc.collect()
+def require_sync(*names):
+    """require() for sync (threadpool) handlers."""
+    try:
+        for name in names:
+            registry.get(name, RESOURCE_WAIT_TIMEOUT)
+    except ResourceUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 def get_base64_image(image_path):
     try:
         with open(image_path, "rb") as f: return base64.b64encode(f.read()).decode()
     except: return None
 
+def ann_search(index, q_vec, k, nprobe=None, ef_search=None):
+    """FAISS search with optional per-request ANN parameters (ignored by flat indices)."""
+    if index is None:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    return index_factory.search(index, q_vec, k, nprobe=nprobe, ef_search=ef_search)
+
+def active_snapshot():
+    snap = snapshots.active
+    if snap is None:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    return snap
+
+async def embed_text(text):
+    """CLIP text embedding: cache hit, or one slot in the next micro-batch."""
+    with span("embed_text"):
+        vec = engine.cached_text_embedding(text)
+        if vec is None:
+            vec = await text_batcher.run_async(text)
+    return vec
+
+async def embed_upload(kind, contents, prepare):
+    """
+    CLIP embedding of an uploaded image/sketch, cached by content hash.
+    `prepare(contents)` decodes (and e.g. cleans a sketch) and runs in the decode stage.
+    """
+    key = (kind, hashlib.sha1(contents).hexdigest())
+    vec = image_embedding_cache.get(key)
+    if vec is None:
+        image = await stages.run("decode", prepare, contents)
+        with span("embed_image"):
+            vec = await image_batcher.run_async(image)
+        image_embedding_cache.set(key, vec)
+    return vec
+
+def extend_window(snap, index, q_vec, query_text, category_filter, nprobe, ef_search, rerank_pool, k, seen, context):
+    """SearchWindow.extend: ANN search at depth k, then hybrid scoring (+ reranking) of the unseen hits. Blocking."""
+    with span("ann"):
+        if category_filter:
+            # Retrieve the top candidates from inside the category instead of post-filtering
+            if index is None:
+                raise HTTPException(status_code=503, detail="Index not loaded")
+            ids, sel = snap.category_search_args(category_filter)
+            D, I = index_factory.filtered_search(index, q_vec, k, ids, sel=sel, nprobe=nprobe, ef_search=ef_search)
+        else:
+            D, I = ann_search(index, q_vec, k, nprobe=nprobe, ef_search=ef_search)
+    hits, scores = I[0], D[0]
+    fresh = ~np.isin(hits, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+    ranked = snap.hybrid.get_hybrid_scores(query_text, q_vec[0], hits[fresh], scores[fresh],
+                                           category_filter=category_filter, rerank_pool=rerank_pool, window=context)
+    return ranked, int((hits >= 0).sum())
+
+def page_results(snap, items):
+    return [{**item, "metadata": snap.catalog.row(item["id"])} for item in items]
+
+def register_window(snap, window, size, has_more):
+    """Keeps the window for the following pages; returns the next-page cursor (None on the last page)."""
+    if not has_more:
+        return None
+    search_windows.set(window.id, (snap, window))
+    return encode_cursor(window.id, size, size)
+
+def rank_candidates(snap, index, q_vec, query_text, top_k, category_filter=None, nprobe=None, ef_search=None,
+                    rerank_pool=None):
+    """
+    First page (top_k) of a new candidate window for one normalized query vector, and the cursor
+    to the next page. Text queries reuse the cached window of an identical earlier query. Blocking.
+    `index` is one of `snap`'s indices.
+    """
+    window = SearchWindow(functools.partial(extend_window, snap, index, q_vec, query_text, category_filter,
+                                            nprobe, ef_search, rerank_pool),
+                          initial_k=max(PAGE_WINDOW, top_k), max_k=PAGE_MAX_CANDIDATES,
+                          id_prefix=prefork.window_prefix())
+    key = cached = None
+    if query_text and query_text.strip():
+        key = (snap.version, id(index), normalize_text(query_text), str(category_filter or "").lower(),
+               nprobe, ef_search, rerank_pool, window.initial_k)
+        cached = results_cache.get(key)
+        if cached is not None:
+            window.restore(cached)
+
+    items, has_more = window.page(0, top_k)
+    if key is not None and cached is None:
+        results_cache.set(key, window.state())
+    return page_results(snap, items), register_window(snap, window, top_k, has_more)
+
+def next_page(window_id, offset, size):
+    """Page [offset, offset + size) of a retained window, and the cursor after it. Blocking."""
+    entry = search_windows.get(window_id)
+    if entry is None:
+        raise HTTPException(status_code=410, detail="Cursor expired; run the search again")
+    snap, window = entry
+    items, has_more = window.page(offset, size)
+    # Sliding expiry: a window stays alive while someone is paging through it
+    search_windows.set(window_id, entry)
+    return page_results(snap, items), encode_cursor(window_id, offset + size, size) if has_more else None
+
+def set_cursor(response, cursor):
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+def decode_upload(contents, mode=None):
+    """
+    Fully decoded upload; 400 if it isn't a readable image. PIL decodes lazily, so without
+    load() a truncated file would only fail later, inside a shared CLIP batch.
+    """
+    try:
+        image = Image.open(io.BytesIO(contents))
+        image.load()
+        return image.convert(mode) if mode else image
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
 # --- Pydantic Models ---
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 12
+    # Optional ANN tuning: IVF lists probed / HNSW search depth
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # Opt-in: embed the full image as base64 instead of returning only image_url
+    inline_images: bool = False
+    # Cross-encoder pool size (default 100; 0 skips reranking) - trades quality for latency
+    rerank_pool: Optional[int] = None
 
 class SearchResponseItem(BaseModel):
     id: int
     score: float
     category: str
     description: str
+    image_url: Optional[str] = None
     image_base64: Optional[str] = None
     path: str
 
 # --- Helper function to format results ---
-def format_results(ranked_results):
+def format_results(ranked_results, inline_images=False):
     response = []
     for res in ranked_results:
         item = res['metadata']
         # Find index in metadata to get path (though path is in item)
         # We need to make sure we return everything needed for the UI
         try:
-            img_b64 = get_base64_image(item['path'])
+            item_id = int(res.get('id', 0)) # Placeholder if ID missing
             response.append({
-                "id": int(res.get('id', 0)), # Placeholder if ID missing
+                "id": item_id,
                 "score": float(res['score']),
                 "category": item.get('category', 'Unknown'),
                 "description": item.get('description', ''),
-                "image_base64": img_b64,
+                "image_url": f"/images/{item_id}",
+                "image_base64": get_base64_image(item['path']) if inline_images else None,
                 "path": item.get('path', '')
             })
         except Exception as e:
@@ -126,267 +438,590 @@ def format_results(ranked_results):
     return response
 
 @app.post("/search/text", response_model=List[SearchResponseItem])
-async def search_by_text(request: SearchRequest):
-    if not hybrid_searcher or not engine:
-        raise HTTPException(status_code=503, detail="Resources not initialized")
-
-    # --- INTENT DETECTION ---
-    # Simple rule-based detection for now. Can be upgraded to LLM later.
-    query_lower = request.query.lower()
-    detected_category = None
-    
-    # Map synonyms to canonical category names (based on items.csv)
-    # Categories seen: 'necklace', 'ring' (from sample). 
-    # Validating with simple mapping:
-    category_map = {
-        "ring": "ring",
-        "rings": "ring",
-        "band": "ring",
-        "necklace": "necklace",
-        "necklaces": "necklace",
-        "chain": "necklace",
-        "pendant": "necklace",
-        "earring": "earring", # Assuming these exist or will exist
-        "earrings": "earring",
-        "bracelet": "bracelet", # Assuming these exist
-        "bracelets": "bracelet",
-        "bangle": "bracelet"
-    }
+async def search_by_text(request: SearchRequest, response: Response):
+    await require("clip", "snapshot")
+    snap = active_snapshot()
 
-    for keyword, category in category_map.items():
-        if keyword in query_lower:
-            detected_category = category
-            break # Stop at first match (simplistic but works for "gold ring")
+    detected_category = detect_category(request.query)
 
-    query_vec = engine.get_text_embedding(request.query)
+    query_vec = await embed_text(request.query)
     q_vec = query_vec.reshape(1, -1).astype('float32')
     faiss.normalize_L2(q_vec)
     
-    D, I = index_std.search(q_vec, k=50)
-    ranked = hybrid_searcher.get_hybrid_scores(
-        request.query, 
-        q_vec[0], 
-        I[0], 
-        D[0], 
-        top_k=request.top_k,
-        category_filter=detected_category
-        # filters removed
-    )
+    ranked, cursor = await stages.run("search", rank_candidates, snap, snap.index_std, q_vec, request.query,
+                                      request.top_k, category_filter=detected_category, nprobe=request.nprobe,
+                                      ef_search=request.ef_search, rerank_pool=request.rerank_pool)
+    set_cursor(response, cursor)
     
-    return format_results(ranked)
+    return await stages.run("format", format_results, ranked, request.inline_images)
 
 @app.post("/search/image", response_model=List[SearchResponseItem])
-async def search_by_image(file: UploadFile = File(...), top_k: int = Form(12)):
-    if not hybrid_searcher or not engine:
-        raise HTTPException(status_code=503, detail="Resources not initialized")
-        
+async def search_by_image(response: Response, file: UploadFile = File(...), top_k: int = Form(12),
+                          nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None),
+                          inline_images: bool = Form(False)):
+    await require("clip", "snapshot")
+    snap = active_snapshot()
+
     contents = await file.read()
-    image = Image.open(io.BytesIO(contents))
     
-    query_vec = engine.get_image_embedding(image)
+    query_vec = await embed_upload("image", contents, decode_upload)
     q_vec = query_vec.reshape(1, -1).astype('float32')
     faiss.normalize_L2(q_vec)
     
     # Image search typically doesn't use hybrid keywords, so query_text=""
-    D, I = index_std.search(q_vec, k=50)
-    ranked = hybrid_searcher.get_hybrid_scores("", q_vec[0], I[0], D[0], top_k=top_k)
+    ranked, cursor = await stages.run("search", rank_candidates, snap, snap.index_std, q_vec, "", top_k,
+                                      nprobe=nprobe, ef_search=ef_search)
+    set_cursor(response, cursor)
     
-    return format_results(ranked)
+    return await stages.run("format", format_results, ranked, inline_images)
 
 @app.post("/search/sketch", response_model=List[SearchResponseItem])
-async def search_by_sketch(file: UploadFile = File(...), top_k: int = Form(12)):
-    if not hybrid_searcher or not engine:
-        raise HTTPException(status_code=503, detail="Resources not initialized")
+async def search_by_sketch(response: Response, file: UploadFile = File(...), top_k: int = Form(12),
+                           nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None),
+                           inline_images: bool = Form(False)):
+    await require("clip", "snapshot")
+    snap = active_snapshot()
 
     contents = await file.read()
-    image = Image.open(io.BytesIO(contents))
     
-    query_vec = engine.get_sketch_embedding(image)
+    query_vec = await embed_upload("sketch", contents, lambda data: engine.sketch_to_image(decode_upload(data)))
     q_vec = query_vec.reshape(1, -1).astype('float32')
     faiss.normalize_L2(q_vec)
     
     # Use SBIR index for sketches
-    D, I = index_sbir.search(q_vec, k=50)
-    ranked = hybrid_searcher.get_hybrid_scores("", q_vec[0], I[0], D[0], top_k=top_k)
+    ranked, cursor = await stages.run("search", rank_candidates, snap, snap.index_sbir, q_vec, "", top_k,
+                                      nprobe=nprobe, ef_search=ef_search)
+    set_cursor(response, cursor)
     
-    return format_results(ranked)
+    return await stages.run("format", format_results, ranked, inline_images)
 
 @app.post("/search/handwriting", response_model=dict)
-async def search_by_handwriting(file: UploadFile = File(...), top_k: int = Form(12), use_llm: bool = Form(True)):
-    if not hybrid_searcher or not engine or not ocr:
-        raise HTTPException(status_code=503, detail="Resources not initialized")
+async def search_by_handwriting(response: Response, file: UploadFile = File(...), top_k: int = Form(12), use_llm: bool = Form(True),
+                               nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None),
+                               inline_images: bool = Form(False), rerank_pool: Optional[int] = Form(None)):
+    await require("ocr", "clip", "snapshot")
+    snap = active_snapshot()
 
     contents = await file.read()
-    image = Image.open(io.BytesIO(contents)).convert('RGB')
-    
-    raw_ocr, cleaned_query, detected_category = ocr.extract_text(image, use_llm=use_llm)
+
+    # OCR runs in its stage; LLM cleaning is async, so a slow LLM holds no thread at all
+    def run_ocr():
+        image = decode_upload(contents, 'RGB')
+        try:
+            return ocr.read(image)
+        except Exception as e:
+            print(f"OCR Error: {e}")
+            return "", None
+    raw_ocr, ocr_info = await stages.run("ocr", run_ocr)
+    cleaned_query, detected_category = raw_ocr, None
+    refined_by = None
+    if use_llm and raw_ocr.strip():
+        with span("llm"):
+            # The local fallback (vocabulary lookups, difflib) is CPU work: keep it off the event loop
+            fallback = functools.partial(stages.run, "clean", lambda text: snap.query_cleaner().clean(text))
+            cleaned_query, detected_category, refined_by = await query_cleaner.clean(raw_ocr, fallback)
     
     if not cleaned_query:
         # If no text found, return empty results with empty text fields
-        return {"results": [], "raw_text": "", "refined_text": ""}
+        return {"results": [], "raw_text": "", "refined_text": "", "refined_by": refined_by, "next_cursor": None,
+                "ocr": ocr_info}
 
-    query_vec = engine.get_text_embedding(cleaned_query)
+    query_vec = await embed_text(cleaned_query)
     q_vec = query_vec.reshape(1, -1).astype('float32')
     faiss.normalize_L2(q_vec)
     
-    D, I = index_std.search(q_vec, k=50)
-    ranked = hybrid_searcher.get_hybrid_scores(
-        cleaned_query, 
-        q_vec[0], 
-        I[0], 
-        D[0], 
-        top_k=top_k,
-        category_filter=detected_category
-    )
+    ranked, cursor = await stages.run("search", rank_candidates, snap, snap.index_std, q_vec, cleaned_query, top_k,
+                                      category_filter=detected_category, nprobe=nprobe, ef_search=ef_search,
+                                      rerank_pool=rerank_pool)
+    set_cursor(response, cursor)
     
-    formatted_results = format_results(ranked)
+    formatted_results = await stages.run("format", format_results, ranked, inline_images)
     
     return {
         "results": formatted_results,
         "raw_text": raw_ocr,
-        "refined_text": cleaned_query if use_llm else "" 
+        "refined_text": cleaned_query if use_llm else "",
+        # "llm", "cache" or "local" (fuzzy fallback)
+        "refined_by": refined_by,
+        # Also in the X-Next-Cursor header; pass to /search/next for the following page
+        "next_cursor": cursor,
+        # Lines read, downscale factor and per-step timings of the OCR pipeline
+        "ocr": ocr_info
     }
 
-@app.get("/search/featured", response_model=List[SearchResponseItem])
-def get_featured_items(count: int = -1):
-    if not hybrid_searcher:
-        raise HTTPException(status_code=503, detail="Resources not initialized")
-    
-    # Return all items if count is -1, else sample
-    if metadata is not None and not metadata.empty:
-        import random
-        num_items = len(metadata)
-        
-        if count == -1 or count >= num_items:
-            indices = list(range(num_items))
-        else:
-            indices = random.sample(range(num_items), count)
-        
-        featured = []
-        for idx in indices:
-            item = metadata.iloc[idx].to_dict()
-            featured.append({
-                'id': idx,
-                'score': 1.0, 
-                'metadata': item
-            })
-        return format_results(featured)
-    return []
+class NextPageRequest(BaseModel):
+    cursor: str
+    # Defaults to the page size of the request that opened the cursor
+    page_size: Optional[int] = None
+    inline_images: bool = False
 
-@app.get("/tags")
-def get_tags():
-    print("DEBUG: get_tags called")
-    global metadata
+@app.post("/search/next", response_model=List[SearchResponseItem])
+async def search_next(request: NextPageRequest, response: Response):
+    """
+    The page after a cursor from any search endpoint (X-Next-Cursor). Served from the retained
+    candidate window; 410 once the cursor expired or the index was reloaded.
+    """
+    try:
+        window_id, offset, size = decode_cursor(request.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.page_size is not None:
+        if request.page_size <= 0:
+            raise HTTPException(status_code=400, detail="page_size must be positive")
+        size = request.page_size
 
-    # Lazy load if missing
-    if metadata is None:
-        print("DEBUG: Metadata missing, attempting reload...")
+    # Pre-forked (run.py --workers): the window lives in the worker that ran the search; hand it the page
+    owner = prefork.owner(window_id)
+    if owner is not None:
         try:
-            if os.path.exists("metadata/items.csv"):
-                metadata = pd.read_csv("metadata/items.csv")
-                print("DEBUG: Metadata reloaded successfully")
-            else:
-                print("DEBUG: metadata/items.csv not found")
+            reply = await prefork.forward(owner, "POST", "/search/next", json=request.model_dump())
         except Exception as e:
-            print(f"DEBUG: Failed to reload metadata: {e}")
+            print(f"Forwarding cursor to worker {owner} failed: {e}")
+            raise HTTPException(status_code=410, detail="Cursor expired; run the search again")
+        headers = {"X-Next-Cursor": reply.headers["x-next-cursor"]} if "x-next-cursor" in reply.headers else None
+        return Response(reply.content, status_code=reply.status_code, headers=headers,
+                        media_type=reply.headers.get("content-type"))
 
-    if metadata is None:
-        return {"tags": ["Gold Necklace", "Diamond Ring", "Silver Bracelet", "Pearl Earrings"]} # New Fallback
-    
+    ranked, cursor = await stages.run("search", next_page, window_id, offset, size)
+    set_cursor(response, cursor)
+    return await stages.run("format", format_results, ranked, request.inline_images)
+
+# --- Batch search (bulk / offline jobs) ---
+class BatchTextSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 12
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    rerank_pool: Optional[int] = None
+    inline_images: bool = False
+    # Same keyword -> category filter as /search/text
+    detect_category: bool = True
+
+def batch_ann_search(snap, index, q_mat, k, categories=None, nprobe=None, ef_search=None):
+    """
+    One FAISS call over the whole (Q, d) query matrix, plus one filtered call per distinct
+    category. Returns (Q, k) distances/ids, padded with -1 ids where a category has fewer items.
+    """
+    if index is None:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    D = np.full((len(q_mat), k), -np.inf, dtype=np.float32)
+    I = np.full((len(q_mat), k), -1, dtype=np.int64)
+    groups = {}
+    for row, category in enumerate(categories or [None] * len(q_mat)):
+        groups.setdefault(category, []).append(row)
+    for category, rows in groups.items():
+        if category:
+            ids, sel = snap.category_search_args(category)
+            d, i = index_factory.filtered_search(index, q_mat[rows], k, ids, sel=sel, nprobe=nprobe, ef_search=ef_search)
+        else:
+            d, i = index_factory.search(index, q_mat[rows], k, nprobe=nprobe, ef_search=ef_search)
+        D[rows, :d.shape[1]] = d
+        I[rows, :i.shape[1]] = i
+    return D, I
+
+def batch_rank(snap, index, q_mat, query_texts, top_k, categories=None, nprobe=None, ef_search=None, rerank_pool=None):
+    """Batched `rank_candidates`: one ranked list per row of `q_mat`. Blocking."""
+    # Deep enough for top_k and the rerank pool, as in rank_candidates
+    k = max(PAGE_WINDOW, top_k, rerank_pool or 0)
+    with span("ann"):
+        D, I = batch_ann_search(snap, index, q_mat, k, categories, nprobe, ef_search)
+    return snap.hybrid.get_hybrid_scores_batch(query_texts, I, D, top_k=top_k, category_filters=categories,
+                                               rerank_pool=rerank_pool)
+
+def ndjson_line(record):
+    return (json.dumps(record, default=str) + "\n").encode("utf-8")
+
+@app.post("/search/batch/text")
+async def search_batch_text(request: BatchTextSearchRequest):
+    """
+    Many text queries in one request. Each chunk of BATCH_SEARCH_CHUNK queries is embedded in one
+    CLIP pass, searched with one FAISS call and ranked together; results stream back as NDJSON
+    ({"index", "query", "category", "results"} per line) as soon as their chunk is done.
+    """
+    if len(request.queries) > BATCH_SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_SEARCH_MAX_QUERIES} queries per request")
+    await require("clip", "snapshot")
+    snap = active_snapshot()
+
+    def run_chunk(start, queries):
+        categories = [detect_category(q) if request.detect_category else None for q in queries]
+        with span("embed_text"):
+            q_mat = engine.get_text_embeddings(queries).astype('float32')
+        faiss.normalize_L2(q_mat)
+        ranked = batch_rank(snap, snap.index_std, q_mat, queries, request.top_k, categories,
+                            request.nprobe, request.ef_search, request.rerank_pool)
+        return b"".join(
+            ndjson_line({"index": start + i, "query": q, "category": categories[i],
+                         "results": format_results(ranked[i], request.inline_images)})
+            for i, q in enumerate(queries))
+
+    async def stream():
+        for start in range(0, len(request.queries), BATCH_SEARCH_CHUNK):
+            yield await stages.run("batch", run_chunk, start, request.queries[start:start + BATCH_SEARCH_CHUNK])
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/search/batch/image")
+async def search_batch_image(files: List[UploadFile] = File(...), top_k: int = Form(12),
+                             nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None),
+                             inline_images: bool = Form(False)):
+    """
+    Many uploaded images in one request, embedded in batched CLIP passes and searched with one
+    FAISS call per chunk. Streams one NDJSON line per image: {"index", "filename", "results"},
+    or {"index", "filename", "error"} if the image could not be decoded.
+    """
+    if len(files) > BATCH_SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_SEARCH_MAX_QUERIES} images per request")
+    await require("clip", "snapshot")
+    snap = active_snapshot()
+    uploads = [(f.filename, await f.read()) for f in files]
+
+    def run_chunk(start, chunk):
+        lines, rows, vecs, missing, images = [], [], [], [], []
+        for offset, (filename, contents) in enumerate(chunk):
+            key = ("image", hashlib.sha1(contents).hexdigest())
+            vec = image_embedding_cache.get(key)
+            if vec is None:
+                try:
+                    images.append(decode_upload(contents))
+                except HTTPException as e:
+                    lines.append((offset, {"filename": filename, "error": e.detail}))
+                    continue
+                missing.append((len(vecs), key))
+            rows.append(offset)
+            vecs.append(vec)
+        if images:
+            with span("embed_image"):
+                embedded = engine.get_pil_image_embeddings(images)
+            for (pos, key), vec in zip(missing, embedded):
+                vecs[pos] = vec
+                image_embedding_cache.set(key, vec)
+        if rows:
+            q_mat = np.stack(vecs).astype('float32')
+            faiss.normalize_L2(q_mat)
+            ranked = batch_rank(snap, snap.index_std, q_mat, [""] * len(rows), top_k, nprobe=nprobe, ef_search=ef_search)
+            for offset, results in zip(rows, ranked):
+                lines.append((offset, {"filename": chunk[offset][0], "results": format_results(results, inline_images)}))
+        return b"".join(ndjson_line({"index": start + offset, **record}) for offset, record in sorted(lines, key=lambda l: l[0]))
+
+    async def stream():
+        for start in range(0, len(uploads), BATCH_SEARCH_CHUNK):
+            yield await stages.run("batch", run_chunk, start, uploads[start:start + BATCH_SEARCH_CHUNK])
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def featured_inline_chunks(snap, ids):
+    """Streamed JSON array of featured items with inline base64 images (read per chunk)."""
+    yield b"["
+    for start in range(0, len(ids), FEATURED_CHUNK):
+        items = []
+        for i in ids[start:start + FEATURED_CHUNK]:
+            row = snap.catalog.row(i)
+            items.append({**featured_item(i, row), "image_base64": get_base64_image(row['path'])})
+        yield (b"," if start else b"") + json.dumps(items)[1:-1].encode("utf-8")
+    yield b"]"
+
+@app.get("/search/featured")
+def get_featured_items(request: Request, count: int = -1, limit: Optional[int] = None, offset: int = 0,
+                       inline_images: bool = False):
+    """
+    Catalog items for the landing page (SearchResponseItem list), streamed as a JSON array from
+    the snapshot's pre-serialized copy. limit/offset page through the catalog in index order
+    (X-Total-Count has its size); count=N returns N random items, count=-1 (default) all of them.
+    """
+    require_sync("snapshot")
+    snap = active_snapshot()
+    landing = snap.landing()
+    total = len(landing)
+    if offset < 0 or (limit is not None and limit < 0):
+        raise HTTPException(status_code=400, detail="offset and limit must be non-negative")
+    headers = {"X-Total-Count": str(total)}
+
+    if limit is None and 0 <= count < total:
+        # Random sample: small, built per request
+        ids = random.sample(range(total), count)
+        if inline_images:
+            return StreamingResponse(featured_inline_chunks(snap, ids), media_type="application/json", headers=headers)
+        return Response(json.dumps([featured_item(i, snap.catalog.row(i)) for i in ids]),
+                        media_type="application/json", headers=headers)
+
+    if inline_images:
+        end = total if limit is None else min(total, offset + limit)
+        return StreamingResponse(featured_inline_chunks(snap, list(range(offset, end))),
+                                 media_type="application/json", headers=headers)
+
+    # A page only changes with the snapshot, so browsers can revalidate instead of re-downloading
+    etag = f'"{snap.version}-{offset}-{limit}"'
+    headers.update({"ETag": etag, "Cache-Control": "public, max-age=60"})
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(landing.featured_chunks(offset, limit, FEATURED_CHUNK),
+                             media_type="application/json", headers=headers)
+
+@app.get("/tags")
+def get_tags(count: int = 5):
+    """Random quick-search suggestions from the snapshot's prebuilt, cleaned tag pool."""
     try:
-        # Get random descriptions
-        if 'description' in metadata.columns:
-            # Drop empty
-            valid_descs = metadata['description'].dropna().tolist()
-            if not valid_descs:
-                 return {"tags": ["Luxury", "Elegance", "Vintage", "Modern"]}
-            
-            # Sample 5 random items
-            
-            # Sample 5 random items
-            import random
-            samples = random.sample(valid_descs, min(len(valid_descs), 5))
-            
-            cleaned_tags = []
-            for desc in samples:
-                # Clean up text
-                text = desc.strip()
-                # Remove starting articles
-                for prefix in ["A ", "An ", "The ", "a ", "an ", "the "]:
-                    if text.startswith(prefix):
-                        text = text[len(prefix):]
-                        break
-                
-                # Capitalize first letter
-                if text:
-                    text = text[0].upper() + text[1:]
-                
-                # Truncate if too long (ellipses)
-                if len(text) > 45:
-                    text = text[:42] + "..."
-                    
-                cleaned_tags.append(text)
-                
-            return {"tags": cleaned_tags}
-        return {"tags": []}
-    except Exception as e:
-        print(f"Error fetching tags: {e}")
-        return {"tags": []}
+        registry.get("snapshot", RESOURCE_WAIT_TIMEOUT)
+    except ResourceUnavailable as e:
+        print(f"Tags unavailable: {e}")
+
+    snap = snapshots.active
+    if snap is None:
+        return {"tags": FALLBACK_TAGS}
+    return {"tags": snap.landing().sample_tags(count) or ["Luxury", "Elegance", "Vintage", "Modern"]}
+
+# /search/similar spaces -> snapshot index / neighbour table
+SIMILAR_SPACES = {"photo": "std", "sketch": "sbir"}
 
 class SimilarSearchRequest(BaseModel):
     id: int
     top_k: int = 12
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    inline_images: bool = False
+    # "photo" (CLIP image embeddings) or "sketch" (SBIR edge-map embeddings)
+    space: str = "photo"
+    # Optional restrictions on the neighbours: a category and {column: [values]} attribute filters
+    category: Optional[str] = None
+    filters: Optional[Dict[str, List[str]]] = None
 
 @app.post("/search/similar", response_model=List[SearchResponseItem])
-async def search_similar(request: SimilarSearchRequest):
-    if not hybrid_searcher or not engine:
-        raise HTTPException(status_code=503, detail="Resources not initialized")
-    
-    # 1. Get vector for the item
-    # vectors is a global numpy array
-    if vectors is None or request.id >= len(vectors):
+async def search_similar(request: SimilarSearchRequest, response: Response):
+    await require("snapshot")
+
+    ranked, cursor = await stages.run("search", find_similar, active_snapshot(), request)
+    set_cursor(response, cursor)
+    return await stages.run("format", format_results, ranked, request.inline_images)
+
+def find_similar(snap, request):
+    """Nearest neighbours of an indexed item (excluding itself) and the next-page cursor. Blocking."""
+    space = SIMILAR_SPACES.get(request.space)
+    if space is None:
+        raise HTTPException(status_code=400, detail=f"space must be one of {sorted(SIMILAR_SPACES)}")
+    index = snap.index_std if space == "std" else snap.index_sbir
+    if index is None or request.id < 0 or request.id >= index.ntotal:
         raise HTTPException(status_code=404, detail="Item ID not found")
-        
-    target_vec = vectors[request.id].reshape(1, -1).astype('float32')
-    faiss.normalize_L2(target_vec)
-    
-    # 2. Search FAISS
-    # We ask for top_k + 1 because the item itself will be the first result (dist=0 or 1)
-    D, I = index_std.search(target_vec, k=request.top_k + 1)
-    
-    # 3. Use get_hybrid_scores mostly for formatting & potential filtering if we add it later
-    # We pass query_text="" so it relies purely on visual similarity for now.
-    # Note: We filter out the item itself in the logic below or via index slicing
-    
-    # Exclude the item itself (usually index 0)
-    # logic: I[0] is the list of indices. D[0] is distances.
-    # We check if request.id is in I[0] and remove it.
-    
-    found_indices = I[0]
-    found_scores = D[0]
-    
-    filtered_indices = []
-    filtered_scores = []
-    
-    for idx, score in zip(found_indices, found_scores):
-        if idx != request.id:
-            filtered_indices.append(idx)
-            filtered_scores.append(score)
-    
-    # Slice to top_k
-    filtered_indices = filtered_indices[:request.top_k]
-    filtered_scores = filtered_scores[:request.top_k]
-    
-    ranked = hybrid_searcher.get_hybrid_scores(
-        "", 
-        target_vec[0], 
-        filtered_indices, 
-        filtered_scores, 
-        top_k=request.top_k
-    )
-    
-    return format_results(ranked)
+
+    # Page through the neighbours: table lookups first, a live FAISS search once pages run past the table
+    window = SearchWindow(functools.partial(extend_similar, snap, space, index, int(request.id), request.category,
+                                            request.filters, request.nprobe, request.ef_search),
+                          initial_k=request.top_k, max_k=PAGE_MAX_CANDIDATES, id_prefix=prefork.window_prefix())
+    items, has_more = window.page(0, request.top_k)
+    return page_results(snap, items), register_window(snap, window, request.top_k, has_more)
+
+def extend_similar(snap, space, index, item_id, category, filters, nprobe, ef_search, k, seen, context):
+    """
+    SearchWindow.extend for /search/similar: the item's k nearest neighbours, read from the
+    snapshot's precomputed table while k fits in it, else from a live search. Blocking.
+    """
+    table = snap.neighbors.get(space)
+    if table is not None and k <= table[0].shape[1]:
+        with span("neighbors"):
+            hits = np.asarray(table[0][item_id, :k], dtype=np.int64)
+            scores = np.asarray(table[1][item_id, :k], dtype=np.float32)
+        n_hits = int((hits >= 0).sum())
+    else:
+        # Get vector for the item, reconstructed from the index itself
+        target_vec = index.reconstruct(item_id).reshape(1, -1).astype('float32')
+        faiss.normalize_L2(target_vec)
+        # We ask for k + 1 because the item itself will be the first result (dist=0 or 1)
+        with span("ann"):
+            if category:
+                ids, sel = snap.category_search_args(category)
+                D, I = index_factory.filtered_search(index, target_vec, k + 1, ids, sel=sel, nprobe=nprobe,
+                                                     ef_search=ef_search)
+            else:
+                D, I = ann_search(index, target_vec, k + 1, nprobe=nprobe, ef_search=ef_search)
+        hits, scores = I[0], D[0]
+        n_hits = int(((hits >= 0) & (hits != item_id)).sum())
+    # Exclude the item itself and the neighbours earlier pages already hold
+    keep = (hits != item_id) & ~np.isin(hits, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+    # query_text="" so it relies purely on visual similarity; category/filters are applied here
+    ranked = snap.hybrid.get_hybrid_scores("", None, hits[keep], scores[keep], category_filter=category,
+                                           filters=filters, window=context)
+    return ranked, n_hits
+
+@app.get("/images/{item_id}")
+def get_image(item_id: int, request: Request, variant: str = "thumb"):
+    """
+    Serves an item's thumbnail (default) or original image with ETag/Cache-Control,
+    so browsers and CDNs revalidate instead of re-downloading.
+    """
+    require_sync("snapshot")
+    metadata = active_snapshot().catalog
+    if item_id < 0 or item_id >= len(metadata):
+        raise HTTPException(status_code=404, detail="Item ID not found")
+    item = metadata.row(item_id)
+
+    path = item.get('path')
+    thumb = item.get('thumbnail')
+    # The variant actually served: a missing thumbnail falls back to the original
+    served = "orig"
+    if variant == "thumb" and isinstance(thumb, str) and os.path.exists(thumb):
+        path, served = thumb, "thumb"
+    if not isinstance(path, str) or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    content_hash = item.get('content_hash')
+    if isinstance(content_hash, str):
+        etag = f'"{content_hash}-{served}"'
+    else:
+        st = os.stat(path)
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=thumbnails.media_type(path), headers=headers)
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/ready")
+def readiness_check(response: Response):
+    """Per-component load state and timings; 503 until every critical resource is loaded."""
+    status = registry.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+def check_admin(request):
+    if ADMIN_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN)
+    else:
+        allowed = request.client is not None and request.client.host in LOOPBACK_HOSTS
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.post("/admin/reload")
+async def reload_snapshot(request: Request, build_id: Optional[str] = None, force: bool = False):
+    """
+    Loads the snapshot CURRENT points at (or `build_id`, e.g. to roll back) in the background
+    and swaps it in. Requests keep being served from the old snapshot until the swap.
+    """
+    check_admin(request)
+    if build_id is not None and build_id not in list_snapshots(snapshots.root):
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot {build_id!r}")
+    await require("snapshot")
+    if prefork.enabled():
+        # Every worker must swap: the master loads the build, then re-forks its workers from it
+        try:
+            reply = await stages.run("reload", prefork.request_master,
+                                     {"command": "reload", "build_id": build_id, "force": force})
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Master process unreachable: {e}")
+        if "error" in reply:
+            raise HTTPException(status_code=409, detail=f"Reload failed, keeping the active snapshot: {reply['error']}")
+        return reply
+    try:
+        swapped = await stages.run("reload", snapshots.reload, build_id, force)
+    except Exception as e:
+        raise HTTPException(status_code=409, detail=f"Reload failed, keeping the active snapshot: {e}")
+    return {"reloaded": swapped is not None, **snapshots.status()}
+
+@app.get("/admin/snapshot")
+def snapshot_status(request: Request):
+    check_admin(request)
+    return snapshots.status()
+
+@app.get("/stats/batching")
+def batching_stats():
+    """Queue depth and batch-size histogram of the CLIP micro-batchers."""
+    return {
+        "text": text_batcher.stats() if text_batcher else None,
+        "image": image_batcher.stats() if image_batcher else None,
+        "rerank": reranker.batcher.stats() if reranker else None,
+    }
+
+@app.get("/stats/cache")
+def cache_stats():
+    """Hit/miss counters of the embedding and result caches."""
+    return {
+        "index_version": snapshots.active.version if snapshots.active else None,
+        "text_embedding": engine.text_cache.stats() if engine else None,
+        "image_embedding": image_embedding_cache.stats(),
+        "results": results_cache.stats(),
+        "rerank_scores": reranker.score_cache.stats() if reranker else None,
+        "llm_query": query_cleaner.cache.stats(),
+        "search_windows": search_windows.stats(),
+    }
+
+@app.get("/stats/llm")
+def llm_stats():
+    """Query-cleaner outcomes, rate limit/budget usage and cache counters."""
+    return query_cleaner.stats()
+
+@app.get("/stats/stages")
+def stage_stats():
+    """Per-stage concurrency limits and in-flight counts of the blocking-stage pool."""
+    return stages.stats()
+
+@metrics.collector
+def collect_runtime_metrics():
+    """Scrape-time gauges: cache hit rates, model queue depths, stage occupancy, index size, load state."""
+    caches = {"image_embedding": image_embedding_cache, "results": results_cache, "llm_query": query_cleaner.cache,
+              "search_windows": search_windows}
+    if engine:
+        caches["text_embedding"] = engine.text_cache
+    if reranker:
+        caches["rerank_scores"] = reranker.score_cache
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    yield ("jewelux_cache_hits_total", "counter", "Cache hits.",
+           [({"cache": n}, st["hits"]) for n, st in cache_stats.items()])
+    yield ("jewelux_cache_misses_total", "counter", "Cache misses.",
+           [({"cache": n}, st["misses"]) for n, st in cache_stats.items()])
+    yield ("jewelux_cache_hit_ratio", "gauge", "Cache hits / lookups since start.",
+           [({"cache": n}, st["hit_rate"]) for n, st in cache_stats.items()])
+    yield ("jewelux_cache_entries", "gauge", "Entries currently cached.",
+           [({"cache": n}, st["size"]) for n, st in cache_stats.items()])
+
+    batchers = {"text": text_batcher, "image": image_batcher, "rerank": reranker.batcher if reranker else None}
+    batch_stats = {name: b.stats() for name, b in batchers.items() if b is not None}
+    yield ("jewelux_batcher_queue_depth", "gauge", "Items waiting for a model micro-batch.",
+           [({"batcher": n}, st["queue_depth"]) for n, st in batch_stats.items()])
+    yield ("jewelux_batcher_items_total", "counter", "Items run through the model micro-batcher.",
+           [({"batcher": n}, st["items_total"]) for n, st in batch_stats.items()])
+    yield ("jewelux_batcher_batches_total", "counter", "Model micro-batches dispatched.",
+           [({"batcher": n}, st["batches_total"]) for n, st in batch_stats.items()])
+
+    yield ("jewelux_query_cleaner_total", "counter",
+           "Handwriting query cleanings by outcome (llm, cache, local, over_budget, saturated, error).",
+           [({"outcome": n}, v) for n, v in query_cleaner.stats()["requests"].items()])
+
+    yield ("jewelux_stage_in_flight", "gauge", "Blocking-stage calls currently holding a slot.",
+           [({"stage": n}, v) for n, v in stages.stats()["in_flight"].items()])
+
+    snap = snapshots.active
+    if snap is not None:
+        yield ("jewelux_index_vectors", "gauge", "Vectors in the active FAISS indices.",
+               [({"index": n}, idx.ntotal) for n, idx in (("std", snap.index_std), ("sbir", snap.index_sbir))
+                if idx is not None])
+        yield ("jewelux_catalog_items", "gauge", "Items in the active catalog.", [({}, len(snap.catalog))])
+        yield ("jewelux_snapshot_info", "gauge", "Active snapshot build.",
+               [({"build_id": snap.build_id, "version": snap.version}, 1)])
+    yield ("jewelux_snapshot_reloads_total", "counter", "Snapshot swaps since start.", [({}, snapshots.reloads)])
+
+    components = registry.status()["components"]
+    yield ("jewelux_component_ready", "gauge", "1 once a startup resource is loaded.",
+           [({"component": n}, int(c["state"] == "ready")) for n, c in components.items()])
+    yield ("jewelux_component_load_seconds", "gauge", "Load time of each startup resource.",
+           [({"component": n}, c["load_seconds"]) for n, c in components.items()])
+
+@app.get("/metrics")
+async def prometheus_metrics(scope: str = "all"):
+    """
+    Prometheus scrape endpoint: latency histograms per endpoint and stage plus runtime gauges.
+    Pre-forked, every sample carries a worker label and the reply covers all workers
+    (scope=worker: only the one answering).
+    """
+    if not prefork.enabled():
+        return PlainTextResponse(metrics.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+    text = metrics.render({"worker": str(prefork.worker_index)})
+    if scope != "worker":
+        replies = await asyncio.gather(*(prefork.forward(i, "GET", "/metrics", timeout=5.0, params={"scope": "worker"})
+                                         for i in prefork.peers()), return_exceptions=True)
+        text = merge_expositions([text] + [r.text for r in replies
+                                           if not isinstance(r, Exception) and r.status_code == 200])
+    return PlainTextResponse(text, media_type=MetricsRegistry.CONTENT_TYPE)
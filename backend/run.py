@@ -1,20 +1,279 @@
-
 import uvicorn
 import os
 import sys
+import gc
+import json
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
 
 # Ensure backend directory is in path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+class Supervisor:
+    """
+    Pre-fork serving: models, indices and the catalog load once in this (master) process,
+    then `workers` processes are forked from it and share those pages copy-on-write. All
+    workers accept on one listening socket, each runs its own uvicorn server and event loop.
+
+    Each worker gets `threads` torch/FAISS intra-op threads (optionally pinned to its own
+    cores), so N workers use the machine instead of N requests fighting over every core.
+    Workers that exit (crash, or --max-requests reached) are replaced; SIGHUP replaces them
+    one at a time; SIGTERM/SIGINT drain them and exit.
+
+    Each worker also accepts on its own unix socket (utils/prefork.py), which other workers use
+    to hand it pages of its search windows and to collect its metrics. Workers send commands to
+    the master's control socket: a snapshot reload happens here, and every worker is then
+    replaced by one forked from the new build. The master's snapshot watcher does the same.
+    """
+
+    def __init__(self, app, snapshots, sock, private, control, workers, threads, cpu_affinity=False, max_requests=0,
+                 max_requests_jitter=0, graceful_timeout=30, log_level="info"):
+        self.app = app
+        self.snapshots = snapshots
+        self.sock = sock
+        self.private = private
+        self.control = control
+        self.workers = workers
+        self.threads = threads
+        self.cpu_affinity = cpu_affinity
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.children = {}  # pid -> (worker index, start time)
+        self.stopping = False
+        self.recycle_queue = []
+        self.recycling = None
+        self.generation = snapshots.reloads
+
+    def cpus_for(self, index):
+        """`threads` consecutive cores of the ones this process may use, round-robin over workers."""
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (index * self.threads) % len(cpus)
+        return {cpus[(start + i) % len(cpus)] for i in range(min(self.threads, len(cpus)))}
+
+    def spawn(self, index):
+        # Never fork halfway through a snapshot reload of the watcher thread
+        with self.snapshots.idle():
+            pid = os.fork()
+        if pid:
+            self.children[pid] = (index, time.monotonic())
+            return pid
+        code = 0
+        try:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            self.control.close()
+            for other, sock in enumerate(self.private):
+                if other != index:
+                    sock.close()
+            self.run_worker(index)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+
+    def run_worker(self, index):
+        import torch
+        import faiss
+        from utils import prefork
+        prefork.worker_index = index
+        # Affinity first: OpenMP sizes its thread team from the CPUs it may run on
+        if self.cpu_affinity and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus_for(index))
+        torch.set_num_threads(self.threads)
+        faiss.omp_set_num_threads(self.threads)
+        print(f"Worker {index} (pid {os.getpid()}) serving with {self.threads} threads"
+              + (f" on CPUs {sorted(os.sched_getaffinity(0))}" if self.cpu_affinity else ""), flush=True)
+        config = uvicorn.Config(self.app, log_level=self.log_level,
+                                limit_max_requests=self.max_requests or None,
+                                limit_max_requests_jitter=self.max_requests_jitter,
+                                timeout_graceful_shutdown=self.graceful_timeout)
+        uvicorn.Server(config).run(sockets=[self.sock, self.private[index]])
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_recycle(self, signum, frame):
+        self.recycle_queue = list(self.children)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_recycle)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while not self.stopping:
+            self.reap()
+            self.serve_control()
+            if self.snapshots.reloads != self.generation:
+                # A new build is active here: re-fork every worker from it
+                self.generation = self.snapshots.reloads
+                print(f"Snapshot {self.snapshots.active.build_id} active; recycling all workers", flush=True)
+                gc.collect()
+                gc.freeze()
+                self.recycle_queue = list(self.children)
+            # Rolling recycle: one worker at a time, so the others keep serving
+            if self.recycling is None and self.recycle_queue:
+                pid = self.recycle_queue.pop(0)
+                if pid in self.children:
+                    self.recycling = pid
+                    print(f"Recycling worker {self.children[pid][0]} (pid {pid})", flush=True)
+                    os.kill(pid, signal.SIGTERM)
+            time.sleep(0.2)
+        self.shutdown()
+
+    def serve_control(self):
+        """Answers one pending command from a worker, if any (one JSON line in, one out)."""
+        try:
+            conn, _ = self.control.accept()
+        except BlockingIOError:
+            return
+        with conn:
+            conn.settimeout(10)
+            try:
+                with conn.makefile("rb") as request:
+                    command = json.loads(request.readline() or b"{}")
+                reply = self.handle(command)
+                conn.sendall(json.dumps(reply, default=str).encode("utf-8") + b"\n")
+            except Exception as e:
+                print(f"Control command failed: {e}", flush=True)
+
+    def handle(self, command):
+        if command.get("command") == "reload":
+            try:
+                swapped = self.snapshots.reload(command.get("build_id"), bool(command.get("force")))
+            except Exception as e:
+                return {"error": str(e)}
+            return {"reloaded": swapped is not None, "recycling_workers": swapped is not None,
+                    **self.snapshots.status()}
+        return {"error": f"Unknown command {command.get('command')!r}"}
+
+    def reap(self):
+        """Collects exited workers and starts their replacements."""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            if pid == self.recycling:
+                self.recycling = None
+            if pid not in self.children:
+                continue
+            index, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            print(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; "
+                  "starting a replacement", flush=True)
+            # Don't fork in a tight loop when workers die right away
+            if time.monotonic() - started < 1.0:
+                time.sleep(1.0)
+            self.spawn(index)
+
+    def shutdown(self):
+        print(f"Stopping {len(self.children)} workers...", flush=True)
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+def bind_unix(path, backlog=128):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def serve_prefork(args):
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    # ONNX Runtime's thread pool is created with the session and doesn't survive fork()
+    if os.getenv("INFERENCE_BACKEND", "torch").lower() == "onnx" and os.getenv("ONNX_THREADS") != "1":
+        print("Pre-fork mode: using ONNX_THREADS=1 (ONNX Runtime thread pools are not fork-safe)", flush=True)
+        os.environ["ONNX_THREADS"] = "1"
+    # Read by utils/prefork.py when main is imported
+    socket_dir = tempfile.mkdtemp(prefix="jewelux-")
+    os.environ["PREFORK_SOCKET_DIR"] = socket_dir
+    os.environ["PREFORK_WORKERS"] = str(args.workers)
+
+    import torch
+    # No OpenMP thread team may exist before fork(), or workers can hang on their first parallel op
+    torch.set_num_threads(1)
+    import main
+    from utils import prefork
+
+    try:
+        config = uvicorn.Config(main.app, host=args.host, port=args.port, backlog=args.backlog)
+        sock = config.bind_socket()
+        private = [bind_unix(prefork.worker_socket(i)) for i in range(args.workers)]
+        control = bind_unix(prefork.control_socket())
+        control.setblocking(False)
+
+        # Every resource, TrOCR included, so workers share one copy instead of loading their own
+        print("Preloading resources...", flush=True)
+        t0 = time.perf_counter()
+        ready = main.registry.preload()
+        print(f"Resources loaded in {time.perf_counter() - t0:.1f}s (ready: {ready}); "
+              f"forking {args.workers} workers x {threads} threads on http://{args.host}:{args.port}", flush=True)
+        # Keep the loaded objects out of the workers' GC passes, which would otherwise write to
+        # (and so un-share) every page holding them
+        gc.collect()
+        gc.freeze()
+
+        Supervisor(main.app, main.snapshots, sock, private, control, args.workers, threads,
+                   cpu_affinity=args.cpu_affinity, max_requests=args.max_requests,
+                   max_requests_jitter=args.max_requests_jitter, graceful_timeout=args.graceful_timeout,
+                   log_level=args.log_level).run()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the JewelUX API. With --workers N, loads the models once "
+                                                 "and serves from N forked worker processes (Linux/macOS).")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", "0")),
+                        help="Pre-forked worker processes (0 = single process)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WORKER_THREADS", "0")),
+                        help="Torch/FAISS threads per worker (default: CPU count / workers)")
+    parser.add_argument("--cpu-affinity", action="store_true", default=os.getenv("WORKER_CPU_AFFINITY", "0") == "1",
+                        help="Pin each worker to its own cores")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("WORKER_MAX_REQUESTS", "0")),
+                        help="Replace a worker after this many requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0")),
+                        help="Random extra requests per worker, so they don't all recycle at once")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30")),
+                        help="Seconds a stopping worker may spend finishing its requests")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "debug"))
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        if not hasattr(os, "fork"):
+            sys.exit("--workers needs os.fork() (Linux/macOS); run without it on Windows")
+        serve_prefork(args)
+        sys.exit(0)
+
     try:
-        print("Starting uvicorn on port 8001...", flush=True)
-        uvicorn.run("main:app", host="127.0.0.1", port=8001, reload=False, log_level="debug")
+        print(f"Starting uvicorn on port {args.port}...", flush=True)
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=False, log_level=args.log_level)
     except Exception as e:
         print(f"Failed to start uvicorn: {e}", flush=True)
         import traceback
         traceback.print_exc()
-    import time
     while True:
         time.sleep(1)
-
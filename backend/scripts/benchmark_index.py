@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+# Add root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.index_factory import build_index, search
+
+# Configurations compared by default: (label, build options, search options)
+DEFAULT_CONFIGS = [
+    ("flat", {"index_type": "flat"}, {}),
+    ("ivf_flat nprobe=4", {"index_type": "ivf_flat"}, {"nprobe": 4}),
+    ("ivf_flat nprobe=16", {"index_type": "ivf_flat"}, {"nprobe": 16}),
+    ("ivf_flat nprobe=64", {"index_type": "ivf_flat"}, {"nprobe": 64}),
+    ("ivf_pq m=64 nprobe=16", {"index_type": "ivf_pq", "pq_m": 64}, {"nprobe": 16}),
+    ("ivf_pq m=64 nprobe=64", {"index_type": "ivf_pq", "pq_m": 64}, {"nprobe": 64}),
+    ("hnsw M=32 ef=32", {"index_type": "hnsw", "hnsw_m": 32}, {"ef_search": 32}),
+    ("hnsw M=32 ef=64", {"index_type": "hnsw", "hnsw_m": 32}, {"ef_search": 64}),
+    ("hnsw M=32 ef=128", {"index_type": "hnsw", "hnsw_m": 32}, {"ef_search": 128}),
+]
+
+def load_vectors(args):
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((args.synthetic, 512)).astype('float32')
+    else:
+        vectors = np.array(np.load(args.vectors, mmap_mode="r"), dtype='float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def make_queries(vectors, n_queries, seed):
+    """ Perturbed copies of catalog vectors, so queries look like real (near-duplicate) lookups. """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((len(picks), vectors.shape[1])).astype('float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / float(len(truth) * k)
+
+def benchmark(vectors, queries, k, configs):
+    flat = build_index(vectors, index_type="flat")
+    _, truth = flat.search(queries, k)
+
+    report = []
+    for label, build_opts, search_opts in configs:
+        t0 = time.perf_counter()
+        index = build_index(vectors.copy(), **build_opts)
+        build_s = time.perf_counter() - t0
+
+        # Latency is measured one query at a time, the way the API issues them
+        latencies = []
+        found = []
+        for q in queries:
+            t0 = time.perf_counter()
+            _, I = search(index, q.reshape(1, -1), k, **search_opts)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            found.append(I[0])
+
+        lat = np.array(latencies)
+        report.append({
+            "config": label,
+            "build_s": round(build_s, 3),
+            f"recall@{k}": round(recall_at_k(found, truth, k), 4),
+            "p50_ms": round(float(np.percentile(lat, 50)), 3),
+            "p99_ms": round(float(np.percentile(lat, 99)), 3),
+        })
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of ANN index types against the flat index.")
+    parser.add_argument("--vectors", default="embeddings/image_vectors.npy",
+                        help="Vectors saved by `scripts/index_data.py --export-vectors`")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N random vectors instead of --vectors")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.seed)
+    print(f"Benchmarking {len(vectors)} vectors, {len(queries)} queries, k={args.k}")
+
+    report = benchmark(vectors, queries, args.k, DEFAULT_CONFIGS)
+
+    print(f"{'config':<24}{'build_s':>9}{'recall@' + str(args.k):>12}{'p50_ms':>9}{'p99_ms':>9}")
+    for row in report:
+        print(f"{row['config']:<24}{row['build_s']:>9}{row[f'recall@{args.k}']:>12}{row['p50_ms']:>9}{row['p99_ms']:>9}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
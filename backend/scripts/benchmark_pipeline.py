@@ -0,0 +1,302 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+import faiss
+from PIL import Image
+
+# Add root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils import snapshots
+from utils.index_factory import INDEX_TYPES, build_index, describe_index, search, filtered_search, neighbor_table
+
+METALS = ["gold", "white gold", "rose gold", "silver", "platinum", "yellow gold"]
+STONES = ["diamond", "ruby", "emerald", "sapphire", "pearl", "white stone", "amethyst", "topaz"]
+STYLES = ["vintage", "modern", "minimal", "floral", "halo", "solitaire", "twisted", "engraved", "heart-shaped"]
+CATEGORIES = {"ring": ["ring", "band"], "necklace": ["necklace", "pendant", "chain"],
+              "earring": ["earrings", "studs"], "bracelet": ["bracelet", "bangle"]}
+
+def percentiles(latencies_ms, elapsed_s=None):
+    lat = np.asarray(latencies_ms, dtype=np.float64)
+    if not len(lat):
+        return {"n": 0}
+    report = {
+        "n": int(len(lat)),
+        "mean_ms": round(float(lat.mean()), 3),
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p95_ms": round(float(np.percentile(lat, 95)), 3),
+        "p99_ms": round(float(np.percentile(lat, 99)), 3),
+        "max_ms": round(float(lat.max()), 3),
+    }
+    if elapsed_s:
+        report["qps"] = round(len(lat) / elapsed_s, 2)
+    return report
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# --- Synthetic data ---
+
+def synthetic_description(rng):
+    category = rng.choice(list(CATEGORIES))
+    noun = rng.choice(CATEGORIES[category])
+    words = [rng.choice(STYLES), rng.choice(METALS), noun, "with", rng.choice(STONES)]
+    if rng.random() < 0.5:
+        words += ["and", rng.choice(STONES), "accents"]
+    return category, " ".join(words).capitalize()
+
+def synthetic_queries(n, seed):
+    rng = np.random.default_rng(seed + 1)
+    return [synthetic_description(rng)[1].lower() for _ in range(n)]
+
+def synthetic_images(n, seed, size=256):
+    rng = np.random.default_rng(seed + 2)
+    images = []
+    for _ in range(n):
+        buf = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(buf, format="PNG")
+        images.append(buf.getvalue())
+    return images
+
+def build_synthetic_snapshot(root, n_items, dim, seed, index_options, neighbors=100):
+    """Writes a random catalog + both indices (+ neighbour tables) as a published snapshot under `root`."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_items):
+        category, description = synthetic_description(rng)
+        rows.append({"path": f"synthetic/{i}.jpg", "category": category, "description": description,
+                     "content_hash": f"{i:016x}", "thumbnail": ""})
+
+    build_id = snapshots.new_build_id()
+    paths = snapshots.snapshot_paths(build_id, root)
+    os.makedirs(snapshots.snapshot_dir(build_id, root))
+    for space, key in (("std", "index_std"), ("sbir", "index_sbir")):
+        vectors = rng.standard_normal((n_items, dim)).astype('float32')
+        faiss.normalize_L2(vectors)
+        index = build_index(vectors, **index_options)
+        faiss.write_index(index, paths[key])
+        if neighbors > 0:
+            ids, scores = neighbor_table(index, vectors, neighbors)
+            np.save(paths[f"neighbors_{space}_ids"], ids)
+            np.save(paths[f"neighbors_{space}_scores"], scores)
+    pd.DataFrame(rows).to_csv(paths["items"], index=False)
+    snapshots.write_manifest(build_id, {"build_id": build_id, "items": n_items, "synthetic": True,
+                                        "index_options": index_options, "indices": {"index_std": describe_index(index)}}, root)
+    snapshots.publish(build_id, root)
+    return build_id
+
+# --- Per-stage benchmarks (direct calls, one at a time) ---
+
+def measure(fn, n, warmup=3, setup=None):
+    for i in range(min(warmup, n)):
+        if setup:
+            setup(i)
+        fn(i)
+    latencies = []
+    for i in range(n):
+        if setup:
+            setup(i)
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return percentiles(latencies)
+
+def bench_stages(main, queries, images, args):
+    snap = main.snapshots.active
+    engine = main.engine
+    catalog, hybrid, index = snap.catalog, snap.hybrid, snap.index_std
+    pil_images = [main.decode_upload(data) for data in images]
+
+    q_vecs = engine.get_text_embeddings(queries[:args.stage_iters]).astype('float32')
+    faiss.normalize_L2(q_vecs)
+    hits = [search(index, q_vecs[i:i + 1], 50) for i in range(len(q_vecs))]
+    category_ids = catalog.category_ids("ring")
+    ranked = [hybrid.get_hybrid_scores(queries[i], q_vecs[i], hits[i][1][0], hits[i][0][0], top_k=args.top_k)
+              for i in range(len(q_vecs))]
+
+    n = len(q_vecs)
+    report = {
+        "embed_text": measure(lambda i: engine.encode_texts([queries[i]]), n),
+        "embed_image": measure(lambda i: engine.get_pil_image_embeddings([pil_images[i % len(pil_images)]]), n),
+        f"embed_text_batch{args.batch_size}": measure(
+            lambda i: engine.encode_texts(queries[:args.batch_size]), max(3, n // 10)),
+        "ann_search": measure(lambda i: search(index, q_vecs[i:i + 1], 50), n),
+        "filtered_search": measure(lambda i: filtered_search(index, q_vecs[i:i + 1], 50, category_ids), n),
+        "bm25": measure(lambda i: hybrid.bm25.score_candidates(queries[i].split(), hits[i][1][0]), n),
+        "filter_mask": measure(lambda i: (catalog.category_mask(hits[i][1][0], "ring"),
+                                          catalog.filter_mask(hits[i][1][0], {"description": ["gold"]})), n),
+        "hybrid_no_rerank": measure(lambda i: hybrid.get_hybrid_scores(queries[i], q_vecs[i], hits[i][1][0], hits[i][0][0],
+                                                                       top_k=args.top_k, rerank_pool=0), n),
+        "format": measure(lambda i: main.format_results(ranked[i]), n),
+    }
+
+    reranker = main.reranker
+    if reranker is not None and not args.no_rerank:
+        descriptions = catalog.column('description')
+        def candidates(i):
+            return [{"metadata": {"description": descriptions[idx]}, "score": 0.0, "id": int(idx)}
+                    for idx in hits[i][1][0] if idx >= 0][:args.rerank_pool]
+        # Score cache cleared before every call, so this is the cross-encoder's real cost
+        report[f"rerank{args.rerank_pool}"] = measure(lambda i: reranker.rerank(queries[i], candidates(i), top_k=args.top_k),
+                                                      n, setup=lambda i: reranker.score_cache.clear())
+    return report
+
+# --- Endpoint benchmarks (in-process ASGI, concurrent clients) ---
+
+async def drive(client, make_request, n_requests, concurrency):
+    latencies, errors = [], 0
+    counter = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                r = await make_request(client, i)
+                if r.status_code >= 400:
+                    errors += 1
+                else:
+                    await r.aread()
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+async def bench_endpoints(main, queries, images, args):
+    import httpx
+    rerank = {"rerank_pool": 0} if args.no_rerank else {}
+    n_items = len(main.snapshots.active.catalog)
+    batch = args.batch_size
+
+    endpoints = {
+        "text": lambda c, i: c.post("/search/text", json={"query": queries[i % len(queries)], "top_k": args.top_k, **rerank}),
+        "image": lambda c, i: c.post("/search/image", files={"file": ("q.png", images[i % len(images)], "image/png")},
+                                     data={"top_k": args.top_k}),
+        "sketch": lambda c, i: c.post("/search/sketch", files={"file": ("q.png", images[i % len(images)], "image/png")},
+                                      data={"top_k": args.top_k}),
+        "similar": lambda c, i: c.post("/search/similar", json={"id": i % n_items, "top_k": args.top_k}),
+        "featured": lambda c, i: c.get("/search/featured", params={"count": args.top_k}),
+        f"batch_text{batch}": lambda c, i: c.post("/search/batch/text", json={
+            "queries": [queries[(i * batch + j) % len(queries)] for j in range(batch)], "top_k": args.top_k, **rerank}),
+    }
+    selected = args.endpoints.split(",") if args.endpoints else list(endpoints)
+
+    report = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        for name in selected:
+            report[name] = {}
+            for concurrency in args.concurrency:
+                await drive(client, endpoints[name], min(concurrency * 2, args.requests), concurrency)  # warm-up
+                latencies, errors, elapsed = await drive(client, endpoints[name], args.requests, concurrency)
+                row = {"concurrency": concurrency, "errors": errors, **percentiles(latencies, elapsed)}
+                if name.startswith("batch_text"):
+                    row["queries_per_s"] = round(len(latencies) * batch / elapsed, 2)
+                report[name][str(concurrency)] = row
+                print(f"  {name:<14} c={concurrency:<4} p50={row['p50_ms']:>9}ms p99={row['p99_ms']:>9}ms "
+                      f"qps={row['qps']:>8} errors={errors}", file=sys.stderr)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency/throughput benchmark of the retrieval pipeline on a synthetic catalog.")
+    parser.add_argument("--items", type=int, default=10000, help="Synthetic catalog size")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding size (must match the CLIP model)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--stage-iters", type=int, default=200, help="Calls per stage benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated client concurrency levels")
+    parser.add_argument("--endpoints", default=None, help="Comma-separated subset (default: all)")
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per batched embed / batch request")
+    parser.add_argument("--rerank-pool", type=int, default=100)
+    parser.add_argument("--neighbors", type=int, default=100,
+                        help="Precomputed neighbours per item (0 = /search/similar searches live)")
+    parser.add_argument("--no-rerank", action="store_true", help="Skip the cross-encoder (rerank_pool=0)")
+    parser.add_argument("--with-caches", action="store_true",
+                        help="Keep the embedding/result caches on (default: off, so every call does the work)")
+    parser.add_argument("--skip-stages", action="store_true")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file ('-' for stdout)")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="jewelux-bench-")
+    t0 = time.perf_counter()
+    index_options = {"index_type": args.index_type}
+    build_synthetic_snapshot(os.path.join(workdir, "snapshots"), args.items, args.dim, args.seed, index_options,
+                             args.neighbors)
+    print(f"Synthetic catalog: {args.items} items ({time.perf_counter() - t0:.1f}s) in {workdir}", file=sys.stderr)
+
+    # main reads its configuration at import time
+    os.environ["SNAPSHOT_ROOT"] = os.path.join(workdir, "snapshots")
+    os.environ.setdefault("OCR_PRELOAD", "0")
+    if not args.with_caches:
+        for var in ("TEXT_EMBED_CACHE_SIZE", "IMAGE_EMBED_CACHE_SIZE", "RESULT_CACHE_SIZE", "RERANK_CACHE_SIZE"):
+            os.environ[var] = "0"
+    import main as app_main
+
+    t0 = time.perf_counter()
+    app_main.load_resources()
+    app_main.registry.get("clip")
+    app_main.registry.get("snapshot")
+    try:
+        app_main.registry.get("reranker")
+    except Exception as e:
+        print(f"Reranker unavailable, rerank stage skipped: {e}", file=sys.stderr)
+    startup_s = time.perf_counter() - t0
+
+    queries = synthetic_queries(max(args.stage_iters, args.requests) * 2, args.seed)
+    images = synthetic_images(64, args.seed)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "faiss": faiss.__version__,
+            "inference_backend": app_main.INFERENCE_BACKEND,
+            "index": describe_index(app_main.snapshots.active.index_std),
+        },
+        "startup_s": round(startup_s, 3),
+        "components": app_main.registry.status()["components"],
+    }
+    if not args.skip_stages:
+        print("Stages:", file=sys.stderr)
+        report["stages"] = bench_stages(app_main, queries, images, args)
+        for name, row in report["stages"].items():
+            print(f"  {name:<20} p50={row['p50_ms']:>9}ms p95={row['p95_ms']:>9}ms p99={row['p99_ms']:>9}ms", file=sys.stderr)
+        report["peak_rss_mb_after_stages"] = peak_rss_mb()
+    if not args.skip_endpoints:
+        print("Endpoints:", file=sys.stderr)
+        report["endpoints"] = asyncio.run(bench_endpoints(app_main, queries, images, args))
+    report["peak_rss_mb"] = peak_rss_mb()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
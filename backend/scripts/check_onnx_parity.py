@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import faiss
+from PIL import Image
+
+# Add root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.embedder import CLIPEngine
+from utils.onnx_backend import ONNX_MODEL_DIR
+from utils.index_factory import load_index, search
+from utils.snapshots import current_paths
+
+DEFAULT_QUERIES = [
+    "gold necklace", "diamond ring", "silver bracelet with blue stones", "pearl earrings",
+    "ruby pendant", "emerald bangle", "white stone studs", "rose gold chain",
+]
+
+def cosine_report(reference, candidate):
+    """Per-row cosine similarity between the PyTorch and ONNX embeddings."""
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cos = np.sum(ref * cand, axis=1)
+    return {"n": int(len(cos)), "mean": round(float(cos.mean()), 5), "min": round(float(cos.min()), 5),
+            "p01": round(float(np.percentile(cos, 1)), 5)}
+
+def overlap_at_k(index, reference, candidate, k):
+    """Mean fraction of the top-k ids that both backends' query vectors retrieve."""
+    ref, cand = reference.astype('float32').copy(), candidate.astype('float32').copy()
+    faiss.normalize_L2(ref)
+    faiss.normalize_L2(cand)
+    _, ref_ids = search(index, ref, k)
+    _, cand_ids = search(index, cand, k)
+    k = ref_ids.shape[1]
+    return round(float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_ids, cand_ids)])), 4)
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, round((time.perf_counter() - t0) * 1000, 1)
+
+def load_sample(metadata_path, n_images, n_texts, seed):
+    if not os.path.exists(metadata_path):
+        return [], list(DEFAULT_QUERIES)
+    df = pd.read_csv(metadata_path)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(df), size=min(n_images, len(df)), replace=False) if len(df) else []
+    paths = [p for p in df.iloc[picks]["path"] if os.path.exists(p)] if "path" in df else []
+    descriptions = df["description"].dropna().astype(str).tolist() if "description" in df else []
+    return paths, list(DEFAULT_QUERIES) + descriptions[:max(0, n_texts - len(DEFAULT_QUERIES))]
+
+def check_clip(args, quantized, paths, texts, index):
+    reference = CLIPEngine(text_cache_size=0)
+    onnx = CLIPEngine(text_cache_size=0, backend="onnx", onnx_dir=args.model_dir, quantized=quantized,
+                      threads=args.threads)
+    report = {}
+
+    ref_text, report["text_ms_torch"] = timed(reference.encode_texts, texts)
+    onnx_text, report["text_ms_onnx"] = timed(onnx.encode_texts, texts)
+    report["text_cosine"] = cosine_report(ref_text, onnx_text)
+    if index is not None:
+        report[f"text_overlap@{args.k}"] = overlap_at_k(index, ref_text, onnx_text, args.k)
+
+    if paths:
+        images = [Image.open(p).convert("RGB") for p in paths]
+        ref_img, report["image_ms_torch"] = timed(reference.get_pil_image_embeddings, images)
+        onnx_img, report["image_ms_onnx"] = timed(onnx.get_pil_image_embeddings, images)
+        report["image_cosine"] = cosine_report(ref_img, onnx_img)
+        if index is not None:
+            report[f"image_overlap@{args.k}"] = overlap_at_k(index, ref_img, onnx_img, args.k)
+    return report
+
+def check_reranker(args, quantized, texts):
+    from utils.reranker import Reranker
+    reference = Reranker(cache_size=0)
+    onnx = Reranker(cache_size=0, backend="onnx", onnx_dir=args.model_dir, quantized=quantized, threads=args.threads)
+    documents = texts[len(DEFAULT_QUERIES):] or DEFAULT_QUERIES
+    pairs = [[q, d] for q in DEFAULT_QUERIES for d in documents[:args.rerank_docs]]
+
+    ref_logits, torch_ms = timed(reference._predict, pairs)
+    onnx_logits, onnx_ms = timed(onnx._predict, pairs)
+    ref_logits, onnx_logits = np.asarray(ref_logits).reshape(len(DEFAULT_QUERIES), -1), np.asarray(onnx_logits).reshape(len(DEFAULT_QUERIES), -1)
+    k = min(args.k, ref_logits.shape[1])
+    overlap = np.mean([len(set(np.argsort(-a)[:k]) & set(np.argsort(-b)[:k])) / k for a, b in zip(ref_logits, onnx_logits)])
+    return {"pairs": len(pairs), "ms_torch": torch_ms, "ms_onnx": onnx_ms,
+            "max_abs_logit_diff": round(float(np.abs(ref_logits - onnx_logits).max()), 4),
+            f"overlap@{k}": round(float(overlap), 4)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ONNX (fp32/int8) embeddings and rankings with the PyTorch models.")
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--metadata", default=None, help="Catalog to sample images and descriptions from (default: current snapshot)")
+    parser.add_argument("--index", default=None, help="Index used for the retrieval overlap (default: current snapshot)")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--texts", type=int, default=64)
+    parser.add_argument("--rerank-docs", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--variants", default="int8,fp32", help="Comma-separated: int8, fp32")
+    parser.add_argument("--skip-reranker", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    args.metadata = args.metadata or current_paths()["items"]
+    args.index = args.index or current_paths()["index_std"]
+
+    paths, texts = load_sample(args.metadata, args.images, args.texts, args.seed)
+    index = load_index(args.index) if os.path.exists(args.index) else None
+
+    results = {}
+    for variant in args.variants.split(","):
+        quantized = variant.strip() == "int8"
+        results[variant] = {"clip": check_clip(args, quantized, paths, texts, index)}
+        if not args.skip_reranker:
+            results[variant]["reranker"] = check_reranker(args, quantized, texts)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for variant, report in results.items():
+            print(f"== {variant} ==")
+            for model, values in report.items():
+                for key, value in values.items():
+                    print(f"  {model:<9} {key:<22} {value}")
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import argparse
+import torch
+
+# Add root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.onnx_backend import ONNX_MODEL_DIR, clip_dir, cross_encoder_dir, model_file
+
+DEFAULT_CLIP_MODEL = "ViT-B/32"
+DEFAULT_RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class VisualTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image):
+        return self.model.encode_image(image)
+
+class TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+class SequenceClassifier(torch.nn.Module):
+    """Returns bare logits so the graph has a single tensor output."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).logits
+
+def export_graph(module, args, path, input_names, output_name, dynamic_axes, opset):
+    module.eval()
+    with torch.no_grad():
+        torch.onnx.export(module, args, path, input_names=input_names, output_names=[output_name],
+                          dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+    print(f"Exported {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+def quantize(path, out_path):
+    """
+    Dynamic int8 quantization of the MatMul/Gemm weights (activations are quantized on the fly).
+    Convolutions stay fp32: ConvInteger is slow on most CPUs and CLIP's only conv is the patch embedding.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(path, out_path, weight_type=QuantType.QInt8, op_types_to_quantize=["MatMul", "Gemm"])
+    print(f"Quantized {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+def export_clip(model, out_dir, opset=17, int8=True):
+    """Exports the visual and text towers of a (CPU, fp32) CLIP model with a dynamic batch axis."""
+    os.makedirs(out_dir, exist_ok=True)
+    model = model.float().eval()
+    n_px = model.visual.input_resolution
+    context_length = model.context_length
+
+    export_graph(VisualTower(model), (torch.randn(2, 3, n_px, n_px),), model_file(out_dir, "visual", False),
+                 ["image"], "embedding", {"image": {0: "batch"}, "embedding": {0: "batch"}}, opset)
+    tokens = torch.randint(1, 1000, (2, context_length), dtype=torch.int64)
+    export_graph(TextTower(model), (tokens,), model_file(out_dir, "text", False),
+                 ["tokens"], "embedding", {"tokens": {0: "batch"}, "embedding": {0: "batch"}}, opset)
+
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"input_resolution": n_px, "context_length": context_length,
+                   "embed_dim": int(model.text_projection.shape[1])}, f, indent=2)
+
+    if int8:
+        for part in ("visual", "text"):
+            quantize(model_file(out_dir, part, False), model_file(out_dir, part, True))
+
+def export_cross_encoder(model, tokenizer, out_dir, opset=17, int8=True):
+    """Exports a Hugging Face sequence-classification model (CrossEncoder.model) and saves its tokenizer."""
+    os.makedirs(out_dir, exist_ok=True)
+    features = tokenizer(["a query", "another query"], ["a document", "a longer document text"],
+                         padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in features]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    export_graph(SequenceClassifier(model.float()), tuple(features[name] for name in input_names),
+                 model_file(out_dir, "model", False), input_names, "logits", dynamic_axes, opset)
+    tokenizer.save_pretrained(out_dir)
+
+    if int8:
+        quantize(model_file(out_dir, "model", False), model_file(out_dir, "model", True))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export CLIP and the reranker to ONNX (+ int8) for INFERENCE_BACKEND=onnx.")
+    parser.add_argument("--out-dir", default=ONNX_MODEL_DIR, help="Output directory (ONNX_MODEL_DIR at serving time)")
+    parser.add_argument("--clip-model", default=DEFAULT_CLIP_MODEL)
+    parser.add_argument("--reranker-model", default=DEFAULT_RERANKER_MODEL)
+    parser.add_argument("--skip-clip", action="store_true")
+    parser.add_argument("--skip-reranker", action="store_true")
+    parser.add_argument("--no-quantize", action="store_true", help="Only write the fp32 graphs")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    if not args.skip_clip:
+        import clip
+        clip_model, _ = clip.load(args.clip_model, device="cpu", jit=False)
+        export_clip(clip_model, clip_dir(args.out_dir, args.clip_model), args.opset, not args.no_quantize)
+
+    if not args.skip_reranker:
+        from sentence_transformers import CrossEncoder
+        cross_encoder = CrossEncoder(args.reranker_model, device="cpu")
+        export_cross_encoder(cross_encoder.model, cross_encoder.tokenizer,
+                             cross_encoder_dir(args.out_dir, args.reranker_model), args.opset, not args.no_quantize)
@@ -1,27 +1,164 @@
 import os
 import sys
 import glob
+import time
+import argparse
+import multiprocessing as mp
 import numpy as np
 import faiss
 import pandas as pd
 import cv2
+import torch
 from PIL import Image
 
 # Add root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from utils.embedder import CLIPEngine
+from utils.embedding_store import EmbeddingStore
+from utils.index_factory import INDEX_TYPES, build_index, describe_index, neighbor_table
+from utils import thumbnails
+from utils import snapshots
 
-def generate_edge_map(image_path):
-    """ Converts a real photo into a 'synthetic sketch' using Canny edges. """
-    img = cv2.imread(image_path, 0)
+# Written only with --export-vectors; scripts/benchmark_index.py reads it by default
+VECTORS_EXPORT_PATH = "embeddings/image_vectors.npy"
+
+def edge_map_from_gray(gray):
+    """ Converts a grayscale photo into a 'synthetic sketch' using Canny edges. """
     # Canny detects the outlines of the jewelry
-    edges = cv2.Canny(img, 100, 200)
+    edges = cv2.Canny(gray, 100, 200)
     # Invert to make it black lines on white background (like a drawing)
     return Image.fromarray(cv2.bitwise_not(edges)).convert("RGB")
 
-def index_dataset(data_dir="data/Jewellery_Data/", excel_path="data/Jewellery_Data/jewelry_descriptions.xlsx"):
-    engine = CLIPEngine(model_name="ViT-B/32")
-    
+def generate_edge_map(image_path):
+    """ Converts a real photo into a 'synthetic sketch' using Canny edges. """
+    return edge_map_from_gray(cv2.imread(image_path, 0))
+
+def load_image_pair(image_path):
+    """ Decodes an image once and returns (photo, edge_map) as RGB PIL images. """
+    # Like PIL (and so the query path), leave EXIF orientation unapplied
+    bgr = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if bgr is None:
+        raise ValueError("could not decode image")
+    photo = Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+    edge_img = edge_map_from_gray(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+    return photo, edge_img
+
+def join_descriptions(image_paths, df_desc):
+    """
+    Joins the description sheet onto the image list in one merge (keyed on file name).
+    Returns a DataFrame with path/category/description in `image_paths` order.
+    """
+    sheet = df_desc[['Image', 'Description', 'Category']]
+
+    # Report sheet rows that share a file name as one batch; the first row wins
+    dup_mask = sheet['Image'].duplicated(keep=False)
+    if dup_mask.any():
+        dup_names = sorted(sheet.loc[dup_mask, 'Image'].unique())
+        print(f"⚠️ {len(dup_names)} image names appear more than once in the sheet (using the first row): "
+              f"{', '.join(dup_names[:20])}{' ...' if len(dup_names) > 20 else ''}")
+    sheet = sheet.drop_duplicates(subset='Image', keep='first')
+
+    images = pd.DataFrame({'path': image_paths})
+    images['Image'] = images['path'].map(os.path.basename)
+    joined = images.merge(sheet, on='Image', how='left', validate='many_to_one')
+
+    unmatched = joined['Description'].isna() & joined['Category'].isna()
+    if unmatched.any():
+        names = joined.loc[unmatched, 'Image'].tolist()
+        print(f"⚠️ {len(names)} images have no row in the description sheet: "
+              f"{', '.join(names[:20])}{' ...' if len(names) > 20 else ''}")
+
+    return pd.DataFrame({
+        'path': joined['path'],
+        'category': joined['Category'].fillna("Item").astype(str),
+        'description': joined['Description'].fillna("Jewelry").astype(str),
+    })
+
+# --- Worker pool ---
+# Each worker holds its own copy of the CLIP preprocess transform and turns a
+# (file path, thumbnail path) job into the two tensors the batched forward passes
+# need, writing the thumbnail from the same decoded image.
+_worker_preprocess = None
+
+def _set_preprocess(preprocess):
+    global _worker_preprocess
+    _worker_preprocess = preprocess
+
+def _init_worker(preprocess):
+    _set_preprocess(preprocess)
+    # Workers only do decoding/resizing; keep torch from spawning a thread per core in each one
+    torch.set_num_threads(1)
+
+def _prepare_item(job):
+    path, thumb_path = job
+    try:
+        photo, edge_img = load_image_pair(path)
+        if thumb_path and not os.path.exists(thumb_path):
+            thumbnails.write_thumbnail(photo, thumb_path)
+        photo_t = _worker_preprocess(photo).numpy()
+        edge_t = _worker_preprocess(edge_img).numpy()
+        return path, photo_t, edge_t, None
+    except Exception as e:
+        return path, None, None, str(e)
+
+def _make_thumbnail(job):
+    path, thumb_path = job
+    try:
+        with Image.open(path) as img:
+            thumbnails.write_thumbnail(img, thumb_path)
+        return path, None
+    except Exception as e:
+        return path, str(e)
+
+def _run_jobs(fn, jobs, workers, initializer=None, initargs=()):
+    # `initializer` only sets up pool processes; in-process jobs run with the caller's state
+    if workers <= 0:
+        for job in jobs:
+            yield fn(job)
+        return
+
+    chunksize = max(1, min(64, len(jobs) // (workers * 4) or 1))
+    with mp.Pool(processes=workers, initializer=initializer, initargs=initargs) as pool:
+        for result in pool.imap(fn, jobs, chunksize=chunksize):
+            yield result
+
+def iter_prepared(jobs, preprocess, workers):
+    """ Yields (path, photo_tensor, edge_tensor, error) for (path, thumb_path) jobs, in input order. """
+    if workers <= 0:
+        # Same process as the CLIP passes: no thread cap here
+        _set_preprocess(preprocess)
+    return _run_jobs(_prepare_item, jobs, workers, initializer=_init_worker, initargs=(preprocess,))
+
+def ensure_thumbnails(image_paths, hashes, workers):
+    """ Writes thumbnails missing for already-embedded images (e.g. after the folder was cleared). """
+    os.makedirs(thumbnails.THUMBNAIL_DIR, exist_ok=True)
+    jobs = [(p, thumbnails.thumbnail_path(hashes[p])) for p in image_paths
+            if not os.path.exists(thumbnails.thumbnail_path(hashes[p]))]
+    if not jobs:
+        return
+    print(f"🖼️ Generating {len(jobs)} missing thumbnails...")
+    for path, error in _run_jobs(_make_thumbnail, jobs, workers):
+        if error is not None:
+            print(f"Thumbnail error on {path}: {error}")
+
+def write_index_atomic(index, path):
+    tmp = path + ".tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+def write_vectors_atomic(vectors, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, vectors)
+    os.replace(tmp, path)
+
+def index_dataset(data_dir="data/Jewellery_Data/", excel_path="data/Jewellery_Data/jewelry_descriptions.xlsx",
+                  batch_size=32, workers=None, chunk_size=1024, full_rebuild=False, index_options=None,
+                  snapshot_root=snapshots.SNAPSHOT_ROOT, keep_snapshots=3, neighbors=100, export_vectors=None):
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 2) - 1)
+
     # Load Excel
     if os.path.exists(excel_path):
         df_desc = pd.read_excel(excel_path)
@@ -35,55 +172,205 @@ def index_dataset(data_dir="data/Jewellery_Data/", excel_path="data/Jewellery_Da
     image_paths = []
     for ext in ['*.jpg', '*.png', '*.jpeg']:
         image_paths.extend(glob.glob(os.path.join(data_dir, "**", ext), recursive=True))
-    
-    photo_embs = []
-    sbir_embs = []
-    metadata = []
-
-    print(f"🚀 Processing {len(image_paths)} images for Standard + SBIR Indexing...")
-
-    for path in image_paths:
-        try:
-            fname = os.path.basename(path)
-            match = df_desc[df_desc['Image'] == fname]
-            desc = str(match['Description'].values[0]) if not match.empty else "Jewelry"
-            cat = str(match['Category'].values[0]) if not match.empty else "Item"
-
-            # 1. Standard Photo Embedding
-            photo_embs.append(engine.get_image_embedding(path))
-            
-            # 2. SBIR (Edge Map) Embedding
-            edge_img = generate_edge_map(path)
-            sbir_embs.append(engine.get_image_embedding(edge_img))
-
-            metadata.append({"path": path, "category": cat, "description": desc})
-        except Exception as e:
-            print(f"Error on {path}: {e}")
-            continue
+    image_paths = sorted(set(image_paths))
+
+    # Metadata join happens up front, so problems show up before any embedding work
+    item_meta = join_descriptions(image_paths, df_desc)
+
+    # --- Incremental plan: only new/changed files get embedded ---
+    store = EmbeddingStore("embeddings/cache", model_name="ViT-B/32")
+    if full_rebuild:
+        store.remove(list(store.items))
+    hashes, to_embed, removed = store.plan(image_paths)
+    store.remove(removed)
+    print(f"📋 {len(image_paths)} images: {len(to_embed)} to embed, "
+          f"{len(hashes) - len(to_embed)} unchanged, {len(removed)} removed")
+
+    if to_embed:
+        engine = CLIPEngine(model_name="ViT-B/32")
+        embed_images(engine, to_embed, hashes, store, batch_size=batch_size, workers=workers, chunk_size=chunk_size)
+    store.save_manifest()
+    store.collect_garbage()
+
+    # Items that failed to decode never make it into the store and are left out of the index
+    indexed_paths = [p for p in image_paths if p in store.items]
+    if not indexed_paths:
+        print("❌ No images were embedded.")
+        return
+
+    ensure_thumbnails(indexed_paths, hashes, workers)
+    metadata = item_meta.set_index('path').loc[indexed_paths].reset_index()
+    metadata['content_hash'] = [hashes[p] for p in indexed_paths]
+    metadata['thumbnail'] = [thumbnails.thumbnail_path(hashes[p]) for p in indexed_paths]
+
+    photo_arr, sbir_arr = store.gather(indexed_paths)
+
+    index_options = index_options or {}
 
     # Create Standard Index
-    photo_arr = np.array(photo_embs).astype('float32')
     faiss.normalize_L2(photo_arr)
-    photo_index = faiss.IndexFlatIP(512)
-    photo_index.add(photo_arr)
-    
+    photo_index = build_index(photo_arr, **index_options)
+    print(f"   Standard index: {describe_index(photo_index)}")
+
     # Create SBIR Index
-    sbir_arr = np.array(sbir_embs).astype('float32')
     faiss.normalize_L2(sbir_arr)
-    sbir_index = faiss.IndexFlatIP(512)
-    sbir_index.add(sbir_arr)
-
-    # Save Everything
-    os.makedirs("embeddings", exist_ok=True)
-    os.makedirs("metadata", exist_ok=True)
-    
-    faiss.write_index(photo_index, "embeddings/faiss_index.bin")
-    faiss.write_index(sbir_index, "embeddings/faiss_sbir_index.bin") # <--- CRITICAL FIX
-    
-    pd.DataFrame(metadata).to_csv("metadata/items.csv", index=False)
-    np.save("embeddings/image_vectors.npy", photo_arr)
-    
-    print(f"✅ DONE! Created 'faiss_index.bin' and 'faiss_sbir_index.bin'")
+    sbir_index = build_index(sbir_arr, **index_options)
+    print(f"   SBIR index: {describe_index(sbir_index)}")
+
+    # Save Everything into a fresh snapshot directory; servers only see it once CURRENT points at it
+    build_id = snapshots.new_build_id()
+    paths = snapshots.snapshot_paths(build_id, snapshot_root)
+    os.makedirs(snapshots.snapshot_dir(build_id, snapshot_root))
+
+    write_index_atomic(photo_index, paths["index_std"])
+    write_index_atomic(sbir_index, paths["index_sbir"]) # <--- CRITICAL FIX
+    metadata.to_csv(paths["items"], index=False)
+
+    # Top-N neighbour tables: /search/similar becomes an array lookup instead of a live search
+    if neighbors > 0:
+        for space, index, vectors in (("std", photo_index, photo_arr), ("sbir", sbir_index, sbir_arr)):
+            t0 = time.perf_counter()
+            ids, scores = neighbor_table(index, vectors, neighbors)
+            np.save(paths[f"neighbors_{space}_ids"], ids)
+            np.save(paths[f"neighbors_{space}_scores"], scores)
+            print(f"   {space} neighbour table: top-{ids.shape[1]} for {len(ids)} items in {time.perf_counter() - t0:.1f}s")
+    # Only offline tools (scripts/benchmark_index.py) read this; the server reconstructs from the index
+    if export_vectors:
+        write_vectors_atomic(photo_arr, export_vectors)
+        print(f"   Exported {len(photo_arr)} photo vectors to {export_vectors}")
+
+    snapshots.write_manifest(build_id, {
+        "build_id": build_id,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "items": len(indexed_paths),
+        "model": "ViT-B/32",
+        "data_dir": data_dir,
+        "index_options": index_options,
+        "neighbors": neighbors,
+        "indices": {"index_std": describe_index(photo_index), "index_sbir": describe_index(sbir_index)},
+        "files": {key: {"name": os.path.basename(path), "bytes": os.path.getsize(path)}
+                  for key, path in paths.items() if os.path.exists(path)},
+    }, snapshot_root)
+    snapshots.publish(build_id, snapshot_root)
+    removed = snapshots.prune(keep_snapshots, snapshot_root)
+
+    # Thumbnails are shared by content hash; keep every one a retained snapshot still references
+    live_thumbs = set(metadata['thumbnail'])
+    for retained in snapshots.list_snapshots(snapshot_root):
+        items_csv = snapshots.snapshot_paths(retained, snapshot_root)["items"]
+        if retained != build_id and os.path.exists(items_csv):
+            live_thumbs.update(pd.read_csv(items_csv, usecols=lambda c: c == "thumbnail").get("thumbnail", []))
+    thumbnails.collect_garbage(live_thumbs)
+
+    print(f"✅ DONE! Published snapshot {build_id} with {len(indexed_paths)} items"
+          + (f" (pruned {len(removed)} old snapshots)" if removed else ""))
+    print("   Running servers pick it up via POST /admin/reload (or SNAPSHOT_WATCH_INTERVAL)")
+
+def embed_images(engine, image_paths, hashes, store, batch_size=32, workers=1, chunk_size=1024):
+    """ Embeds `image_paths` and checkpoints them into `store` every `chunk_size` images. """
+    print(f"🚀 Processing {len(image_paths)} images for Standard + SBIR Indexing "
+          f"(batch_size={batch_size}, workers={workers})...")
+
+    batch_photos, batch_edges, batch_paths = [], [], []
+    chunk_photo, chunk_sbir, chunk_paths = [], [], []
+    done = 0
+
+    def flush_batch():
+        if not batch_paths:
+            return
+        # 1. Standard Photo Embedding / 2. SBIR (Edge Map) Embedding, one forward pass each
+        chunk_photo.append(engine.get_image_embeddings(batch_photos))
+        chunk_sbir.append(engine.get_image_embeddings(batch_edges))
+        chunk_paths.extend(batch_paths)
+        batch_photos.clear()
+        batch_edges.clear()
+        batch_paths.clear()
+
+    def flush_chunk():
+        flush_batch()
+        if not chunk_paths:
+            return
+        store.add_chunk(chunk_paths, hashes, np.concatenate(chunk_photo), np.concatenate(chunk_sbir))
+        chunk_photo.clear()
+        chunk_sbir.clear()
+        chunk_paths.clear()
+
+    start = time.perf_counter()
+    last_report = start
+    os.makedirs(thumbnails.THUMBNAIL_DIR, exist_ok=True)
+    jobs = [(p, thumbnails.thumbnail_path(hashes[p])) for p in image_paths]
+    for path, photo_t, edge_t, error in iter_prepared(jobs, engine.preprocess, workers):
+        if error is not None:
+            print(f"Error on {path}: {error}")
+            continue
+
+        batch_photos.append(photo_t)
+        batch_edges.append(edge_t)
+        batch_paths.append(path)
+        done += 1
+
+        if len(batch_paths) >= batch_size:
+            flush_batch()
+        if len(chunk_paths) >= chunk_size:
+            flush_chunk()
+
+        now = time.perf_counter()
+        if now - last_report >= 10:
+            print(f"   {done}/{len(image_paths)} images ({done / (now - start):.1f} img/s)")
+            last_report = now
+    flush_chunk()
+
+    elapsed = time.perf_counter() - start
+    print(f"⏱️ Embedded {done} images in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} img/s)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the standard + SBIR FAISS indices for the jewelry catalog.")
+    parser.add_argument("--data-dir", default="data/Jewellery_Data/")
+    parser.add_argument("--excel-path", default="data/Jewellery_Data/jewelry_descriptions.xlsx")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per CLIP forward pass")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Decode/preprocess worker processes (0 = run in the main process)")
+    parser.add_argument("--chunk-size", type=int, default=1024,
+                        help="Images per checkpoint written to embeddings/cache")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="Ignore the embedding cache and re-embed every image")
+    parser.add_argument("--snapshot-root", default=snapshots.SNAPSHOT_ROOT,
+                        help="Where versioned builds are written (snapshots/<build_id>/ + CURRENT)")
+    parser.add_argument("--keep-snapshots", type=int, default=3,
+                        help="Snapshots to keep, the published one included; older ones are deleted (0 = keep all)")
+    parser.add_argument("--neighbors", type=int, default=100,
+                        help="Precomputed neighbours per item for /search/similar (0 = none, always search live)")
+    parser.add_argument("--export-vectors", nargs="?", const=VECTORS_EXPORT_PATH, default=None, metavar="PATH",
+                        help=f"Also save the normalized photo vectors for scripts/benchmark_index.py "
+                             f"(default path: {VECTORS_EXPORT_PATH})")
+
+    ann = parser.add_argument_group("ANN index")
+    ann.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    ann.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(N))")
+    ann.add_argument("--nprobe", type=int, default=16, help="IVF lists probed per query (stored in the index)")
+    ann.add_argument("--pq-m", type=int, default=64, help="IVF-PQ sub-quantizers (must divide 512)")
+    ann.add_argument("--pq-bits", type=int, default=8)
+    ann.add_argument("--hnsw-m", type=int, default=32)
+    ann.add_argument("--ef-construction", type=int, default=40)
+    ann.add_argument("--ef-search", type=int, default=64, help="HNSW search depth (stored in the index)")
+    return parser.parse_args()
+
+def index_options_from_args(args):
+    return {
+        "index_type": args.index_type,
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        "pq_m": args.pq_m,
+        "pq_bits": args.pq_bits,
+        "hnsw_m": args.hnsw_m,
+        "ef_construction": args.ef_construction,
+        "ef_search": args.ef_search,
+    }
 
 if __name__ == "__main__":
-    index_dataset()
\ No newline at end of file
+    args = parse_args()
+    index_dataset(args.data_dir, args.excel_path, batch_size=args.batch_size, workers=args.workers,
+                  chunk_size=args.chunk_size, full_rebuild=args.full_rebuild,
+                  index_options=index_options_from_args(args),
+                  snapshot_root=args.snapshot_root, keep_snapshots=args.keep_snapshots, neighbors=args.neighbors,
+                  export_vectors=args.export_vectors)
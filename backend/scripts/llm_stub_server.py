@@ -0,0 +1,84 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.query_cleaner import LocalQueryCleaner
+
+RAW_TEXT_RE = re.compile(r'Raw OCR Text: "(.*)"', re.S)
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal OpenAI-compatible POST /v1/chat/completions. Answers the query-cleaning prompt with
+    the local cleaner's output, after an optional delay and with an optional failure rate, so the
+    timeout / fallback / cache paths of /search/handwriting can be exercised offline.
+    """
+    cleaner = LocalQueryCleaner()
+    latency_ms = 0.0
+    fail_rate = 0.0
+    bad_json_rate = 0.0
+    calls = 0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        StubHandler.calls += 1
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        time.sleep(self.latency_ms / 1000.0)
+        if random.random() < self.fail_rate:
+            return self._send(500, {"error": {"message": "stub failure"}})
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        match = RAW_TEXT_RE.search(prompt)
+        query, category = self.cleaner.clean(match.group(1) if match else prompt)
+        content = "not json" if random.random() < self.bad_json_rate else json.dumps({"query": query, "category": category})
+        self._send(200, {
+            "id": f"stub-{StubHandler.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub for the handwriting query cleaner. "
+                                                 "Point the API at it with LLM_BASE_URL=http://HOST:PORT/v1 LLM_API_KEY=stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay before each answer (test LLM_TIMEOUT)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of calls answered with HTTP 500")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="Share of calls answered with non-JSON content")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    StubHandler.latency_ms = args.latency_ms
+    StubHandler.fail_rate = args.fail_rate
+    StubHandler.bad_json_rate = args.bad_json_rate
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"LLM stub listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add backend root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.hybrid import InvertedBM25, HybridSearcher
+from utils.pagination import SearchWindow
+from utils import snapshots
+
+CORPUS = [
+    "gold ring with diamond".split(),
+    "silver ring".split(),
+    "gold necklace gold chain".split(),
+    "ring ring ring".split(),
+    "pearl earrings".split(),
+    "gold bracelet with ring clasp".split(),
+    "vintage silver brooch".split(),
+]
+
+@pytest.mark.parametrize("query", [
+    "gold ring",           # "ring" is in 4 of 7 documents: negative idf, epsilon floor applies
+    "ring ring",           # repeated terms count again
+    "diamond",
+    "pearl silver gold",
+    "platinum",            # no matches
+])
+def test_bm25_matches_rank_bm25(query):
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    reference = rank_bm25.BM25Okapi(CORPUS).get_scores(query.split())
+    matched, scores = InvertedBM25(CORPUS).score_matching(query.split())
+    ours = np.zeros(len(CORPUS))
+    ours[matched] = scores
+    np.testing.assert_allclose(ours, reference, rtol=1e-5, atol=1e-6)
+
+def test_bm25_epsilon_floor():
+    bm25 = InvertedBM25(CORPUS)
+    # df 4 of 7 gives a negative raw idf, floored to epsilon * mean idf
+    assert bm25.idf[bm25.vocab["ring"]] > 0
+    assert np.isclose(bm25.idf[bm25.vocab["ring"]], 0.25 * np.mean(
+        np.log(len(CORPUS) - np.diff(bm25.offsets) + 0.5) - np.log(np.diff(bm25.offsets) + 0.5)))
+
+def make_searcher(n=400, dim=16, seed=0, reranker=None):
+    rng = np.random.default_rng(seed)
+    words = ["gold", "silver", "ring", "necklace", "diamond", "pearl", "vintage", "modern", "chain", "stud"]
+    df = pd.DataFrame({
+        "description": [" ".join(rng.choice(words, size=5)) for _ in range(n)],
+        "category": rng.choice(["ring", "necklace", "earring"], size=n),
+    })
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return HybridSearcher(df, reranker=reranker), vectors
+
+def make_reranker():
+    pytest.importorskip("sentence_transformers")
+    from utils.reranker import Reranker
+    reranker = Reranker.__new__(Reranker)
+    # Deterministic logits instead of the cross-encoder
+    reranker.score = lambda query, candidates: [
+        float(len(set(query.split()) & set(c["metadata"]["description"].split()))) - 1.5
+        for c in candidates]
+    return reranker
+
+@pytest.mark.parametrize("use_reranker", [False, True])
+def test_cursor_pages_are_unique_and_non_increasing(use_reranker):
+    searcher, vectors = make_searcher(reranker=make_reranker() if use_reranker else None)
+    query_text = "gold diamond ring"
+    q_vec = vectors[7] + 0.3 * np.random.default_rng(1).standard_normal(vectors.shape[1]).astype(np.float32)
+
+    def extend(k, seen, context):
+        # Exact ANN search at depth k, then scoring of the unseen hits (as main.extend_window)
+        sims = vectors @ q_vec
+        hits = np.argsort(-sims, kind="stable")[:k]
+        fresh = ~np.isin(hits, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+        ranked = searcher.get_hybrid_scores(query_text, q_vec, hits[fresh], sims[hits][fresh],
+                                            rerank_pool=20, window=context)
+        return ranked, len(hits)
+
+    window = SearchWindow(extend, initial_k=25, max_k=len(vectors))
+    served, offset, has_more = [], 0, True
+    while has_more:
+        items, has_more = window.page(offset, 10)
+        served.extend(items)
+        offset += 10
+
+    ids = [item["id"] for item in served]
+    scores = [item["score"] for item in served]
+    assert len(ids) == len(set(ids)) == len(vectors)
+    assert all(a >= b for a, b in zip(scores, scores[1:]))
+
+def make_builds(root, build_ids):
+    for build_id in build_ids:
+        os.makedirs(os.path.join(root, build_id))
+        with open(os.path.join(root, build_id, snapshots.MANIFEST_FILE), "w") as f:
+            json.dump({"build_id": build_id}, f)
+
+@pytest.mark.parametrize("keep", [1, 2, 3, 5])
+def test_prune_keeps_newest_including_current(tmp_path, keep):
+    root = str(tmp_path)
+    builds = ["b1", "b2", "b3", "b4", "b5"]
+    make_builds(root, builds)
+    snapshots.publish("b5", root)
+    removed = snapshots.prune(keep, root)
+    assert snapshots.list_snapshots(root) == builds[-keep:]
+    assert removed == builds[:-keep]
+
+def test_prune_never_removes_current(tmp_path):
+    root = str(tmp_path)
+    make_builds(root, ["b1", "b2", "b3", "b4"])
+    # Rolled back to an older build
+    snapshots.publish("b2", root)
+    snapshots.prune(2, root)
+    assert snapshots.list_snapshots(root) == ["b2", "b4"]
+    assert snapshots.prune(0, root) == []
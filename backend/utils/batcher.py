@@ -0,0 +1,132 @@
+# batcher.py - Dynamic micro-batching: coalesces concurrent single-item calls into one batched call.
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+class MicroBatcher:
+    """
+    Queues items from concurrent callers and runs them through `batch_fn` together.
+
+    A batch is dispatched as soon as it holds `max_batch_size` items, or `max_wait_ms`
+    after its first item arrived, whichever comes first. `batch_fn` receives a list of
+    items and must return one result per item, in order.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._items_total = 0
+        self._batches_total = 0
+        self._max_queue_depth = 0
+        self._histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+        self._start_worker()
+        # Threads don't survive fork(): a pre-fork worker (run.py --workers) needs its own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+        self._worker.start()
+
+    def _after_fork(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._start_worker()
+
+    def submit(self, item):
+        """Enqueues one item; returns a concurrent.futures.Future for its result."""
+        future = Future()
+        self._queue.put((item, future))
+        depth = self._queue.qsize()
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return future
+
+    def submit_many(self, items):
+        return [self.submit(item) for item in items]
+
+    def __call__(self, item):
+        """Blocking call, for use from worker threads."""
+        return self.submit(item).result()
+
+    async def run_async(self, item):
+        """Awaitable call, for use from the event loop."""
+        return await asyncio.wrap_future(self.submit(item))
+
+    async def run_many_async(self, items):
+        return await asyncio.gather(*(asyncio.wrap_future(f) for f in self.submit_many(items)))
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Skip items whose caller already gave up
+            batch = [(item, fut) for item, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self._record(len(batch))
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                for (_, fut), result in zip(batch, results):
+                    fut.set_result(result)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # One bad item must not fail its whole batch: retry each on its own
+                for item, fut in batch:
+                    if fut.done():
+                        continue
+                    try:
+                        fut.set_result(self.batch_fn([item])[0])
+                    except Exception as item_error:
+                        fut.set_exception(item_error)
+
+    def _record(self, size):
+        bucket = len(BATCH_SIZE_BUCKETS)
+        for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= bound:
+                bucket = i
+                break
+        with self._lock:
+            self._items_total += size
+            self._batches_total += 1
+            self._histogram[bucket] += 1
+
+    def stats(self):
+        with self._lock:
+            labels = [f"<={b}" for b in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "items_total": self._items_total,
+                "batches_total": self._batches_total,
+                "mean_batch_size": round(self._items_total / self._batches_total, 2) if self._batches_total else 0.0,
+                "batch_size_histogram": dict(zip(labels, self._histogram)),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
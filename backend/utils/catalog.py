@@ -0,0 +1,85 @@
+# catalog.py - Columnar, read-only item metadata (one NumPy array per column).
+import numpy as np
+import pandas as pd
+
+class Catalog:
+    """
+    Item metadata stored column-wise, indexed by the same row ids as the FAISS indices.
+
+    Categories are dictionary-encoded to integer codes, so category filtering over a
+    set of hits is a single vectorized comparison. Row dicts are only built on demand,
+    for the handful of items that actually get returned.
+    """
+
+    def __init__(self, df):
+        self.columns = list(df.columns)
+        self._size = len(df)
+        self._values = {col: df[col].to_numpy(dtype=object) for col in self.columns}
+        self._lower = {}
+
+        categories = self._normalized("category") if "category" in self.columns else np.full(self._size, "", dtype=object)
+        codes, names = pd.factorize(pd.Series(categories, dtype=object))
+        self.category_codes = codes.astype(np.int32)
+        self.category_names = list(names)
+        self._category_lookup = {name: code for code, name in enumerate(self.category_names)}
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path))
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def empty(self):
+        return self._size == 0
+
+    def _normalized(self, col):
+        """Lower-cased, stripped string view of a column (cached)."""
+        if col not in self._lower:
+            values = self._values.get(col)
+            if values is None:
+                self._lower[col] = np.full(self._size, "", dtype=object)
+            else:
+                self._lower[col] = pd.Series(values, dtype=object).fillna("").astype(str).str.lower().str.strip().to_numpy(dtype=object)
+        return self._lower[col]
+
+    def column(self, col):
+        return self._values[col]
+
+    def category_code(self, category):
+        """Integer code of a category name, or -1 if no item has it."""
+        return self._category_lookup.get(str(category).lower().strip(), -1)
+
+    def category_ids(self, category):
+        """All row ids in a category (sorted)."""
+        return np.flatnonzero(self.category_codes == self.category_code(category))
+
+    def category_mask(self, ids, category):
+        code = self.category_code(category)
+        if code < 0:
+            return np.zeros(len(ids), dtype=bool)
+        return self.category_codes[ids] == code
+
+    def filter_mask(self, ids, filters):
+        """
+        Attribute filters as {column: [values]}: an item passes if, for every column,
+        it contains at least one of the values (case-insensitive substring).
+        """
+        mask = np.ones(len(ids), dtype=bool)
+        for key, required_values in (filters or {}).items():
+            if not required_values:
+                continue
+            column = self._normalized(key)[ids].astype(str)
+            any_match = np.zeros(len(ids), dtype=bool)
+            for val in required_values:
+                any_match |= np.char.find(column, str(val).lower()) >= 0
+            mask &= any_match
+        return mask
+
+    def row(self, idx):
+        """One item as a plain dict (like DataFrame.iloc[idx].to_dict())."""
+        return {col: self._values[col][idx] for col in self.columns}
+
+    def rows(self, ids):
+        return [self.row(idx) for idx in ids]
@@ -4,11 +4,23 @@ import clip
 from PIL import Image
 import cv2
 import numpy as np
+from utils.cache import LRUCache, normalize_text
 
 class CLIPEngine:
-    def __init__(self, model_name="ViT-B/32"):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = clip.load(model_name, device=self.device)
+    def __init__(self, model_name="ViT-B/32", text_cache_size=4096, backend="torch", onnx_dir=None,
+                 quantized=True, threads=None):
+        self.backend = backend
+        if backend == "onnx":
+            # CPU-only: exported (optionally int8) towers run in ONNX Runtime; no PyTorch weights are loaded
+            from utils.onnx_backend import ONNX_MODEL_DIR, OnnxCLIP, clip_dir
+            self.device = "cpu"
+            self.model = OnnxCLIP(clip_dir(onnx_dir or ONNX_MODEL_DIR, model_name), quantized, threads)
+            self.preprocess = self.model.preprocess
+        else:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model, self.preprocess = clip.load(model_name, device=self.device)
+        # Popular queries are typed again and again; their embeddings never change for a given model
+        self.text_cache = LRUCache("text_embedding", maxsize=text_cache_size)
 
     def get_image_embedding(self, image_path_or_pil):
         if isinstance(image_path_or_pil, str):
@@ -20,24 +32,57 @@ class CLIPEngine:
             embedding = self.model.encode_image(image)
         return embedding.cpu().numpy().flatten()
 
-    def get_sketch_embedding(self, pil_image):
+    def get_image_embeddings(self, image_tensors):
+        """Batched forward pass over already-preprocessed image tensors (N, 3, H, W)."""
+        if not isinstance(image_tensors, torch.Tensor):
+            image_tensors = torch.as_tensor(np.stack(image_tensors))
+        with torch.no_grad():
+            embeddings = self.model.encode_image(image_tensors.to(self.device))
+        return embeddings.float().cpu().numpy()
+
+    def get_pil_image_embeddings(self, images):
+        """Batched embedding of a list of PIL images."""
+        return self.get_image_embeddings(torch.stack([self.preprocess(img) for img in images]))
+
+    def sketch_to_image(self, pil_image):
         """
         SBIR Logic: Cleans the user's hand-drawing to match indexed edges.
         """
         # Convert to OpenCV format
-        img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2GRAY)
+        img = cv2.cvtColor(np.array(pil_image.convert("RGB")), cv2.COLOR_RGB2GRAY)
         # Remove paper noise (Thresholding)
         _, thresh = cv2.threshold(img, 180, 255, cv2.THRESH_BINARY_INV)
         # Normalize line thickness (Dilation)
         kernel = np.ones((2,2), np.uint8)
         processed = cv2.dilate(thresh, kernel, iterations=1)
         # Convert back to white background/black lines for CLIP
-        final_img = Image.fromarray(cv2.bitwise_not(processed)).convert("RGB")
-        return self.get_image_embedding(final_img)
+        return Image.fromarray(cv2.bitwise_not(processed)).convert("RGB")
+
+    def get_sketch_embedding(self, pil_image):
+        return self.get_image_embedding(self.sketch_to_image(pil_image))
 
     def get_text_embedding(self, text):
+        return self.get_text_embeddings([text])[0]
+
+    def cached_text_embedding(self, text):
+        """Cached embedding for `text`, or None (without running the model)."""
+        return self.text_cache.get(normalize_text(text))
+
+    def get_text_embeddings(self, texts):
+        """Batched text embedding; returns an (N, 512) float32 array. Only cache misses hit the model."""
+        embeddings = [self.text_cache.get(normalize_text(t)) for t in texts]
+        missing = [i for i, vec in enumerate(embeddings) if vec is None]
+        if missing:
+            for i, vec in zip(missing, self.encode_texts([texts[i] for i in missing])):
+                embeddings[i] = vec
+        return np.stack(embeddings)
+
+    def encode_texts(self, texts):
+        """Runs the text tower (no cache lookup) and stores the results in the text cache."""
         # Truncate text to 77 tokens to prevent CLIP crash
-        text_tokens = clip.tokenize([text], truncate=True).to(self.device)
+        text_tokens = clip.tokenize(list(texts), truncate=True).to(self.device)
         with torch.no_grad():
-            embedding = self.model.encode_text(text_tokens)
-        return embedding.cpu().numpy().flatten()
\ No newline at end of file
+            embeddings = self.model.encode_text(text_tokens).float().cpu().numpy()
+        for text, vec in zip(texts, embeddings):
+            self.text_cache.set(normalize_text(text), vec)
+        return embeddings
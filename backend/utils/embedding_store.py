@@ -0,0 +1,143 @@
+# embedding_store.py - On-disk, chunked cache of image embeddings keyed by file path + content hash.
+import os
+import json
+import hashlib
+import numpy as np
+
+MANIFEST_VERSION = 1
+
+def content_hash(path, block_size=1 << 20):
+    """SHA-1 of the file contents."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _atomic_write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+class EmbeddingStore:
+    """
+    Keeps photo + SBIR embeddings in numbered .npz chunks with a JSON manifest.
+
+    The manifest maps every indexed file path to its content hash and its (chunk, row)
+    location. It is rewritten after every chunk, so an interrupted run loses at most
+    one chunk of work and the next run only embeds what is new or changed.
+    """
+
+    def __init__(self, cache_dir="embeddings/cache", model_name="ViT-B/32"):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.items = {}
+        self.next_chunk = 0
+        self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not read embedding manifest ({e}), starting fresh")
+            return
+
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("model") != self.model_name:
+            print("Embedding manifest is for a different model/format, re-embedding everything")
+            return
+        self.items = manifest.get("items", {})
+        self.next_chunk = manifest.get("next_chunk", 0)
+
+    def save_manifest(self):
+        _atomic_write_json(self.manifest_path, {
+            "version": MANIFEST_VERSION,
+            "model": self.model_name,
+            "next_chunk": self.next_chunk,
+            "items": self.items,
+        })
+
+    def _chunk_path(self, chunk_name):
+        return os.path.join(self.cache_dir, chunk_name + ".npz")
+
+    def file_hash(self, path):
+        """Content hash of `path`, reusing the manifest's hash when size and mtime are unchanged."""
+        st = os.stat(path)
+        entry = self.items.get(path)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+            return entry["hash"]
+        return content_hash(path)
+
+    def plan(self, image_paths):
+        """
+        Splits the current file list into (hashes, to_embed, removed).
+        `hashes` maps every current path to its content hash.
+        """
+        hashes = {}
+        to_embed = []
+        for path in image_paths:
+            try:
+                digest = self.file_hash(path)
+            except OSError as e:
+                print(f"Error hashing {path}: {e}")
+                continue
+            hashes[path] = digest
+            entry = self.items.get(path)
+            if entry is None or entry["hash"] != digest or not os.path.exists(self._chunk_path(entry["chunk"])):
+                to_embed.append(path)
+
+        removed = [p for p in self.items if p not in hashes]
+        return hashes, to_embed, removed
+
+    def add_chunk(self, paths, hashes, photo_embs, sbir_embs):
+        """Persists one chunk of embeddings, then records it in the manifest."""
+        chunk_name = f"chunk_{self.next_chunk:06d}"
+        tmp = self._chunk_path(chunk_name) + ".tmp.npz"
+        np.savez(tmp, photo=np.asarray(photo_embs, dtype=np.float32), sbir=np.asarray(sbir_embs, dtype=np.float32))
+        os.replace(tmp, self._chunk_path(chunk_name))
+
+        for row, path in enumerate(paths):
+            st = os.stat(path)
+            self.items[path] = {
+                "hash": hashes[path],
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "chunk": chunk_name,
+                "row": row,
+            }
+        self.next_chunk += 1
+        self.save_manifest()
+
+    def remove(self, paths):
+        for path in paths:
+            self.items.pop(path, None)
+
+    def collect_garbage(self):
+        """Deletes chunk files that no manifest entry points to any more."""
+        live = {entry["chunk"] for entry in self.items.values()}
+        for fname in os.listdir(self.cache_dir):
+            if fname.startswith("chunk_") and fname.endswith(".npz") and fname[:-4] not in live:
+                os.remove(os.path.join(self.cache_dir, fname))
+
+    def gather(self, paths):
+        """Returns (photo, sbir) float32 arrays for `paths`, in that order."""
+        photo = np.zeros((len(paths), 512), dtype=np.float32)
+        sbir = np.zeros((len(paths), 512), dtype=np.float32)
+
+        by_chunk = {}
+        for i, path in enumerate(paths):
+            entry = self.items[path]
+            by_chunk.setdefault(entry["chunk"], []).append((i, entry["row"]))
+
+        for chunk_name, rows in by_chunk.items():
+            with np.load(self._chunk_path(chunk_name)) as chunk:
+                dst = np.array([r[0] for r in rows])
+                src = np.array([r[1] for r in rows])
+                photo[dst] = chunk["photo"][src]
+                sbir[dst] = chunk["sbir"][src]
+        return photo, sbir
@@ -1,93 +1,300 @@
+from collections import Counter
 import numpy as np
-from rank_bm25 import BM25Okapi
+from utils.catalog import Catalog
+from utils.tracing import span
+
+class InvertedBM25:
+    """
+    Okapi BM25 over an array-backed inverted index (same scoring as rank_bm25.BM25Okapi).
+
+    Postings are stored CSR-style: for term t, doc ids and term frequencies live in
+    doc_ids[offsets[t]:offsets[t+1]] / tfs[...], sorted by doc id. IDF and the
+    per-document length norm are precomputed, so a query only touches the postings
+    of its own terms instead of scoring the whole corpus.
+    """
+
+    def __init__(self, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.n_docs = len(corpus)
+        self.vocab = {}
+
+        postings = {}
+        doc_len = np.zeros(self.n_docs, dtype=np.float32)
+        for doc_id, tokens in enumerate(corpus):
+            doc_len[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        offsets = [0]
+        doc_ids, tfs = [], []
+        for term_id, (term, plist) in enumerate(postings.items()):
+            self.vocab[term] = term_id
+            doc_ids.extend(d for d, _ in plist)
+            tfs.extend(tf for _, tf in plist)
+            offsets.append(len(doc_ids))
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.tfs = np.asarray(tfs, dtype=np.float32)
+
+        # IDF with BM25Okapi's epsilon floor for very common terms
+        df = np.diff(self.offsets).astype(np.float64)
+        idf = np.log(self.n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        self.idf = idf.astype(np.float32)
+
+        avgdl = float(doc_len.mean()) if self.n_docs and doc_len.sum() > 0 else 1.0
+        self.doc_norm = (k1 * (1 - b + b * doc_len / avgdl)).astype(np.float32)
+
+    def _postings(self, tokens):
+        """(doc_ids, contributions) of every posting touched by the query; repeated terms count again."""
+        term_ids = [self.vocab[t] for t in tokens if t in self.vocab]
+        if not term_ids:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        docs, contribs = [], []
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            d = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            docs.append(d)
+            contribs.append(self.idf[t] * (tf * (self.k1 + 1) / (tf + self.doc_norm[d])))
+        return np.concatenate(docs), np.concatenate(contribs)
+
+    def score_matching(self, tokens):
+        """Sorted doc ids that contain any query term, with their BM25 scores."""
+        docs, contribs = self._postings(tokens)
+        if len(docs) == 0:
+            return docs, contribs
+        matched, inverse = np.unique(docs, return_inverse=True)
+        return matched, np.bincount(inverse, weights=contribs).astype(np.float32)
+
+    def score_candidates(self, tokens, candidates):
+        """BM25 scores for `candidates` only, plus the best score over the whole corpus (for normalization)."""
+        candidates = np.asarray(candidates, dtype=np.int64)
+        matched, scores = self.score_matching(tokens)
+        out = np.zeros(len(candidates), dtype=np.float32)
+        if len(matched) == 0:
+            return out, 0.0
+        pos = np.clip(np.searchsorted(matched, candidates), 0, len(matched) - 1)
+        hit = matched[pos] == candidates
+        out[hit] = scores[pos[hit]]
+        return out, float(scores.max())
+
+    def score_candidates_batch(self, token_lists, candidates):
+        """
+        score_candidates() for Q queries at once. `candidates` is a (Q, K) id matrix; postings of
+        all queries are scored in one pass keyed by (query row, doc id). Returns (Q, K) scores and
+        each query's best score over the whole corpus.
+        """
+        candidates = np.asarray(candidates, dtype=np.int64)
+        out = np.zeros(candidates.shape, dtype=np.float32)
+        maxima = np.zeros(len(token_lists), dtype=np.float32)
+
+        keys, contribs = [], []
+        for q, tokens in enumerate(token_lists):
+            docs, c = self._postings(tokens)
+            keys.append(q * self.n_docs + docs.astype(np.int64))
+            contribs.append(c)
+        keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+        if len(keys) == 0:
+            return out, maxima
+        matched, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contribs)).astype(np.float32)
+        np.maximum.at(maxima, matched // self.n_docs, scores)
+
+        cand_keys = np.arange(len(token_lists), dtype=np.int64)[:, None] * self.n_docs + candidates
+        pos = np.clip(np.searchsorted(matched, cand_keys), 0, len(matched) - 1)
+        # Out-of-range ids (FAISS -1 padding) would alias a neighbouring query's key
+        hit = (matched[pos] == cand_keys) & (candidates >= 0) & (candidates < self.n_docs)
+        out[hit] = scores[pos[hit]]
+        return out, maxima
+
+    def top_k(self, tokens, k):
+        """Direct lexical retrieval: the k best-scoring doc ids and their scores."""
+        matched, scores = self.score_matching(tokens)
+        if len(matched) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            matched, scores = matched[part], scores[part]
+        order = np.argsort(-scores, kind="stable")
+        return matched[order], scores[order]
 
 class HybridSearcher:
-    def __init__(self, metadata_df, reranker=None):
-        self.df = metadata_df
+    def __init__(self, catalog, reranker=None):
+        # Accept a Catalog or (for scripts/notebooks) the raw items.csv DataFrame
+        self.catalog = catalog if isinstance(catalog, Catalog) else Catalog(catalog)
         # Use the 'description' column created by the indexer
-        self.corpus = [str(d).lower().split() for d in self.df['description'].fillna("").tolist()]
-        self.bm25 = BM25Okapi(self.corpus)
+        self.corpus = [str(d).lower().split() for d in self.catalog.column('description')]
+        self.bm25 = InvertedBM25(self.corpus)
         self.reranker = reranker
 
-    def get_hybrid_scores(self, query_text, query_vec, visual_indices, visual_scores, top_k=10, category_filter=None, filters=None):
-        # 1. Broad Retrieval Phase
-        # If we have a reranker, fetch more items initially (e.g. 100) to give the reranker a good pool
-        search_k = 100 if self.reranker else top_k
+    def _results(self, ids, scores):
+        with span("rows"):
+            return [{"metadata": self.catalog.row(idx), "score": float(score), "id": int(idx)}
+                    for idx, score in zip(ids, scores)]
 
-        if not query_text or query_text.strip() == "":
-            # If no text, just return visual matches (filtering if needed)
-            results = []
-            for i, idx in enumerate(visual_indices):
-                if idx >= len(self.df): continue
-                item = self.df.iloc[idx].to_dict()
-                if category_filter and str(item.get('category', '')).lower() != category_filter.lower():
-                    continue
-                results.append({"metadata": item, "score": float(visual_scores[i])})
-            return results[:min(len(results), top_k)]
-
-        query_tokens = query_text.lower().split()
-        bm25_scores = self.bm25.get_scores(query_tokens)
-        
-        if np.max(bm25_scores) > 0:
-            bm25_scores = bm25_scores / np.max(bm25_scores)
+    @staticmethod
+    def _scored(ids, scores):
+        return [{"id": int(idx), "score": float(score)} for idx, score in zip(ids, scores)]
 
-        final_ranked_results = []
-        for i, idx in enumerate(visual_indices):
-            v_score = visual_scores[i]
-            
-            # Safety check: ensure FAISS index matches BM25 corpus size
-            if idx >= len(bm25_scores):
-                continue
+    @staticmethod
+    def _capped(items, window):
+        """
+        Caps each score at the lowest one the window has shown so far. Items are appended in rank
+        order, so scores never rise from one item (or page) to the next, even where an unreranked
+        tail or a deeper search would put them on a different scale.
+        """
+        floor = window.get("score_floor", float("inf"))
+        for item in items:
+            floor = min(floor, item["score"])
+            item["score"] = floor
+        if items:
+            window["score_floor"] = floor
+        return items
+
+    def get_hybrid_scores(self, query_text, query_vec, visual_indices, visual_scores, top_k=10, category_filter=None, filters=None,
+                          rerank_pool=None, window=None):
+        """
+        Ranked top_k of the FAISS candidates. With `window` (pagination: the SearchWindow's context
+        dict) every valid candidate is returned instead, as {"id", "score"} without metadata: the
+        reranked pool first, then the rest in hybrid order. The first pool's score calibration is
+        kept in `window` and reused by later widenings.
+        """
+        # 1. Broad Retrieval Phase
+        # If we have a reranker, fetch more items initially (e.g. 100) to give the reranker a good pool.
+        # Latency-sensitive callers can shrink the pool (rerank_pool=0 skips reranking).
+        search_k = (100 if rerank_pool is None else max(0, int(rerank_pool))) if self.reranker else top_k
+
+        ids = np.asarray(visual_indices, dtype=np.int64).reshape(-1)
+        v_scores = np.asarray(visual_scores, dtype=np.float32).reshape(-1)
 
-            item = self.df.iloc[idx].to_dict()
+        with span("filter"):
+            # Safety check: ensure FAISS ids are inside the catalog (and skip FAISS -1 padding)
+            valid = (ids >= 0) & (ids < len(self.catalog))
 
             # --- METADATA FILTERING ---
-            # If a category is detected (e.g. "ring"), penalize or exclude other categories
+            # If a category is detected (e.g. "ring"), exclude other categories (strict filtering)
             if category_filter:
-                item_category = str(item.get('category', '')).lower().strip()
-                if item_category != category_filter.lower():
-                    continue # Strict filtering: Skip items that don't match
+                valid[valid] &= self.catalog.category_mask(ids[valid], category_filter)
 
             # --- ADVANCED FILTERS ---
             if filters:
-                skip_item = False
-                for key, required_values in filters.items():
-                    if not required_values: continue
-                    item_val = str(item.get(key, '')).lower()
-                    match_found = False
-                    for val in required_values:
-                        if str(val).lower() in item_val:
-                            match_found = True
-                            break
-                    if not match_found:
-                        skip_item = True
-                        break
-                if skip_item:
-                    continue
-                
-            k_score = bm25_scores[idx]
-            
+                valid[valid] &= self.catalog.filter_mask(ids[valid], filters)
+
+            ids, v_scores = ids[valid], v_scores[valid]
+
+        if window is not None:
+            top_k = len(ids)
+            results = lambda i, s: self._capped(self._scored(i, s), window)
+        else:
+            results = self._results
+
+        if not query_text or query_text.strip() == "":
+            # If no text, just return visual matches in FAISS order
+            return results(ids[:top_k], v_scores[:top_k])
+
+        with span("bm25"):
+            query_tokens = query_text.lower().split()
+            # Only the FAISS candidates are scored; the max still covers the whole corpus
+            bm25_scores, bm25_max = self.bm25.score_candidates(query_tokens, ids)
+
+            if bm25_max > 0:
+                bm25_scores = bm25_scores / bm25_max
+
             # Adjusted Weights: 40% Visual, 60% Keyword
-            total_score = (v_score * 0.4 + (k_score * 0.6))
-            
-            final_ranked_results.append({
-                "metadata": item,
-                "score": total_score,
-                "id": idx
-            })
-
-        # Sort by initial hybrid score
-        final_ranked_results.sort(key=lambda x: x['score'], reverse=True)
+            total_scores = v_scores * 0.4 + bm25_scores * 0.6
+
+            # Sort by initial hybrid score
+            order = np.argsort(-total_scores, kind="stable")
         
         # 2. Reranking Phase
-        if self.reranker and query_text.strip():
-            # Slice top candidates for reranking - use safer slicing
-            pool_size = min(len(final_ranked_results), search_k)
-            candidates_to_rerank = final_ranked_results[:pool_size]
+        if self.reranker and search_k > 0 and query_text.strip():
+            # Slice top candidates for reranking; the reranker only needs descriptions
+            pool = order[:search_k]
+            descriptions = self.catalog.column('description')
+            candidates_to_rerank = [
+                {"metadata": {"description": descriptions[ids[i]]}, "score": float(total_scores[i]), "id": int(ids[i])}
+                for i in pool
+            ]
             
             if candidates_to_rerank:
-                # Reranker returns sorted list
-                reranked_results = self.reranker.rerank(query_text, candidates_to_rerank, top_k=top_k)
+                # Reranker returns sorted list; full metadata only for what we return
+                with span("rerank"):
+                    reranked_results = self.reranker.rerank(query_text, candidates_to_rerank, top_k=top_k,
+                                                            calibration=(window or {}).get("calibration"))
+                if window is not None:
+                    if "calibration" not in window:
+                        window["calibration"] = self.reranker.calibration(reranked_results[0]['rerank_score'])
+                    tail = order[len(pool):]
+                    return self._capped(
+                        self._scored([r['id'] for r in reranked_results], [r['score'] for r in reranked_results]) +
+                        self._scored(ids[tail], total_scores[tail]), window)
+                with span("rows"):
+                    for res in reranked_results:
+                        res['metadata'] = self.catalog.row(res['id'])
                 return reranked_results
             
-        return final_ranked_results[:min(len(final_ranked_results), top_k)] 
\ No newline at end of file
+        top = order[:top_k]
+        return results(ids[top], total_scores[top])
+
+    def get_hybrid_scores_batch(self, query_texts, visual_indices, visual_scores, top_k=10, category_filters=None,
+                                rerank_pool=None):
+        """
+        get_hybrid_scores() for a batch: (Q, K) FAISS ids/scores in, one ranked list per query out.
+        Validity and category masks, BM25 and the score blend run over the whole matrix at once,
+        and the reranker gets the pairs of every query in one go.
+        """
+        search_k = (100 if rerank_pool is None else max(0, int(rerank_pool))) if self.reranker else top_k
+
+        ids = np.asarray(visual_indices, dtype=np.int64)
+        v_scores = np.asarray(visual_scores, dtype=np.float32)
+        valid = (ids >= 0) & (ids < len(self.catalog))
+        safe_ids = np.where(valid, ids, 0)
+
+        if category_filters is not None:
+            filtered = np.array([bool(c) for c in category_filters])
+            codes = np.array([self.catalog.category_code(c) if c else -1 for c in category_filters])
+            valid &= ~filtered[:, None] | (self.catalog.category_codes[safe_ids] == codes[:, None])
+
+        texts = [t if t and t.strip() else "" for t in query_texts]
+        has_text = np.array([bool(t) for t in texts])
+        with span("bm25"):
+            bm25_scores, bm25_max = self.bm25.score_candidates_batch([t.lower().split() for t in texts], safe_ids)
+            bm25_scores /= np.where(bm25_max > 0, bm25_max, 1.0)[:, None]
+
+        # Adjusted Weights: 40% Visual, 60% Keyword (text-less queries keep the visual score)
+        total_scores = np.where(has_text[:, None], v_scores * 0.4 + bm25_scores * 0.6, v_scores)
+        # Text-less rows keep FAISS order; invalid candidates sort last
+        sort_key = np.where(valid, np.where(has_text[:, None], -total_scores, 0.0), np.inf)
+        order = np.argsort(sort_key, axis=1, kind="stable")
+        n_valid = valid.sum(axis=1)
+
+        results = [None] * len(texts)
+        rerank_rows, rerank_candidates, pool_sizes = [], [], []
+        descriptions = self.catalog.column('description')
+        for q in range(len(texts)):
+            if self.reranker and search_k > 0 and has_text[q] and n_valid[q]:
+                pool = order[q, :min(search_k, n_valid[q])]
+                rerank_rows.append(q)
+                pool_sizes.append(len(pool))
+                rerank_candidates.append([
+                    {"metadata": {"description": descriptions[ids[q, i]]}, "score": float(total_scores[q, i]),
+                     "id": int(ids[q, i])}
+                    for i in pool
+                ])
+            else:
+                top = order[q, :min(top_k, n_valid[q])]
+                results[q] = self._results(ids[q, top], total_scores[q, top])
+
+        if rerank_rows:
+            with span("rerank"):
+                reranked = self.reranker.rerank_many([texts[q] for q in rerank_rows], rerank_candidates, top_k=top_k)
+            for q, n_pool, ranked in zip(rerank_rows, pool_sizes, reranked):
+                for res in ranked:
+                    res['metadata'] = self.catalog.row(res['id'])
+                # top_k beyond the pool: the rest in hybrid order, scored no higher than the reranked items
+                tail = order[q, n_pool:min(top_k, n_valid[q])]
+                if len(tail):
+                    ranked += self._capped(self._results(ids[q, tail], total_scores[q, tail]),
+                                           {"score_floor": ranked[-1]['score']})
+                results[q] = ranked
+        return results
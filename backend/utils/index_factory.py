@@ -0,0 +1,175 @@
+# index_factory.py - Builds and queries the FAISS indices used for photo and SBIR retrieval.
+import math
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Defaults used when the caller doesn't pass a value
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+# Filtered searches over at most this many ids skip the ANN structure and scan them exactly
+EXACT_FILTER_MAX = 4096
+
+def default_nlist(n_vectors):
+    """Rule of thumb: ~4*sqrt(N) lists, but keep >= 39 training points per list."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+def build_index(vectors, index_type="flat", nlist=None, nprobe=DEFAULT_NPROBE, pq_m=64, pq_bits=8,
+                hnsw_m=32, ef_construction=40, ef_search=DEFAULT_EF_SEARCH):
+    """
+    Builds (and trains, where needed) an inner-product index over L2-normalized `vectors`.
+    Falls back to a flat index when there are too few vectors to train the requested type.
+    """
+    n, d = vectors.shape
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        min_train = max(nlist, 2 ** pq_bits if index_type == "ivf_pq" else 1)
+        if n < min_train:
+            print(f"Warning: {n} vectors is too few to train {index_type} (need {min_train}), using flat")
+            index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    else:
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_bits, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.nprobe = min(nprobe, nlist)
+
+    index.add(vectors)
+
+    # IVF indices need a direct map so single items can be reconstructed by id
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index
+
+def load_index(path, mmap=True):
+    """
+    Reads an index, memory-mapping its vector storage when FAISS supports it for that
+    index type, so several processes share one page-cache copy instead of a heap copy each.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+
+    flags = faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    # IVF inverted lists can only be mapped by some FAISS builds; fall back to reading them
+    for io_flags in (flags | faiss.IO_FLAG_MMAP, flags):
+        try:
+            return faiss.read_index(path, io_flags)
+        except RuntimeError:
+            continue
+    return faiss.read_index(path)
+
+def describe_index(index):
+    """Short, JSON-friendly description of an index and its baked-in search parameters."""
+    info = {"type": "flat", "ntotal": int(index.ntotal), "dim": int(index.d)}
+    if isinstance(index, faiss.IndexHNSW):
+        info.update(type="hnsw", M=int(index.hnsw.nb_neighbors(1)), efSearch=int(index.hnsw.efSearch))
+    elif isinstance(index, faiss.IndexIVF):
+        info.update(type="ivf_pq" if isinstance(index, faiss.IndexIVFPQ) else "ivf_flat",
+                    nlist=int(index.nlist), nprobe=int(index.nprobe))
+    return info
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """Per-call FAISS SearchParameters; None when the index defaults apply."""
+    if isinstance(index, faiss.IndexIVF):
+        if nprobe is None and sel is None:
+            return None
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(nprobe if nprobe is not None else index.nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        if ef_search is None and sel is None:
+            return None
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search if ef_search is not None else index.hnsw.efSearch)
+    else:
+        if sel is None:
+            return None
+        params = faiss.SearchParameters()
+    if sel is not None:
+        params.sel = sel
+    return params
+
+def search(index, queries, k, nprobe=None, ef_search=None, sel=None):
+    """index.search with optional runtime nprobe / efSearch overrides."""
+    k = max(1, min(int(k), index.ntotal))
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+def make_id_selector(ids):
+    """IDSelectorBatch over `ids` (FAISS copies them, so the array needn't outlive it)."""
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+
+def exact_search(index, queries, k, ids):
+    """Brute-force inner product over just `ids`, using vectors reconstructed from the index."""
+    ids = np.asarray(ids, dtype=np.int64)
+    k = min(int(k), len(ids))
+    n = len(queries)
+    if k <= 0:
+        return np.zeros((n, 0), dtype=np.float32), np.zeros((n, 0), dtype=np.int64)
+    vectors = index.reconstruct_batch(ids)
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(top_scores, order, axis=1).astype(np.float32), ids[top]
+
+def filtered_search(index, queries, k, ids, sel=None, nprobe=None, ef_search=None):
+    """
+    Top-k restricted to `ids` (e.g. one category), so results are never emptied by post-filtering.
+
+    Small id sets are scanned exactly; larger ones use an IDSelector inside the ANN search,
+    falling back to the exact scan if the ANN walk couldn't fill k results.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    k = min(int(k), len(ids))
+    if k <= 0 or len(ids) <= EXACT_FILTER_MAX:
+        return exact_search(index, queries, k, ids)
+
+    if sel is None:
+        sel = make_id_selector(ids)
+    D, I = search(index, queries, k, nprobe=nprobe, ef_search=ef_search, sel=sel)
+    if (I < 0).any():
+        return exact_search(index, queries, k, ids)
+    return D, I
+
+def neighbor_table(index, vectors, n, batch_size=4096, nprobe=None, ef_search=None):
+    """
+    Top-n neighbours of every indexed vector (itself excluded), by batched search of the whole
+    matrix against `index`. Returns (ids int32, scores float16), both (N, n); rows padded with
+    -1 ids where the ANN walk found fewer. `vectors` must be the L2-normalized index contents,
+    in index order.
+    """
+    total = len(vectors)
+    n = max(0, min(int(n), index.ntotal - 1))
+    ids = np.full((total, n), -1, dtype=np.int32)
+    scores = np.zeros((total, n), dtype=np.float16)
+    if n == 0:
+        return ids, scores
+    for start in range(0, total, batch_size):
+        batch = np.ascontiguousarray(vectors[start:start + batch_size], dtype=np.float32)
+        D, I = search(index, batch, n + 1, nprobe=nprobe, ef_search=ef_search)
+        rows = np.arange(start, start + len(batch))
+        # Drop the item itself, or the last hit when the ANN walk missed it
+        drop = I == rows[:, None]
+        drop[~drop.any(axis=1), -1] = True
+        keep = ~drop
+        ids[rows] = I[keep].reshape(len(batch), n)
+        scores[rows] = D[keep].reshape(len(batch), n)
+    return ids, scores
@@ -0,0 +1,77 @@
+# landing.py - Catalog landing page data (featured items, tag suggestions), built once per snapshot.
+import json
+import random
+import numpy as np
+
+# Shown while no catalog (or no description) is available
+FALLBACK_TAGS = ["Gold Necklace", "Diamond Ring", "Silver Bracelet", "Pearl Earrings"]
+ARTICLES = ["A ", "An ", "The ", "a ", "an ", "the "]
+MAX_TAG_LENGTH = 45
+
+def clean_tag(description):
+    """Short, capitalized suggestion from a description ('A gold ring ...' -> 'Gold ring ...'), or None."""
+    if not isinstance(description, str):
+        return None
+    text = description.strip()
+    # Remove starting articles
+    for prefix in ARTICLES:
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+            break
+    if not text:
+        return None
+    # Capitalize first letter
+    text = text[0].upper() + text[1:]
+    # Truncate if too long (ellipses)
+    if len(text) > MAX_TAG_LENGTH:
+        text = text[:MAX_TAG_LENGTH - 3] + "..."
+    return text
+
+def _text(value, default=""):
+    return value if isinstance(value, str) else default
+
+def featured_item(item_id, row):
+    """One item in the /search/featured (SearchResponseItem) shape, without inline image."""
+    return {
+        "id": int(item_id),
+        "score": 1.0,
+        "category": _text(row.get('category'), 'Unknown'),
+        "description": _text(row.get('description')),
+        "image_url": f"/images/{int(item_id)}",
+        "image_base64": None,
+        "path": _text(row.get('path')),
+    }
+
+class LandingData:
+    """
+    Featured items pre-serialized as one JSON blob (plus byte offsets per item), so any
+    limit/offset page is a slice, and the cleaned, de-duplicated tag suggestion pool.
+    """
+
+    def __init__(self, catalog):
+        parts = [json.dumps(featured_item(i, catalog.row(i))).encode("utf-8") + b"," for i in range(len(catalog))]
+        self._blob = b"".join(parts)
+        self._offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in parts], out=self._offsets[1:])
+
+        descriptions = catalog.column('description') if 'description' in catalog.columns else []
+        self.tags = list(dict.fromkeys(tag for tag in map(clean_tag, descriptions) if tag))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def featured_chunks(self, offset=0, limit=None, chunk_size=256):
+        """JSON array of items [offset, offset + limit), yielded in byte chunks of `chunk_size` items."""
+        end = len(self) if limit is None else min(len(self), offset + limit)
+        yield b"["
+        for start in range(offset, end, chunk_size):
+            stop = min(end, start + chunk_size)
+            chunk = self._blob[self._offsets[start]:self._offsets[stop]]
+            # Every item carries a trailing comma; the array's last one must go
+            yield chunk[:-1] if stop == end else chunk
+        yield b"]"
+
+    def sample_tags(self, count=5):
+        if not self.tags:
+            return []
+        return random.sample(self.tags, min(len(self.tags), max(0, count)))
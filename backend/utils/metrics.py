@@ -0,0 +1,141 @@
+# metrics.py - Minimal in-process Prometheus metrics: histograms, counters and scrape-time gauges.
+import bisect
+import threading
+
+# Seconds; covers sub-millisecond FAISS lookups up to multi-second OCR/LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(pairs):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per tuple of label values."""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, extra=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, n) for labels, (counts, total, n) in self._series.items()]
+        for labelvalues, counts, total, n in sorted(series):
+            pairs = list(extra) + list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {n}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self, extra=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            pairs = list(extra) + list(zip(self.labelnames, labelvalues))
+            lines.append(f"{self.name}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Owns the metrics and renders them in the Prometheus text format (version 0.0.4).
+
+    Values that already live elsewhere (cache counters, queue depths, index sizes) are read
+    at scrape time by collectors: functions returning (name, type, help, samples) tuples,
+    where samples is a list of ({label: value}, number).
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self, labels=None):
+        """The exposition; `labels` (e.g. {"worker": "0"}) are added to every sample."""
+        extra = list((labels or {}).items())
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(extra))
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for sample_labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(extra + list(sample_labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def merge_expositions(texts):
+    """
+    One exposition from those of several processes (whose samples differ by a label such as
+    worker): each family's HELP/TYPE once, followed by the samples of every process.
+    """
+    heads, samples = {}, {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                name = line.split(" ", 3)[2]
+                heads.setdefault(name, [])
+                samples.setdefault(name, [])
+                if len(heads[name]) < 2:
+                    heads[name].append(line)
+            elif line and name is not None:
+                samples[name].append(line)
+    return "".join("\n".join(heads[name] + samples[name]) + "\n" for name in heads)
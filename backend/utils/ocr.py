@@ -1,85 +1,118 @@
-import os
+import time
 import cv2
 import numpy as np
 import torch
 from PIL import Image
 # from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-from openai import OpenAI
-from dotenv import load_dotenv
-
-# Path-aware loading: This finds the .env in the root folder automatically
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-load_dotenv(dotenv_path=dotenv_path)
+from utils.tracing import span
 
 class OCRManager:
-    def __init__(self):
+    """
+    Handwriting OCR: downscale -> enhance (CLAHE, denoise, threshold) -> split into text lines ->
+    one batched TrOCR generate over all lines.
+
+    Uploads are first scaled so handwritten characters are about `text_height` px tall
+    (never enlarged, and never larger than `max_side`): the denoiser's cost grows with the
+    pixel count, and TrOCR resizes every line to 384 px anyway. Decoding is greedy by
+    default (`num_beams` > 1 for beam search), capped at `max_new_tokens` per line.
+    """
+
+    def __init__(self, query_cleaner=None, model_id="microsoft/trocr-small-handwritten", text_height=32,
+                 max_side=1600, segment_lines=True, max_lines=8, num_beams=1, max_new_tokens=32):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model_id = model_id
         self.processor = None
         self.model = None
-        
-        # 2. Initialize LLM Client (Replace with your credentials)
-        # os.getenv pulls the values from your .env file
-        api_key = os.getenv("LLM_API_KEY")
-        base_url = os.getenv("LLM_BASE_URL")
+        # Optional blocking cleaner raw_text -> (query, category), used by extract_text(use_llm=True).
+        # The API cleans asynchronously instead (utils/query_cleaner.py).
+        self.query_cleaner = query_cleaner
+        self.text_height = text_height
+        self.max_side = max_side
+        self.segment_lines = segment_lines
+        self.max_lines = max(1, max_lines)
+        self.num_beams = max(1, num_beams)
+        self.max_new_tokens = max_new_tokens
 
-        if not api_key:
-            print("❌ WARNING: LLM_API_KEY not found in .env file")
+    def estimate_text_height(self, gray):
+        """Median height (px) of character-sized ink blobs, measured on a small copy; None if none found."""
+        h, w = gray.shape
+        probe_scale = min(1.0, 800.0 / max(h, w))
+        small = cv2.resize(gray, (max(1, int(w * probe_scale)), max(1, int(h * probe_scale))),
+                           interpolation=cv2.INTER_AREA) if probe_scale < 1.0 else gray
+        _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        # Skip specks and page-sized blobs (shadows, borders)
+        heights = heights[(areas >= 4) & (heights >= 2) & (heights < small.shape[0] * 0.5)]
+        if len(heights) == 0:
+            return None
+        return float(np.median(heights)) / probe_scale
 
-        self.llm_client = OpenAI(
-            api_key=api_key, 
-            base_url=base_url
-        )
+    def downscale(self, gray):
+        """Scales the page so characters are ~text_height px tall (only ever shrinks). Returns (image, scale)."""
+        h, w = gray.shape
+        scale = min(1.0, self.max_side / max(h, w))
+        text_h = self.estimate_text_height(gray)
+        if text_h:
+            scale = min(scale, self.text_height / text_h)
+        if scale >= 1.0:
+            return gray, 1.0
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), scale
 
-    def preprocess_image(self, pil_image):
-        """Advanced OpenCV preprocessing for noisy handwriting."""
-        img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
+    def enhance(self, gray):
+        """Advanced OpenCV preprocessing for noisy handwriting (on the downscaled page)."""
         # CLAHE for contrast, Denoising, and Adaptive Thresholding
         clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
         enhanced = clahe.apply(gray)
         denoised = cv2.fastNlMeansDenoising(enhanced, h=20)
-        th = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 25, 12)
-        
+        return cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 25, 12)
+
+    def preprocess_image(self, pil_image):
+        """Downscaled, enhanced page as a PIL image (the whole-page input of the old pipeline)."""
+        gray = cv2.cvtColor(np.array(pil_image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+        th = self.enhance(self.downscale(gray)[0])
         return Image.fromarray(cv2.cvtColor(th, cv2.COLOR_GRAY2RGB))
 
-    def clean_query_with_llm(self, raw_text):
-        """Uses LLM to correct OCR errors and extract category."""
-        prompt = f"""
-        You are a jewelry search assistant. Your task is to clean up noisy OCR text extracted from a handwritten note AND detect the jewelry category.
-        
-        RULES:
-        1. Correct spelling errors (e.g., 'diomond' -> 'diamond', 'neklace' -> 'necklace').
-        2. Standardize terms: Use 'ring', 'necklace', 'earring', 'bracelet', 'bangle'.
-        3. Standardize stones: Use 'diamond', 'ruby', 'emerald', 'sapphire', 'white stone'.
-        4. Remove noise (special characters, random letters).
-        5. Output a VALID JSON object with two fields: "query" (cleaned text) and "category" (one of: ring, necklace, bracelet, earring, or null if unknown).
-
-        Raw OCR Text: "{raw_text}"
-        
-        Output JSON:"""
+    def segment_lines_of(self, th):
+        """
+        Text-line crops of a thresholded page (dark ink on white), top to bottom, from the
+        horizontal ink profile. Falls back to the whole page when no line stands out.
+        """
+        ink = th < 128
+        h, w = ink.shape
+        rows = ink.sum(axis=1) > max(1, int(0.005 * w))
+        # Runs of inked rows
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+        runs = list(zip(edges[::2], edges[1::2]))
+        if not runs:
+            return [th]
+        # Merge runs split by small gaps (dots, descenders), then drop specks
+        min_gap = max(2, int(0.3 * self.text_height))
+        merged = [list(runs[0])]
+        for start, end in runs[1:]:
+            if start - merged[-1][1] < min_gap:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        lines = [(s, e) for s, e in merged if e - s >= max(4, int(0.4 * self.text_height))]
+        if not lines:
+            lines = [(0, h)]
+        if len(lines) > self.max_lines:
+            # Keep the most inked lines, in reading order
+            weight = [ink[s:e].sum() for s, e in lines]
+            keep = sorted(np.argsort(weight)[::-1][:self.max_lines])
+            lines = [lines[i] for i in keep]
 
-        try:
-            response = self.llm_client.chat.completions.create(
-                model="gpt-4.1-nano", # or your specific model
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=60,
-                response_format={ "type": "json_object" }
-            )
-            content = response.choices[0].message.content.strip()
-            
-            import json
-            try:
-                data = json.loads(content)
-                return data.get("query", raw_text), data.get("category", None)
-            except json.JSONDecodeError:
-                # Fallback if LLM fails to output valid JSON (rare with json_object mode but possible)
-                return content, None
-                
-        except Exception as e:
-            print(f"LLM Error: {e}")
-            return raw_text, None # Fallback to raw text if API fails
+        pad = max(2, self.text_height // 4)
+        crops = []
+        for start, end in lines:
+            top, bottom = max(0, start - pad), min(h, end + pad)
+            cols = np.flatnonzero(ink[top:bottom].any(axis=0))
+            left, right = (max(0, cols[0] - pad), min(w, cols[-1] + 1 + pad)) if len(cols) else (0, w)
+            crops.append(th[top:bottom, left:right])
+        return crops
 
     def load_model(self):
         """Loads the TrOCR model into memory."""
@@ -87,43 +120,67 @@ class OCRManager:
             print("Loading TrOCR model safely...")
             try:
                 from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-                model_id = "microsoft/trocr-small-handwritten"
-                self.processor = TrOCRProcessor.from_pretrained(model_id)
+                self.processor = TrOCRProcessor.from_pretrained(self.model_id)
                 # optimization: low_cpu_mem_usage=True speeds up loading if accelerate is installed
-                self.model = VisionEncoderDecoderModel.from_pretrained(model_id).to(self.device)
+                self.model = VisionEncoderDecoderModel.from_pretrained(self.model_id).to(self.device)
+                self.model.eval()
                 print("TrOCR model loaded successfully!")
             except Exception as e:
                 print(f"Failed to load TrOCR model: {e}")
 
+    def recognize(self, line_images):
+        """Text of each line image, from one batched generate call."""
+        pixel_values = self.processor(images=[Image.fromarray(img).convert("RGB") for img in line_images],
+                                      return_tensors="pt").pixel_values.to(self.device)
+        options = {"num_beams": self.num_beams, "early_stopping": True} if self.num_beams > 1 else {"num_beams": 1}
+        with torch.inference_mode():
+            generated_ids = self.model.generate(pixel_values, max_new_tokens=self.max_new_tokens, do_sample=False,
+                                                **options)
+        return self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def read(self, pil_image):
+        """
+        Runs the OCR pipeline. Returns (raw_text, info) where info has the line count, the
+        downscale factor and per-step timings in ms (each step is also a tracing span "ocr.<step>").
+        """
+        timings = {}
+
+        def step(name, fn, *args):
+            t0 = time.perf_counter()
+            with span(f"ocr.{name}"):
+                out = fn(*args)
+            timings[name] = round((time.perf_counter() - t0) * 1000, 2)
+            return out
+
+        # Lazy Load Fallback
+        if self.model is None:
+            self.load_model()
+        if self.model is None:
+            raise RuntimeError("TrOCR model not loaded")
+
+        gray = step("grayscale", lambda img: cv2.cvtColor(np.array(img.convert("RGB")), cv2.COLOR_RGB2GRAY), pil_image)
+        small, scale = step("downscale", self.downscale, gray)
+        th = step("enhance", self.enhance, small)
+        lines = step("segment", self.segment_lines_of, th) if self.segment_lines else [th]
+        texts = step("recognize", self.recognize, lines)
+        raw_text = " ".join(t.strip() for t in texts if t.strip())
+        return raw_text, {"lines": len(lines), "scale": round(scale, 4), "timings_ms": timings}
+
     def extract_text(self, pil_image, use_llm=True):
         try:
-            # Step A: Preprocess
-            processed_pil = self.preprocess_image(pil_image)
-            
-            # Step B: TrOCR Inference (Lazy Load Fallback)
-            if self.model is None:
-                self.load_model()
-
-            if self.model is None:
-                return "", "", None # Failed to load
-
-            pixel_values = self.processor(processed_pil, return_tensors="pt").pixel_values.to(self.device)
-            with torch.no_grad():
-                generated_ids = self.model.generate(pixel_values)
-            
-            raw_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-            
+            raw_text, _ = self.read(pil_image)
+
             detected_category = None
             cleaned_text = raw_text
 
-            # Step C: LLM Refinement
+            # Query Refinement
             if raw_text.strip():
-                if use_llm:
-                    cleaned_text, detected_category = self.clean_query_with_llm(raw_text)
+                if use_llm and self.query_cleaner is not None:
+                    cleaned_text, detected_category = self.query_cleaner(raw_text)
                     return raw_text, cleaned_text, detected_category
                 else:
-                    return raw_text, raw_text, None 
+                    return raw_text, raw_text, None
             return "", "", None
         except Exception as e:
             print(f"OCR Error: {e}")
-            return "", "", None
\ No newline at end of file
+            return "", "", None
@@ -0,0 +1,91 @@
+# onnx_backend.py - ONNX Runtime (optionally int8-quantized) CPU inference for the CLIP towers and the cross-encoder.
+# Models are produced by scripts/export_onnx.py; check drift with scripts/check_onnx_parity.py.
+import os
+import json
+import numpy as np
+import torch
+import onnxruntime as ort
+from torchvision import transforms
+
+ONNX_MODEL_DIR = "models/onnx"
+
+# CLIP's own preprocessing constants (see clip/clip.py)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+def clip_dir(model_dir, model_name):
+    return os.path.join(model_dir, "clip-" + model_name.replace("/", "-").lower())
+
+def cross_encoder_dir(model_dir, model_name):
+    return os.path.join(model_dir, model_name.rstrip("/").split("/")[-1])
+
+def model_file(directory, part, quantized):
+    return os.path.join(directory, part + (".int8" if quantized else "") + ".onnx")
+
+def load_session(path, threads=None):
+    """CPU inference session with full graph optimizations."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found - run scripts/export_onnx.py first")
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        opts.intra_op_num_threads = int(threads)
+        opts.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+def _convert_to_rgb(image):
+    return image.convert("RGB")
+
+def clip_preprocess(n_px):
+    """Same transform as clip.load() returns, without loading the PyTorch weights."""
+    return transforms.Compose([
+        transforms.Resize(n_px, interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop(n_px),
+        _convert_to_rgb,
+        transforms.ToTensor(),
+        transforms.Normalize(CLIP_MEAN, CLIP_STD),
+    ])
+
+class OnnxCLIP:
+    """
+    Drop-in for the `model` returned by clip.load(): encode_image / encode_text take and
+    return torch tensors, so CLIPEngine's batching and caching code is unchanged.
+    """
+
+    def __init__(self, directory, quantized=True, threads=None):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.visual = load_session(model_file(directory, "visual", quantized), threads)
+        self.text = load_session(model_file(directory, "text", quantized), threads)
+        self.preprocess = clip_preprocess(self.meta["input_resolution"])
+
+    def encode_image(self, images):
+        pixels = images.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.visual.run(None, {"image": pixels})[0])
+
+    def encode_text(self, tokens):
+        ids = tokens.detach().cpu().numpy().astype(np.int64, copy=False)
+        return torch.from_numpy(self.text.run(None, {"tokens": ids})[0])
+
+class OnnxCrossEncoder:
+    """
+    Drop-in for sentence_transformers.CrossEncoder.predict(): returns one raw logit per
+    (query, document) pair, like the ms-marco models (whose default activation is Identity).
+    """
+
+    def __init__(self, directory, quantized=True, threads=None, max_length=512):
+        from transformers import AutoTokenizer
+        self.session = load_session(model_file(directory, "model", quantized), threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = max_length
+
+    def predict(self, sentence_pairs, batch_size=32):
+        logits = []
+        for start in range(0, len(sentence_pairs), batch_size):
+            batch = sentence_pairs[start:start + batch_size]
+            features = self.tokenizer([p[0] for p in batch], [p[1] for p in batch], padding=True,
+                                      truncation="longest_first", max_length=self.max_length, return_tensors="np")
+            feeds = {name: features[name].astype(np.int64) for name in self.input_names}
+            logits.append(self.session.run(None, feeds)[0].reshape(len(batch), -1)[:, 0])
+        return np.concatenate(logits) if logits else np.zeros(0, dtype=np.float32)
@@ -0,0 +1,74 @@
+# pagination.py - Opaque cursors over a retained, incrementally widened window of ranked candidates.
+import base64
+import secrets
+import threading
+
+class SearchWindow:
+    """
+    The ranked candidates of one query, kept between pages.
+
+    `extend(k, seen, context)` runs the ANN search at depth k and returns (ranked, n_hits):
+    the candidates not in `seen`, ranked, as {"id", "score"} dicts, and how many hits the
+    index returned. `context` is a dict kept for the window's lifetime (e.g. the score scale
+    of its first page), so every widening scores on the same scale.
+
+    The window starts at depth `initial_k` and doubles whenever a page runs past its end.
+    New candidates are appended behind the ones already ranked, so pages that were
+    served never reorder. The window is exhausted once the index has no more hits or
+    `max_k` is reached.
+    """
+
+    def __init__(self, extend, initial_k=50, max_k=1000, growth=2, id_prefix=""):
+        self.id = id_prefix + secrets.token_urlsafe(12)
+        self.extend = extend
+        self.initial_k = max(1, int(initial_k))
+        self.max_k = max(self.initial_k, int(max_k))
+        self.growth = max(2, int(growth))
+        self.items = []
+        self.k = 0
+        self.exhausted = False
+        self.seen = set()
+        self.context = {}
+        self.lock = threading.Lock()
+
+    def restore(self, state):
+        """Seeds the window from state() of an identical query (e.g. from the results cache)."""
+        items, self.k, self.exhausted, context = state
+        self.items = list(items)
+        self.seen = {item["id"] for item in self.items}
+        self.context = dict(context)
+
+    def state(self):
+        return (list(self.items), self.k, self.exhausted, dict(self.context))
+
+    def _widen(self):
+        k = min(self.max_k, self.k * self.growth if self.k else self.initial_k)
+        ranked, n_hits = self.extend(k, self.seen, self.context)
+        for item in ranked:
+            if item["id"] not in self.seen:
+                self.seen.add(item["id"])
+                self.items.append(item)
+        self.k = k
+        self.exhausted = n_hits < k or k >= self.max_k
+
+    def page(self, offset, size):
+        """Items [offset, offset + size), widening as needed. Returns (items, has_more). Blocking."""
+        with self.lock:
+            while len(self.items) < offset + size and not self.exhausted:
+                self._widen()
+            return self.items[offset:offset + size], offset + size < len(self.items) or not self.exhausted
+
+def encode_cursor(window_id, offset, size):
+    return base64.urlsafe_b64encode(f"{window_id}:{offset}:{size}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """(window_id, offset, size); ValueError if the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        window_id, offset, size = raw.rsplit(":", 2)
+        offset, size = int(offset), int(size)
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if offset < 0 or size <= 0:
+        raise ValueError("Malformed cursor")
+    return window_id, offset, size
@@ -0,0 +1,51 @@
+# prefork.py - Worker identity and the master/worker channels of pre-fork serving (run.py --workers).
+import os
+import json
+import socket
+import httpx
+
+# Set by run.py before main is imported; unset when the API runs as a single process
+SOCKET_DIR = os.getenv("PREFORK_SOCKET_DIR") or None
+WORKERS = int(os.getenv("PREFORK_WORKERS", "0"))
+# Index of this worker, set right after fork()
+worker_index = None
+
+def enabled():
+    return SOCKET_DIR is not None and worker_index is not None
+
+def worker_socket(index):
+    """Unix socket only worker `index` accepts on, so other workers can reach that one process."""
+    return os.path.join(SOCKET_DIR, f"worker-{index}.sock")
+
+def control_socket():
+    return os.path.join(SOCKET_DIR, "master.sock")
+
+def peers():
+    return [i for i in range(WORKERS) if i != worker_index]
+
+def window_prefix():
+    """Prefix for search window ids, so a cursor names the worker that holds its window."""
+    return f"{worker_index}." if enabled() else ""
+
+def owner(window_id):
+    """Index of the other worker holding `window_id`; None if it's this one (or not pre-forked)."""
+    head, sep, _ = window_id.partition(".")
+    if not enabled() or not sep or not head.isdigit():
+        return None
+    index = int(head)
+    return index if index != worker_index and index < WORKERS else None
+
+async def forward(index, method, path, timeout=30.0, **kwargs):
+    """Re-issues a request to worker `index` over its private socket; returns the httpx.Response."""
+    transport = httpx.AsyncHTTPTransport(uds=worker_socket(index))
+    async with httpx.AsyncClient(transport=transport, base_url="http://worker", timeout=timeout) as client:
+        return await client.request(method, path, **kwargs)
+
+def request_master(command, timeout=300.0):
+    """Sends one JSON command to the master's control socket and returns its JSON reply. Blocking."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(control_socket())
+        sock.sendall(json.dumps(command).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as reply:
+            return json.loads(reply.readline())
@@ -0,0 +1,260 @@
+# query_cleaner.py - Cleans noisy OCR text into a search query: async LLM call with a local fuzzy fallback.
+import os
+import re
+import json
+import time
+import asyncio
+import difflib
+import threading
+from collections import Counter
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from utils.cache import LRUCache, normalize_text
+
+# Path-aware loading: This finds the .env in the root folder automatically
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- INTENT DETECTION ---
+# Map synonyms to canonical category names (based on items.csv)
+CATEGORY_MAP = {
+    "ring": "ring",
+    "rings": "ring",
+    "band": "ring",
+    "necklace": "necklace",
+    "necklaces": "necklace",
+    "chain": "necklace",
+    "pendant": "necklace",
+    "earring": "earring", # Assuming these exist or will exist
+    "earrings": "earring",
+    "bracelet": "bracelet", # Assuming these exist
+    "bracelets": "bracelet",
+    "bangle": "bracelet"
+}
+CATEGORIES = set(CATEGORY_MAP.values())
+
+# Terms the cleaner should always know, even if no catalog description uses them
+DOMAIN_TERMS = ("gold", "silver", "platinum", "rose", "white", "yellow", "diamond", "ruby", "emerald",
+                "sapphire", "pearl", "stone", "stones", "bangle")
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def detect_category(query):
+    """Simple rule-based detection for now. Can be upgraded to LLM later."""
+    query_lower = query.lower()
+    for keyword, category in CATEGORY_MAP.items():
+        if keyword in query_lower:
+            return category # Stop at first match (simplistic but works for "gold ring")
+    return None
+
+PROMPT = """
+You are a jewelry search assistant. Your task is to clean up noisy OCR text extracted from a handwritten note AND detect the jewelry category.
+
+RULES:
+1. Correct spelling errors (e.g., 'diomond' -> 'diamond', 'neklace' -> 'necklace').
+2. Standardize terms: Use 'ring', 'necklace', 'earring', 'bracelet', 'bangle'.
+3. Standardize stones: Use 'diamond', 'ruby', 'emerald', 'sapphire', 'white stone'.
+4. Remove noise (special characters, random letters).
+5. Output a VALID JSON object with two fields: "query" (cleaned text) and "category" (one of: ring, necklace, bracelet, earring, or null if unknown).
+
+Raw OCR Text: "{raw_text}"
+
+Output JSON:"""
+
+class LocalQueryCleaner:
+    """
+    Deterministic, offline cleaner: fuzzy spell correction (difflib) against the catalog
+    vocabulary, noise removal, and category detection through CATEGORY_MAP.
+    """
+
+    def __init__(self, vocabulary=(), cutoff=0.75, cache_size=10000):
+        counts = Counter(vocabulary)
+        for term in list(CATEGORY_MAP) + list(DOMAIN_TERMS):
+            counts[term] += 1
+        self.counts = counts
+        self.cutoff = cutoff
+        # Candidates bucketed by length: a typo rarely changes the length by more than 2
+        self._by_length = {}
+        for word in counts:
+            self._by_length.setdefault(len(word), []).append(word)
+        self._corrections = LRUCache("spelling", maxsize=cache_size)
+
+    @classmethod
+    def from_texts(cls, texts, **kwargs):
+        return cls((tok for text in texts if isinstance(text, str) for tok in TOKEN_RE.findall(text.lower())), **kwargs)
+
+    def correct(self, token):
+        """Closest vocabulary word, the token itself if nothing is close, or None for noise."""
+        if token in self.counts or token.isdigit():
+            return token
+        if len(token) < 3:
+            # Stray letters are OCR noise
+            return None
+        cached = self._corrections.get(token)
+        if cached is not None:
+            return cached
+        candidates = [w for n in range(len(token) - 2, len(token) + 3) for w in self._by_length.get(n, ())]
+        matches = difflib.get_close_matches(token, candidates, n=3, cutoff=self.cutoff)
+        if matches:
+            # Equally close: prefer the more common word
+            best = difflib.SequenceMatcher(None, token, matches[0]).ratio()
+            ties = [m for m in matches if difflib.SequenceMatcher(None, token, m).ratio() == best]
+            result = max(ties, key=lambda m: self.counts[m])
+        else:
+            result = token
+        self._corrections.set(token, result)
+        return result
+
+    def clean(self, raw_text):
+        """Returns (query, category)."""
+        words = [self.correct(tok) for tok in TOKEN_RE.findall(str(raw_text).lower())]
+        words = [w for w in words if w]
+        category = next((CATEGORY_MAP[w] for w in words if w in CATEGORY_MAP), None)
+        return " ".join(words), category
+
+class RateLimiter:
+    """Token bucket (rate_per_minute, burst) plus an optional per-day call budget. Never blocks."""
+
+    def __init__(self, rate_per_minute=60, burst=10, daily_budget=0):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.daily_budget = daily_budget
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._day = time.strftime("%Y-%m-%d")
+        self._spent_today = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            today = time.strftime("%Y-%m-%d")
+            if today != self._day:
+                self._day, self._spent_today = today, 0
+            if self.daily_budget and self._spent_today >= self.daily_budget:
+                return False
+            if self.rate > 0 and self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self._spent_today += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"rate_per_minute": self.rate * 60, "burst": self.burst, "daily_budget": self.daily_budget,
+                    "spent_today": self._spent_today}
+
+class LLMQueryCleaner:
+    """
+    Async LLM query cleaning with a hard timeout, a concurrency limit, a rate limit/budget and
+    a result cache keyed by the normalized OCR text. Whenever the remote call can't be made or
+    fails (no key, over budget, all slots busy, timeout, error, bad JSON) the caller's local
+    fallback (an async callable, so its CPU work can run off the event loop) answers instead,
+    so a handwriting search never waits on an unavailable endpoint.
+    After a failure the endpoint is skipped for `cooldown` seconds.
+    """
+
+    def __init__(self, api_key=None, base_url=None, model="gpt-4.1-nano", timeout=4.0, max_concurrency=4,
+                 rate_per_minute=60, burst=10, daily_budget=0, cache_size=2048, cache_ttl=86400, cooldown=30.0):
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max(1, max_concurrency)
+        self.cooldown = cooldown
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0) if api_key else None
+        self.limiter = RateLimiter(rate_per_minute, burst, daily_budget)
+        self.cache = LRUCache("llm_query", maxsize=cache_size, ttl=cache_ttl)
+        self._semaphores = {}
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def _semaphore(self):
+        # asyncio.Semaphore binds to the running loop on first use, so keep one per loop
+        loop_id = id(asyncio.get_running_loop())
+        with self._lock:
+            if loop_id not in self._semaphores:
+                self._semaphores[loop_id] = asyncio.Semaphore(self.max_concurrency)
+            return self._semaphores[loop_id]
+
+    def _count(self, source):
+        with self._lock:
+            self.counts[source] += 1
+
+    async def clean(self, raw_text, fallback):
+        """Returns (query, category, source); source is "cache", "llm" or "local" (await fallback(raw_text) answered)."""
+        key = normalize_text(raw_text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count("cache")
+            return (*cached, "cache")
+
+        result = await self._remote(raw_text)
+        if result is None:
+            self._count("local")
+            return (*await fallback(raw_text), "local")
+        self.cache.set(key, result)
+        self._count("llm")
+        return (*result, "llm")
+
+    async def _remote(self, raw_text):
+        """(query, category) from the LLM, or None if it was skipped or failed."""
+        if self.client is None or time.monotonic() < self._unavailable_until:
+            return None
+        if not self.limiter.try_acquire():
+            self._count("over_budget")
+            return None
+        sem = self._semaphore()
+        try:
+            # Waiting for a slot counts against the same deadline as the call
+            deadline = time.monotonic() + self.timeout
+            await asyncio.wait_for(sem.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._count("saturated")
+            return None
+        try:
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": PROMPT.format(raw_text=raw_text)}],
+                    temperature=0,
+                    max_tokens=60,
+                    response_format={"type": "json_object"},
+                ),
+                timeout=max(0.001, deadline - time.monotonic()))
+            return self._parse(response.choices[0].message.content, raw_text)
+        except Exception as e:
+            print(f"LLM Error ({type(e).__name__}): {e}; using local cleaner for {self.cooldown:.0f}s")
+            self._count("error")
+            self._unavailable_until = time.monotonic() + self.cooldown
+            return None
+        finally:
+            sem.release()
+
+    @staticmethod
+    def _parse(content, raw_text):
+        try:
+            data = json.loads((content or "").strip())
+        except json.JSONDecodeError:
+            # Rare with json_object mode; let the local cleaner handle it
+            return None
+        if not isinstance(data, dict):
+            return None
+        query = str(data.get("query") or raw_text).strip()
+        category = str(data.get("category") or "").lower().strip()
+        return query, category if category in CATEGORIES else None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "enabled": self.client is not None,
+            "model": self.model,
+            "timeout": self.timeout,
+            "max_concurrency": self.max_concurrency,
+            "cooling_down": time.monotonic() < self._unavailable_until,
+            "requests": counts,
+            "rate_limit": self.limiter.stats(),
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,134 @@
+# registry.py - Named startup resources, loaded concurrently (or on first use) with per-component state and timings.
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+PENDING, LOADING, READY, FAILED, LAZY = "pending", "loading", "ready", "failed", "lazy"
+
+class ResourceUnavailable(Exception):
+    def __init__(self, name, reason):
+        super().__init__(f"{name} unavailable: {reason}")
+        self.name = name
+        self.reason = reason
+
+class Resource:
+    def __init__(self, name, loader, deps=(), lazy=False, critical=True):
+        self.name = name
+        self.loader = loader
+        self.deps = tuple(deps)
+        self.lazy = lazy
+        self.critical = critical
+        self.state = LAZY if lazy else PENDING
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.future = Future()
+
+class ResourceRegistry:
+    """
+    Each resource is a loader function whose return value becomes the resource; loaders
+    receive the values of their `deps` as positional arguments. Eager resources load on a
+    thread pool as soon as their dependencies are ready; lazy ones load on the first get().
+
+    The service is ready once every critical, non-lazy resource has loaded.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._resources = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self.started_at = None
+
+    def register(self, name, loader, deps=(), lazy=False, critical=True):
+        for dep in deps:
+            if dep not in self._resources:
+                raise ValueError(f"{name}: unknown dependency {dep!r} (register it first)")
+        self._resources[name] = Resource(name, loader, deps, lazy, critical)
+
+    def start(self):
+        """
+        Kicks off all eager loads (in registration order, which is also dependency order) and returns.
+        Resources that already loaded (see preload()) are skipped, so a forked worker can call it again.
+        """
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="startup")
+        for res in self._resources.values():
+            if not res.lazy and res.state == PENDING:
+                self._pool.submit(self._load, res)
+
+    def preload(self):
+        """
+        Loads every resource, lazy ones included, and blocks until all have finished (or failed),
+        then drops the loader threads. For pre-fork serving: workers forked afterwards inherit
+        the loaded resources instead of each loading its own copy.
+        """
+        self.start()
+        for res in self._resources.values():
+            if res.state == LAZY:
+                self._pool.submit(self._load, res)
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        return self.is_ready()
+
+    def _load(self, res):
+        with self._lock:
+            if res.state not in (PENDING, LAZY):
+                return
+            res.state = LOADING
+        t0 = time.perf_counter()
+        try:
+            args = [self._resources[dep].future.result() for dep in res.deps]
+            value = res.loader(*args)
+        except Exception as e:
+            res.load_seconds = round(time.perf_counter() - t0, 3)
+            res.error = str(e)
+            res.state = FAILED
+            res.future.set_exception(e)
+            print(f"Resource {res.name} failed after {res.load_seconds}s: {e}")
+            return
+        res.load_seconds = round(time.perf_counter() - t0, 3)
+        res.value = value
+        res.state = READY
+        res.future.set_result(value)
+        print(f"Resource {res.name} ready in {res.load_seconds}s")
+
+    def get(self, name, timeout=None):
+        """Blocks until `name` is loaded (loading it now if lazy); raises ResourceUnavailable if it failed."""
+        res = self._resources[name]
+        if res.state == LAZY:
+            self._load(res)
+        try:
+            return res.future.result(timeout=timeout)
+        except FutureTimeout:
+            raise ResourceUnavailable(name, "still loading")
+        except Exception as e:
+            raise ResourceUnavailable(name, str(e))
+
+    async def wait(self, name, timeout=None):
+        """Async get(): lazy resources load on the startup pool, never on the event loop."""
+        res = self._resources[name]
+        if res.state == LAZY:
+            self._pool.submit(self._load, res)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(res.future)), timeout)
+        except asyncio.TimeoutError:
+            raise ResourceUnavailable(name, "still loading")
+        except Exception as e:
+            raise ResourceUnavailable(name, str(e))
+
+    def is_ready(self):
+        return all(res.state == READY for res in self._resources.values() if res.critical and not res.lazy)
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "uptime_seconds": round(time.perf_counter() - self.started_at, 3) if self.started_at else None,
+            "components": {
+                res.name: {"state": res.state, "load_seconds": res.load_seconds, "critical": res.critical,
+                           "lazy": res.lazy, "error": res.error}
+                for res in self._resources.values()
+            },
+        }
@@ -1,30 +1,78 @@
+import numpy as np
 from sentence_transformers import CrossEncoder
+from utils.cache import LRUCache, normalize_text
+from utils.batcher import MicroBatcher
 
 class Reranker:
-    def __init__(self, model_name='cross-encoder/ms-marco-MiniLM-L-6-v2'):
-        print(f"Loading Reranker model: {model_name}...")
-        self.model = CrossEncoder(model_name)
+    def __init__(self, model_name='cross-encoder/ms-marco-MiniLM-L-6-v2', cache_size=50000,
+                 max_batch_size=256, max_wait_ms=3.0, backend="torch", onnx_dir=None, quantized=True, threads=None):
+        print(f"Loading Reranker model: {model_name} ({backend})...")
+        if backend == "onnx":
+            from utils.onnx_backend import ONNX_MODEL_DIR, OnnxCrossEncoder, cross_encoder_dir
+            self.model = OnnxCrossEncoder(cross_encoder_dir(onnx_dir or ONNX_MODEL_DIR, model_name), quantized, threads)
+        else:
+            self.model = CrossEncoder(model_name)
+        # (query, item id, description) -> logit; repeated and paginated queries skip the model
+        self.score_cache = LRUCache("rerank_scores", maxsize=cache_size)
+        # Pairs from concurrent requests are coalesced into one predict() call
+        self.batcher = MicroBatcher("rerank", self._predict, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
         print("Reranker model loaded.")
 
-    def rerank(self, query, candidates, top_k=12):
+    def _predict(self, sentence_pairs):
+        return self.model.predict(sentence_pairs)
+
+    def score(self, query, candidates):
+        """Cross-encoder logits for each candidate; only uncached pairs are sent to the model."""
+        return self.score_many([query], [candidates])[0]
+
+    def score_many(self, queries, candidate_lists):
+        """score() for several queries; their uncached pairs are submitted to the model together."""
+        logits = [[None] * len(candidates) for candidates in candidate_lists]
+        keys, pairs = [], []
+        for q, (query, candidates) in enumerate(zip(queries, candidate_lists)):
+            query_key = normalize_text(query)
+            for idx, item in enumerate(candidates):
+                # Use description for reranking as it contains the most detail
+                desc = item['metadata'].get('description', '')
+                key = (query_key, item.get('id'), desc)
+                logits[q][idx] = self.score_cache.get(key)
+                if logits[q][idx] is None:
+                    keys.append((q, idx, key))
+                    # Prepare pairs for Cross-Encoder: [[query, doc_text], [query, doc_text], ...]
+                    pairs.append([query, desc])
+
+        if pairs:
+            for (q, idx, key), future in zip(keys, self.batcher.submit_many(pairs)):
+                logits[q][idx] = float(future.result())
+                self.score_cache.set(key, logits[q][idx])
+        return logits
+
+    def rerank(self, query, candidates, top_k=12, calibration=None):
         """
         Reranks a list of candidates based on the query.
+        `calibration` reuses the scale factor of an earlier rerank (see calibration()).
         """
         if not candidates:
             return []
+        return self._rank(candidates, self.score(query, candidates), top_k, calibration)
 
-        # Prepare pairs for Cross-Encoder: [[query, doc_text], [query, doc_text], ...]
-        sentence_pairs = []
-        for item in candidates:
-            # Use description for reranking as it contains the most detail
-            desc = item['metadata'].get('description', '')
-            sentence_pairs.append([query, desc])
+    def rerank_many(self, queries, candidate_lists, top_k=12):
+        """rerank() for several queries at once (one round of cross-encoder batches)."""
+        scores = self.score_many(queries, candidate_lists)
+        return [self._rank(candidates, logits, top_k) if candidates else []
+                for candidates, logits in zip(candidate_lists, scores)]
 
+    @staticmethod
+    def calibration(best_score):
+        """Scale factor that maps the best sigmoid score of a pool to 0.98."""
+        # We want the best score to appear as 0.98
+        return 0.98 / best_score if best_score > 0 else None
+
+    def _rank(self, candidates, logits, top_k, calibration=None):
         # Predict scores (Logits)
-        scores = self.model.predict(sentence_pairs)
+        scores = np.asarray(logits, dtype=np.float32)
 
         # Normalize scores using Sigmoid to get 0-1 range
-        import numpy as np
         def sigmoid(x):
             return 1 / (1 + np.exp(-x))
             
@@ -33,18 +81,25 @@ class Reranker:
         # Attach sigmoid scores first
         for idx, score in enumerate(normalized_scores):
             candidates[idx]['hybrid_score'] = candidates[idx]['score']
+            candidates[idx]['rerank_score'] = float(score)
             candidates[idx]['score'] = float(score)
 
         # Sort by score (Descending) so we know the best candidate
         candidates.sort(key=lambda x: x['score'], reverse=True)
 
+        # A later pool of the same query (pagination) keeps the first pool's scale, without the
+        # top-tier boost, so its scores don't jump back up to 0.98
+        if calibration is not None:
+            for item in candidates:
+                item['score'] = min(0.99, item['score'] * calibration)
+            return candidates[:top_k]
+
         # Force-High Calibration: Ensure the top result is ~98% (Green)
         # and others scale relative to it, but maintain a high baseline.
         if candidates:
-            best_score = candidates[0]['score']
+            ratio = self.calibration(candidates[0]['score'])
             # Avoid division by zero
-            if best_score > 0:
-                # We want the best score to appear as 0.98
+            if ratio is not None:
                 # We can straightforwardly map the range [0, best_score] -> [0, 0.98]
                 # But to keep it "high", we might want a curve too.
                 # Let's try a simple scaling factor first, but boost lower scores too.
@@ -54,9 +109,6 @@ class Reranker:
                 # 2. Plateau Boost: Ensure the top N items (e.g. 5) stay very high (>0.95) 
                 #    if they are reasonably close to the winner, creating a "Top Tier" group.
                 
-                target = 0.98
-                ratio = target / best_score
-                
                 for idx, item in enumerate(candidates):
                     # 1. Apply Linear Base Scale
                     new_score = item['score'] * ratio
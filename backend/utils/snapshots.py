@@ -0,0 +1,306 @@
+# snapshots.py - Versioned index builds (snapshots/<build_id>/) and atomic hot-swapping of the loaded one.
+import os
+import gc
+import json
+import time
+import shutil
+import hashlib
+import secrets
+import threading
+import weakref
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils import index_factory
+from utils.catalog import Catalog
+from utils.hybrid import HybridSearcher
+from utils.query_cleaner import LocalQueryCleaner
+from utils.landing import LandingData
+
+SNAPSHOT_ROOT = "snapshots"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+SNAPSHOT_FILES = {"index_std": "faiss_index.bin", "index_sbir": "faiss_sbir_index.bin", "items": "items.csv"}
+# Precomputed top-N neighbour tables (scripts/index_data.py --neighbors); optional, /search/similar
+# falls back to a live search without them
+NEIGHBOR_FILES = {
+    "neighbors_std_ids": "neighbors_std_ids.npy", "neighbors_std_scores": "neighbors_std_scores.npy",
+    "neighbors_sbir_ids": "neighbors_sbir_ids.npy", "neighbors_sbir_scores": "neighbors_sbir_scores.npy",
+}
+# Pre-snapshot layout, still served when no snapshot has been published
+LEGACY_PATHS = {"index_std": "embeddings/faiss_index.bin", "index_sbir": "embeddings/faiss_sbir_index.bin",
+                "items": "metadata/items.csv"}
+
+def new_build_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+
+def snapshot_dir(build_id, root=SNAPSHOT_ROOT):
+    return os.path.join(root, build_id)
+
+def snapshot_paths(build_id, root=SNAPSHOT_ROOT):
+    files = {**SNAPSHOT_FILES, **NEIGHBOR_FILES}
+    return {key: os.path.join(snapshot_dir(build_id, root), fname) for key, fname in files.items()}
+
+def read_current(root=SNAPSHOT_ROOT):
+    """Build id the CURRENT pointer names, or None before the first snapshot is published."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def current_paths(root=SNAPSHOT_ROOT):
+    """File paths of the published snapshot, falling back to the legacy layout."""
+    build_id = read_current(root)
+    return snapshot_paths(build_id, root) if build_id else dict(LEGACY_PATHS)
+
+def publish(build_id, root=SNAPSHOT_ROOT):
+    """Points CURRENT at a complete snapshot directory (atomic rename)."""
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(build_id + "\n")
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+def write_manifest(build_id, manifest, root=SNAPSHOT_ROOT):
+    path = os.path.join(snapshot_dir(build_id, root), MANIFEST_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def read_manifest(build_id, root=SNAPSHOT_ROOT):
+    try:
+        with open(os.path.join(snapshot_dir(build_id, root), MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def list_snapshots(root=SNAPSHOT_ROOT):
+    """Published-looking snapshot ids (directories with a manifest), oldest first."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if os.path.isfile(os.path.join(root, name, MANIFEST_FILE)))
+
+def prune(keep=3, root=SNAPSHOT_ROOT):
+    """
+    Deletes all but the newest `keep` snapshots, CURRENT counted among them (and never deleted).
+    keep <= 0 deletes nothing. Returns the removed ids.
+    """
+    if keep <= 0:
+        return []
+    builds = list_snapshots(root)
+    current = read_current(root)
+    others = [b for b in builds if b != current]
+    keep_others = keep - 1 if current in builds else keep
+    old = others[:max(0, len(others) - keep_others)]
+    for build_id in old:
+        shutil.rmtree(snapshot_dir(build_id, root), ignore_errors=True)
+    return old
+
+def legacy_version(paths=LEGACY_PATHS):
+    """Fingerprint of the legacy index files; changes whenever the indexer rewrites them."""
+    h = hashlib.sha1()
+    for path in paths.values():
+        if os.path.exists(path):
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return "legacy-" + h.hexdigest()[:16]
+
+def _open_index(path, label):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{label} index not found at {path}")
+    index = index_factory.load_index(path)
+    print(f"{label} index: {index_factory.describe_index(index)}")
+    return index
+
+def _open_neighbors(paths, space):
+    """(ids, scores) neighbour table of one space, memory-mapped; None if the build has none."""
+    ids_path, scores_path = paths.get(f"neighbors_{space}_ids"), paths.get(f"neighbors_{space}_scores")
+    if not ids_path or not os.path.exists(ids_path) or not os.path.exists(scores_path):
+        return None
+    return np.load(ids_path, mmap_mode="r"), np.load(scores_path, mmap_mode="r")
+
+def _open_catalog(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Metadata CSV not found at {path}")
+    return Catalog.from_csv(path)
+
+class Snapshot:
+    """
+    One loaded build: both indices, the catalog and everything derived from them.
+    Requests take a reference once and use it throughout, so a swap never mixes builds.
+    """
+
+    def __init__(self, build_id, version, paths, manifest, index_std, index_sbir, catalog, reranker=None,
+                 neighbors=None):
+        self.build_id = build_id
+        self.version = version
+        self.paths = paths
+        self.manifest = manifest
+        self.index_std = index_std
+        self.index_sbir = index_sbir
+        self.catalog = catalog
+        # Space ("std" / "sbir") -> (ids, scores) top-N neighbour table
+        self.neighbors = neighbors or {}
+        self.hybrid = HybridSearcher(catalog, reranker=reranker)
+        self.loaded_at = time.time()
+        # Category -> (row ids, IDSelector), built on first use
+        self.category_selectors = {}
+        self._query_cleaner = None
+        self._landing = None
+        self._landing_lock = threading.Lock()
+        self._cleaner_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, build_id=None, root=SNAPSHOT_ROOT, reranker=None):
+        """Loads a snapshot (None = legacy layout); the indices and the catalog load concurrently."""
+        if build_id:
+            paths, manifest, version = snapshot_paths(build_id, root), read_manifest(build_id, root), build_id
+        else:
+            paths, manifest, version = dict(LEGACY_PATHS), {}, legacy_version()
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="snapshot") as pool:
+            index_std = pool.submit(_open_index, paths["index_std"], "Standard")
+            index_sbir = pool.submit(_open_index, paths["index_sbir"], "SBIR")
+            catalog = pool.submit(_open_catalog, paths["items"])
+            neighbors = {}
+            for space in ("std", "sbir"):
+                table = _open_neighbors(paths, space)
+                if table is not None:
+                    neighbors[space] = table
+            return cls(build_id or "legacy", version, paths, manifest,
+                       index_std.result(), index_sbir.result(), catalog.result(), reranker, neighbors)
+
+    def category_search_args(self, category):
+        key = str(category).lower().strip()
+        if key not in self.category_selectors:
+            ids = self.catalog.category_ids(key)
+            self.category_selectors[key] = (ids, index_factory.make_id_selector(ids))
+        return self.category_selectors[key]
+
+    def query_cleaner(self):
+        """LocalQueryCleaner over this build's vocabulary (descriptions + categories), built once."""
+        with self._cleaner_lock:
+            if self._query_cleaner is None:
+                texts = list(self.catalog.column('description')) if 'description' in self.catalog.columns else []
+                self._query_cleaner = LocalQueryCleaner.from_texts(texts + list(self.catalog.category_names))
+            return self._query_cleaner
+
+    def landing(self):
+        """Featured items + tag pool of this build (LandingData), built once."""
+        with self._landing_lock:
+            if self._landing is None:
+                self._landing = LandingData(self.catalog)
+            return self._landing
+
+    def describe(self):
+        return {"build_id": self.build_id, "version": self.version, "items": len(self.catalog),
+                "neighbors": {space: int(table[0].shape[1]) for space, table in self.neighbors.items()},
+                "loaded_at": self.loaded_at, "created_at": self.manifest.get("created_at")}
+
+class SnapshotManager:
+    """
+    Holds the active Snapshot and swaps in new ones built by scripts/index_data.py.
+
+    A reload loads the new snapshot next to the old one, then replaces `active` in a
+    single assignment. The old snapshot is freed as soon as the last in-flight request
+    drops its reference; the indices are memory-mapped, so only the catalog and BM25
+    structures are ever held twice, and only until then.
+    """
+
+    def __init__(self, root=SNAPSHOT_ROOT, on_swap=None):
+        self.root = root
+        self.on_swap = on_swap
+        self.active = None
+        self.reranker = None
+        self.reloads = 0
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # Swapped-out snapshots that in-flight requests still hold
+        self._retired = weakref.WeakValueDictionary()
+        self._watcher = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A pre-fork worker (run.py --workers) gets fresh locks but no watcher: the master watches,
+        # reloads, and re-forks its workers so they all serve the same build
+        self._reload_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def idle(self):
+        """Lock held by every reload; holding it guarantees no reload is half done (e.g. across fork())."""
+        return self._reload_lock
+
+    def reload(self, build_id=None, force=False):
+        """
+        Loads `build_id` (default: whatever CURRENT names, else the legacy layout) and swaps it in.
+        Returns None if that snapshot is already active and `force` is not set.
+        One reload at a time, so memory never holds more than two snapshots.
+        """
+        if build_id is not None and build_id not in list_snapshots(self.root):
+            raise ValueError(f"Unknown snapshot {build_id!r}")
+        with self._reload_lock:
+            target = build_id or read_current(self.root)
+            if not force and self.active is not None and self.active.build_id == (target or "legacy"):
+                return None
+            t0 = time.perf_counter()
+            try:
+                snapshot = Snapshot.load(target, self.root, reranker=self.reranker)
+            except Exception as e:
+                self.last_error = f"{target or 'legacy'}: {e}"
+                raise
+            self.last_error = None
+            self._swap(snapshot)
+            print(f"Snapshot {snapshot.build_id} active ({len(snapshot.catalog)} items, "
+                  f"loaded in {time.perf_counter() - t0:.2f}s)")
+            return snapshot
+
+    def _swap(self, snapshot):
+        with self._lock:
+            # The reranker may have attached while this snapshot was loading
+            snapshot.hybrid.reranker = self.reranker
+            old, self.active = self.active, snapshot
+            self.reloads += 1
+        if old is not None:
+            self._retired[old.build_id + f"#{id(old)}"] = old
+        if self.on_swap:
+            self.on_swap(old, snapshot)
+        del old
+        gc.collect()
+
+    def attach_reranker(self, reranker):
+        with self._lock:
+            self.reranker = reranker
+            if self.active is not None:
+                self.active.hybrid.reranker = reranker
+
+    def watch(self, interval):
+        """Polls the CURRENT pointer every `interval` seconds and reloads when it changes."""
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def loop():
+            seen = read_current(self.root)
+            while True:
+                time.sleep(interval)
+                current = read_current(self.root)
+                if current == seen:
+                    continue
+                seen = current
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Snapshot reload failed (keeping {self.active.build_id if self.active else None}): {e}")
+
+        self._watcher = threading.Thread(target=loop, name="snapshot-watch", daemon=True)
+        self._watcher.start()
+
+    def status(self):
+        return {
+            "active": self.active.describe() if self.active else None,
+            "current": read_current(self.root),
+            "available": list_snapshots(self.root),
+            "draining": sorted(key.split("#")[0] for key in self._retired.keys()),
+            "reloads": self.reloads,
+            "watching": self._watcher is not None,
+            "last_error": self.last_error,
+        }
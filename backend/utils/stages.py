@@ -0,0 +1,64 @@
+# stages.py - Runs blocking pipeline stages off the asyncio event loop with per-stage concurrency limits.
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from utils import tracing
+
+class StageExecutor:
+    """
+    A bounded thread pool shared by all blocking stages (OCR, LLM, FAISS, ranking, formatting).
+
+    Each stage also has its own concurrency limit, so e.g. two slow TrOCR calls can't
+    take every pool thread and starve the cheap FAISS lookups of other requests.
+    """
+
+    def __init__(self, max_workers=8, limits=None, default_limit=4):
+        self.max_workers = max_workers
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage")
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, stage):
+        # asyncio.Semaphore binds to the running loop on first use, so create it lazily
+        loop = asyncio.get_running_loop()
+        key = (stage, id(loop))
+        with self._lock:
+            sem = self._semaphores.get(key)
+            if sem is None:
+                sem = asyncio.Semaphore(self.limits.get(stage, self.default_limit))
+                self._semaphores[key] = sem
+        return sem
+
+    async def run(self, stage, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on the pool once a slot for `stage` is free.
+        The wait for the slot and the run itself are traced as `<stage>.queue` and `<stage>`;
+        the request's context is carried onto the worker thread so spans inside fn attach to it.
+        """
+        queued = time.perf_counter()
+        async with self._semaphore(stage):
+            tracing.record(f"{stage}.queue", queued, time.perf_counter() - queued)
+            loop = asyncio.get_running_loop()
+            call = functools.partial(contextvars.copy_context().run, tracing.call, fn, *args, **kwargs)
+            with tracing.span(stage):
+                return await loop.run_in_executor(self._pool, call)
+
+    def stats(self):
+        with self._lock:
+            in_use = {}
+            for (stage, _), sem in self._semaphores.items():
+                limit = self.limits.get(stage, self.default_limit)
+                in_use[stage] = in_use.get(stage, 0) + (limit - sem._value)
+        return {
+            "max_workers": self.max_workers,
+            "limits": {**self.limits, "default": self.default_limit},
+            "in_flight": in_use,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,35 @@
+# thumbnails.py - Size-bounded catalog thumbnails, generated at index time and keyed by content hash.
+import os
+from PIL import Image, features
+
+THUMBNAIL_DIR = "thumbnails"
+THUMBNAIL_MAX_SIDE = 384
+
+# WebP is much smaller for photos; older Pillow builds may lack it
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMBNAIL_EXT = ".webp" if THUMBNAIL_FORMAT == "WEBP" else ".jpg"
+MEDIA_TYPES = {".webp": "image/webp", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+def thumbnail_path(content_hash, thumb_dir=THUMBNAIL_DIR):
+    return os.path.join(thumb_dir, content_hash + THUMBNAIL_EXT)
+
+def write_thumbnail(pil_image, out_path, max_side=THUMBNAIL_MAX_SIDE, quality=80):
+    """Downscales (never upscales) to fit `max_side` and writes atomically."""
+    thumb = pil_image.convert("RGB")
+    thumb.thumbnail((max_side, max_side), Image.LANCZOS)
+    tmp = out_path + ".tmp"
+    thumb.save(tmp, format=THUMBNAIL_FORMAT, quality=quality)
+    os.replace(tmp, out_path)
+
+def media_type(path):
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+def collect_garbage(live_paths, thumb_dir=THUMBNAIL_DIR):
+    """Removes thumbnails that no indexed item references any more."""
+    if not os.path.isdir(thumb_dir):
+        return
+    live = {os.path.normpath(p) for p in live_paths}
+    for fname in os.listdir(thumb_dir):
+        path = os.path.normpath(os.path.join(thumb_dir, fname))
+        if path not in live:
+            os.remove(path)
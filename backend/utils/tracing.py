@@ -0,0 +1,106 @@
+# tracing.py - Per-request timing spans and sampled cProfile capture of slow requests.
+import os
+import time
+import pstats
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("trace", default=None)
+# Callables (stage, seconds) fed by every span, e.g. a stage histogram
+_observers = []
+# cProfile can't run two profilers at once (sys.monitoring on 3.12+), so only one stage is profiled at a time
+_profile_lock = threading.Lock()
+
+class Trace:
+    """Spans of one request. Shared by reference with the threads its stages run on."""
+
+    def __init__(self, name, profile=False):
+        self.name = name
+        self.profile = profile
+        self.started = time.perf_counter()
+        self.spans = []
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, start, seconds):
+        with self._lock:
+            self.spans.append((stage, start - self.started, seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def totals_ms(self):
+        """Milliseconds per stage name (stages that ran several times are summed)."""
+        totals = {}
+        with self._lock:
+            for stage, _, seconds in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + seconds * 1000
+        return {stage: round(ms, 3) for stage, ms in totals.items()}
+
+    def server_timing(self):
+        """Server-Timing header value, so browser dev tools show the breakdown."""
+        return ", ".join(f"{stage.replace('.', '-')};dur={ms}" for stage, ms in self.totals_ms().items())
+
+    def to_dict(self, status=None):
+        with self._lock:
+            spans = [{"stage": s, "start_ms": round(o * 1000, 3), "ms": round(d * 1000, 3)} for s, o, d in self.spans]
+        return {"request": self.name, "status": status, "ms": round(self.elapsed() * 1000, 3), "spans": spans}
+
+    def add_profile(self, profiler):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def dump_profile(self, directory):
+        """Writes the collected stage profiles as a .prof file (open with snakeviz / pstats). Returns its path."""
+        with self._lock:
+            if self._stats is None:
+                return None
+            os.makedirs(directory, exist_ok=True)
+            slug = self.name.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+            path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{int(self.elapsed() * 1000)}ms.prof")
+            self._stats.dump_stats(path)
+            return path
+
+def add_observer(fn):
+    _observers.append(fn)
+
+def start_trace(name, profile=False):
+    trace = Trace(name, profile)
+    _current.set(trace)
+    return trace
+
+def current_trace():
+    return _current.get()
+
+def record(stage, start, seconds):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(stage, start, seconds)
+    for fn in _observers:
+        fn(stage, seconds)
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as `stage` of the current request (if any) and feeds the observers."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, start, time.perf_counter() - start)
+
+def call(fn, *args, **kwargs):
+    """fn(*args, **kwargs), under cProfile if the current request was sampled for profiling."""
+    trace = _current.get()
+    if trace is None or not trace.profile or not _profile_lock.acquire(blocking=False):
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        _profile_lock.release()
+        trace.add_profile(profiler)
@@ -9,9 +9,7 @@ import LiveRatesTicker from './components/LiveRatesTicker';
 import { Search, Upload, Loader2, Sparkles, ChevronRight, Mic } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 import axios from 'axios';
-
-// Define API Base URL (Vercel support + Localhost fallback)
-const API_BASE_URL = import.meta.env.VITE_API_URL || `http://${window.location.hostname}:8001`;
+import { API_BASE_URL, imageSrc } from './api';
 
 function App() {
     const [activeTab, setActiveTab] = useState('home');
@@ -108,16 +106,17 @@ function App() {
     };
 
     const handleSimilarSearch = async (item) => {
-        if (!item?.image_base64) {
+        const src = imageSrc(item, 'original');
+        if (!src) {
             setToast({ type: 'error', message: "No image available for this item." });
             return;
         }
 
         try {
 
-            // Convert Base64 to File object
-            const base64Response = await fetch(`data:image/jpeg;base64,${item.image_base64}`);
-            const blob = await base64Response.blob();
+            // Fetch the original image and convert it to a File object
+            const imageResponse = await fetch(src);
+            const blob = await imageResponse.blob();
             const file = new File([blob], "similar_item.jpg", { type: "image/jpeg" });
 
             setToast({ type: 'info', message: "Loading item into Visual Search..." });
@@ -0,0 +1,9 @@
+// Shared API helpers (Vercel support + Localhost fallback)
+export const API_BASE_URL = import.meta.env.VITE_API_URL || `http://${window.location.hostname}:8001`;
+
+// Search results carry an image_url (cached thumbnail); image_base64 is only set in inline mode
+export const imageSrc = (item, variant = 'thumb') => {
+    if (item?.image_base64) return `data:image/jpeg;base64,${item.image_base64}`;
+    if (!item?.image_url) return '';
+    return variant === 'thumb' ? `${API_BASE_URL}${item.image_url}` : `${API_BASE_URL}${item.image_url}?variant=${variant}`;
+};
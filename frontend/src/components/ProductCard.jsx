@@ -1,6 +1,7 @@
 import React, { useRef, useState, useMemo } from 'react';
 import { motion, useMotionValue, useSpring, useTransform, useMotionTemplate } from 'framer-motion';
 import { ArrowUpRight, Sparkles } from 'lucide-react';
+import { imageSrc } from '../api';
 
 const ProductCard = ({ item, onClick, onSimilar, showAccuracy = true }) => {
     const ref = useRef(null);
@@ -103,7 +104,7 @@ const ProductCard = ({ item, onClick, onSimilar, showAccuracy = true }) => {
                 {/* Background Image - Slight zoom on hover */}
                 <div className="absolute inset-0 bg-black">
                     <img
-                        src={`data:image/jpeg;base64,${item.image_base64}`}
+                        src={imageSrc(item)}
                         alt={item.category}
                         className="w-full h-full object-cover transition-transform duration-700 group-hover:scale-110 opacity-90"
                     />
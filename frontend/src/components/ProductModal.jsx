@@ -1,6 +1,7 @@
 import React, { useMemo, useState } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { X, Heart, MessageSquare, ShieldCheck, Truck, Sparkles, ZoomIn } from 'lucide-react';
+import { imageSrc } from '../api';
 
 const ProductModal = ({ item, isOpen, onClose }) => {
     const [loupe, setLoupe] = useState({ show: false, x: 0, y: 0 });
@@ -68,7 +69,7 @@ const ProductModal = ({ item, isOpen, onClose }) => {
                             onMouseLeave={() => setLoupe({ ...loupe, show: false })}
                         >
                             <img
-                                src={`data:image/jpeg;base64,${item.image_base64}`}
+                                src={imageSrc(item, 'original')}
                                 alt={item.category}
                                 className="w-full h-full object-cover opacity-90 transition-transform duration-1000"
                             />
@@ -85,7 +86,7 @@ const ProductModal = ({ item, isOpen, onClose }) => {
                                             left: `${loupe.x}%`,
                                             top: `${loupe.y}%`,
                                             transform: 'translate(-50%, -50%)',
-                                            backgroundImage: `url(data:image/jpeg;base64,${item.image_base64})`,
+                                            backgroundImage: `url(${imageSrc(item, 'original')})`,
                                             backgroundPosition: `${loupe.x}% ${loupe.y}%`,
                                             backgroundSize: '200%', // 2x Zoom
                                             backgroundColor: '#000'